@@ -0,0 +1,92 @@
+"""
+Price filter micro-benchmark.
+
+Compares the sorted price index against a linear pass over a synthetic
+catalog the size of the real one (default 30k products):
+
+- range: "under / over / priced at $x" within a department, linear mask
+  vs binary search + slice;
+- cheapest: n cheapest in a department, full sort vs partition slice.
+
+    python bench_price_index.py --products 30000 --repeat 2000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from price_index import PriceIndex
+
+DEPARTMENTS = ["Men", "Women"]
+CATEGORIES = ["Jeans", "Outerwear & Coats", "Sweaters", "Dresses", "Tops & Tees", "Accessories"]
+
+
+def synthetic_catalog(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.lognormal(3.5, 0.8, n), 2)
+    departments = np.array(DEPARTMENTS, dtype=object)[rng.integers(0, len(DEPARTMENTS), n)]
+    categories = np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), n)]
+    return prices, departments, categories
+
+
+def timed(fn, repeat: int) -> float:
+    """Mean microseconds per call."""
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=30000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    prices, departments, categories = synthetic_catalog(args.products, args.seed)
+
+    started = time.perf_counter()
+    index = PriceIndex(prices, departments, categories)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    by_department = {d: np.flatnonzero(departments == d).astype(np.int32) for d in DEPARTMENTS}
+    men = by_department["Men"]
+
+    def linear(price, price_op):
+        p = prices[men]
+        if price_op == "under":
+            return men[p <= price]
+        if price_op == "over":
+            return men[p >= price]
+        return men[(p >= price - 0.01) & (p <= price + 0.01)]
+
+    report = {"products": args.products, "build_ms": round(build_ms, 2), "range": {}, "cheapest": {}}
+
+    for price, price_op in [(20, "under"), (100, "over"), (float(prices[men[0]]), "exact")]:
+        assert np.array_equal(np.sort(index.range(price, price_op, "Men")), linear(price, price_op))
+
+        before = timed(lambda: linear(price, price_op), args.repeat)
+        after = timed(lambda: index.range(price, price_op, "Men"), args.repeat)
+        report["range"][f"{price_op} {price}"] = {
+            "linear_us": round(before, 2),
+            "indexed_us": round(after, 2),
+            "speedup": round(before / after, 1),
+        }
+
+    for n in (5, 50):
+        before = timed(lambda: men[np.argsort(prices[men], kind="stable")[:n]], args.repeat)
+        after = timed(lambda: index.cheapest(n, "Men"), args.repeat)
+        report["cheapest"][n] = {
+            "sort_us": round(before, 2),
+            "indexed_us": round(after, 2),
+            "speedup": round(before / after, 1),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
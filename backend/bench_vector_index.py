@@ -0,0 +1,170 @@
+"""
+Vector index micro-benchmark.
+
+Builds the text-vector index over a synthetic catalog the size of the
+real one (default 30k products) and times free-text queries, a batch of
+queries, and "similar items" for a page of products.
+
+For every dimension it also reports recall@k against an exact baseline:
+the same TF-IDF features with one column per distinct feature (no
+hashing collisions) and no int8 quantization.
+
+    python bench_vector_index.py --products 30000 --repeat 200 --dims 256,1024,4096
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from search_index import tokenize
+from vector_index import DIM, FIELDS, VectorIndex, word_features
+
+WORDS = [
+    "jacket", "winter", "rain", "fleece", "denim", "coat", "tee", "dress", "hoodie", "wool",
+    "cotton", "slim", "fit", "jeans", "sweater", "cargo", "shorts", "socks", "trucker", "parka",
+]
+CATEGORIES = ["Jeans", "Outerwear & Coats", "Sweaters", "Dresses", "Tops & Tees", "Accessories"]
+
+
+def synthetic_catalog(n: int, seed: int) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "name": " ".join(rng.choice(WORDS, 4)) + f" {rng.integers(100, 999)}",
+            "brand": f"Brand {rng.integers(0, 500)}",
+            "category": str(rng.choice(CATEGORIES)),
+            "department": str(rng.choice(["Men", "Women"])),
+        }
+        for _ in range(n)
+    ]
+
+
+class ExactIndex:
+    """Unhashed, unquantized TF-IDF vectors, as a sparse (row, column, value) list."""
+
+    def __init__(self, rows: list[dict]):
+        self.columns = {}
+        entries = {}
+
+        for i, row in enumerate(rows):
+            for feature, value in self._features(row):
+                entries[i, feature] = entries.get((i, feature), 0.0) + value
+
+        self.rows = np.array([i for i, _ in entries], dtype=np.int64)
+        self.cols = np.array([c for _, c in entries], dtype=np.int64)
+        values = np.array(list(entries.values()), dtype=np.float64)
+
+        df = np.bincount(self.cols, minlength=len(self.columns))
+        self.idf = np.log((1 + len(rows)) / (1 + df)) + 1
+        values *= self.idf[self.cols]
+        norms = np.sqrt(np.bincount(self.rows, weights=values ** 2, minlength=len(rows)))
+        self.values = values / np.where(norms == 0, 1, norms)[self.rows]
+        self.n = len(rows)
+
+    def _column(self, feature: str, learn: bool) -> int | None:
+        column = self.columns.get(feature)
+        if column is None and learn:
+            column = self.columns[feature] = len(self.columns)
+        return column
+
+    def _features(self, row: dict, learn: bool = True):
+        for field, weight in FIELDS:
+            for word in tokenize(row.get(field)):
+                for feature, value in word_features(word, field == "name"):
+                    column = self._column(feature, learn)
+                    if column is not None:
+                        yield column, weight * value
+
+    def scores(self, text: str) -> np.ndarray:
+        """Exact cosine of every product against `text`."""
+        query = np.zeros(len(self.columns))
+        for column, value in self._features({"name": text}, learn=False):
+            query[column] += value
+        query *= self.idf
+        query /= np.linalg.norm(query) or 1
+        return np.bincount(self.rows, weights=self.values * query[self.cols], minlength=self.n)
+
+
+def recall(index: VectorIndex, exact: ExactIndex, queries: list[str], k: int) -> tuple[float, float]:
+    """
+    (recall@k, score ratio) against the exact index. Recall is the share
+    of the returned top k that belongs in the exact top k; any product
+    scoring at least the exact k-th best counts, since names tie a lot.
+    The score ratio is the exact score of what was returned over the
+    exact top k's: how much worse the misses are.
+    """
+    found = 0
+    returned = best = 0.0
+    scores = index.scores(index.encode(queries))
+    for j, query in enumerate(queries):
+        truth = exact.scores(query)
+        top = np.partition(truth, len(truth) - k)[len(truth) - k:]
+        approx = [i for i, _ in VectorIndex.top_k(scores[:, j], k)]
+        found += int(np.count_nonzero(truth[approx] >= top.min() - 1e-9))
+        returned += truth[approx].sum()
+        best += top.sum()
+    return found / (k * len(queries)), returned / best
+
+
+def timed(fn, repeat: int) -> float:
+    """Mean milliseconds per call."""
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=30000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--dims", default=f"256,{DIM},4096", help="comma-separated vector dimensions")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    rows = synthetic_catalog(args.products, args.seed)
+    # Catalog names, some with a dropped letter: the typo case trigrams are for
+    rng = np.random.default_rng(args.seed + 1)
+    queries = []
+    for row in rng.choice(rows, args.queries):
+        words = row["name"].split()[:3]
+        if rng.random() < 0.5:
+            cut = int(rng.integers(1, len(words[0])))
+            words[0] = words[0][:cut] + words[0][cut + 1:]
+        queries.append(" ".join(words))
+
+    started = time.perf_counter()
+    exact = ExactIndex(rows)
+    results = {
+        "products": args.products,
+        "exact_features": len(exact.columns),
+        "exact_build_s": round(time.perf_counter() - started, 2),
+        "dims": [],
+    }
+
+    for dim in (int(d) for d in args.dims.split(",")):
+        started = time.perf_counter()
+        index = VectorIndex(rows, dim=dim)
+        build_s = time.perf_counter() - started
+        found, ratio = recall(index, exact, queries, args.k)
+
+        results["dims"].append({
+            "dim": dim,
+            "matrix_bytes": int(index.matrix.nbytes),
+            "build_s": round(build_s, 2),
+            f"recall_at_{args.k}": round(found, 4),
+            "exact_score_ratio": round(ratio, 4),
+            "search_ms": round(timed(lambda: index.search(["winter denim jackt"], 10), args.repeat), 3),
+            "search_batch_8_ms": round(timed(lambda: index.search(["winter denim jacket"] * 8, 10), args.repeat), 3),
+            "similar_ms": round(timed(lambda: index.similar(list(range(5)), 10), args.repeat), 3),
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
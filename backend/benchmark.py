@@ -0,0 +1,274 @@
+"""
+End-to-end /chat benchmark.
+
+Replays the conversations in search_guide.txt, plus synthetic
+variations of them, against the FastAPI app in-process with the local
+catalog backend (no BigQuery, no network). Each virtual shopper has its
+own session and walks through its script in order; `--concurrency`
+shoppers run at once.
+
+    python benchmark.py --requests 2000 --concurrency 16 --out bench.json
+
+The report is JSON (p50/p95/p99 latency, requests per second, and the
+same per intent) so runs can be diffed over time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+GUIDE = HERE.parent / "search_guide.txt"
+
+# Rows of the markdown table quote the message in backticks
+TABLE_MESSAGE_RE = re.compile(r"^\|\s*`([^`]+)`")
+
+CATEGORIES = ["jackets", "winter jackets", "pants", "hoodies", "sweaters", "shirts", "coats", "dresses"]
+SIZES = ["small", "medium", "large", "xl"]
+RECIPIENTS = ["girlfriend", "father", "mother", "brother", "sister", "wife", "husband", "parents"]
+PRICES = [4, 10, 25, 40, 60, 100]
+
+SYNTHETIC_TEMPLATES = [
+    "Show me {category} under ${price}",
+    "Show me {category} over ${price} and {size}",
+    "Show me ${price} {category}",
+    "Do you have {category} in {size}?",
+    "I need a gift for my {recipient}",
+    "Show me {category} under ${price} for my {recipient}",
+    "show {count} nearest stores",
+    "closest store with {category}",
+    "closest store with {category} under ${price}",
+    "cheapest store nearby",
+    "stores within {radius} km",
+    "store details {store}",
+    "search store {store}",
+    "compare {category}",
+]
+
+QUICK_REPLIES = ["increase budget", "remove size filter", "show similar items"]
+
+
+def load_guide_messages(path: Path = GUIDE) -> list[str]:
+    messages = []
+
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or set(line) <= set("|- "):
+            continue
+
+        if line.startswith("|"):
+            match = TABLE_MESSAGE_RE.match(line)
+            if match:
+                messages.append(match.group(1))
+            continue
+
+        messages.append(line)
+
+    return messages
+
+
+def synthetic_messages(rng: random.Random, count: int) -> list[str]:
+    messages = []
+
+    for _ in range(count):
+        template = rng.choice(SYNTHETIC_TEMPLATES)
+        messages.append(template.format(
+            category=rng.choice(CATEGORIES),
+            size=rng.choice(SIZES),
+            recipient=rng.choice(RECIPIENTS),
+            price=rng.choice(PRICES),
+            count=rng.randint(1, 8),
+            radius=rng.choice([50, 200, 800, 2000]),
+            store=rng.randint(1, 10),
+        ))
+
+        # Follow searches with a quick reply, like the UI does
+        if "$" in messages[-1] and rng.random() < 0.3:
+            messages.append(rng.choice(QUICK_REPLIES))
+
+    return messages
+
+
+def build_scripts(guide: list[str], shoppers: int, per_shopper: int, seed: int) -> list[list[str]]:
+    """One script per shopper: the guide (rotated) mixed with variations."""
+    rng = random.Random(seed)
+    scripts = []
+
+    for i in range(shoppers):
+        offset = i % len(guide) if guide else 0
+        script = guide[offset:] + guide[:offset]
+        script += synthetic_messages(rng, max(per_shopper - len(script), 0))
+        scripts.append(script[:per_shopper])
+
+    return scripts
+
+
+def classify(message: str) -> str:
+    from message_parser import parse_message, route
+
+    return route(parse_message(message))
+
+
+def summarize(latencies_ms: list[float], duration_s: float, errors: int = 0) -> dict:
+    if not latencies_ms:
+        return {"requests": 0, "errors": errors}
+
+    values = np.asarray(latencies_ms)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rps": round(len(values) / duration_s, 2) if duration_s else None,
+        "latency_ms": {
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "mean": round(float(values.mean()), 3),
+            "max": round(float(values.max()), 3),
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(
+    requests: int = 1000,
+    concurrency: int = 8,
+    per_shopper: int = 40,
+    warmup: int = 50,
+    seed: int = 7,
+    user_id: int | None = None
+) -> dict:
+    import httpx
+    from main import app
+
+    guide = load_guide_messages()
+    shoppers = max(1, -(-requests // per_shopper))
+    scripts = build_scripts(guide, shoppers, per_shopper, seed)
+
+    transport = httpx.ASGITransport(app=app)
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    queue = asyncio.Queue()
+
+    for i, script in enumerate(scripts):
+        queue.put_nowait((f"bench-shopper-{i:05d}", script))
+
+    sent = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def send(session_id: str, message: str, record: bool):
+            headers = {"X-Session-Id": session_id}
+            if user_id is not None:
+                headers["X-User-Id"] = str(user_id)
+
+            start = time.perf_counter()
+            res = await client.get("/chat", params={"message": message}, headers=headers)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            if record:
+                intent = classify(message)
+                samples[intent].append(elapsed)
+                if res.status_code != 200:
+                    errors[intent] += 1
+
+        # Warm caches, the snapshot and the parser like a running server
+        for message in guide[:warmup]:
+            await send("bench-warmup", message, record=False)
+
+        async def shopper():
+            nonlocal sent
+
+            while not queue.empty():
+                session_id, script = queue.get_nowait()
+                for message in script:
+                    if sent >= requests:
+                        return
+                    sent += 1
+                    await send(session_id, message, record=True)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(shopper() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+
+    all_latencies = [v for values in samples.values() for v in values]
+
+    return {
+        "config": {
+            "requests": requests,
+            "concurrency": concurrency,
+            "per_shopper": per_shopper,
+            "warmup": warmup,
+            "seed": seed,
+            "catalog_backend": os.getenv("CATALOG_BACKEND"),
+            "catalog_data_dir": os.getenv("CATALOG_DATA_DIR"),
+        },
+        "environment": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "duration_s": round(duration, 3),
+        "total": summarize(all_latencies, duration, sum(errors.values())),
+        "intents": {
+            intent: summarize(values, duration, errors[intent])
+            for intent, values in sorted(samples.items())
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark /chat end to end")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-shopper", type=int, default=40, help="messages per simulated session")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--user-id", type=int, default=None)
+    parser.add_argument("--data-dir", default=str(HERE / "tests" / "data"), help="local catalog CSVs")
+    parser.add_argument("--out", help="write the JSON report here as well")
+    args = parser.parse_args(argv)
+
+    # Always the local backend: benchmarks must not depend on BigQuery
+    os.environ["CATALOG_BACKEND"] = "local"
+    os.environ["CATALOG_DATA_DIR"] = args.data_dir
+    os.environ.setdefault("USER_ID", "1")
+    sys.path.insert(0, str(HERE))
+
+    report = asyncio.run(run_benchmark(
+        requests=args.requests,
+        concurrency=args.concurrency,
+        per_shopper=args.per_shopper,
+        warmup=args.warmup,
+        seed=args.seed,
+        user_id=args.user_id,
+    ))
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+In-process TTL + LRU cache.
+
+Entries expire after `ttl` seconds and the least recently used ones are
+evicted once either `max_entries` or `max_bytes` is exceeded. Sizes are
+estimated from the JSON encoding of each value, which is close to what
+the entry costs us to rebuild and to send.
+"""
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+def estimate_size(value) -> int:
+    # Objects that know their own footprint (e.g. paged result sets) say so
+    if hasattr(value, "estimated_size"):
+        return value.estimated_size()
+    return len(json.dumps(value, default=str))
+
+
+class TTLCache:
+    def __init__(
+        self,
+        ttl: float = 300,
+        max_entries: int = 1024,
+        max_bytes: int | None = None,
+        clock=time.monotonic
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._entries = OrderedDict()   # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, size, value = entry
+            if expires_at <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        size = estimate_size(value) if self.max_bytes else 0
+
+        # Never let a single oversized value flush the whole cache, but
+        # don't keep serving the value it was meant to replace either
+        if self.max_bytes and size > self.max_bytes:
+            self.delete(key)
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> int:
+        with self._lock:
+            flushed = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return flushed
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+# Cached marker for ids the backing store doesn't know
+NOT_FOUND = "__not_found__"
+_UNSEEN = object()
+
+
+class BatchedLoader(ABC):
+    """
+    Rows by id through a TTLCache. Ids missing from the cache are
+    fetched together in one `fetch(ids)` call; ids the fetch doesn't
+    return are cached as NOT_FOUND for `negative_ttl`, so a bad id can't
+    turn into a query per request. Subclasses implement `fetch`.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        negative_ttl: float,
+        max_entries: int,
+        clock=time.monotonic
+    ):
+        self.negative_ttl = negative_ttl
+        self.lookups = 0
+        self._cache = TTLCache(ttl=ttl, max_entries=max_entries, clock=clock)
+
+    @abstractmethod
+    async def fetch(self, ids: list[int]) -> list[dict]:
+        """Rows for `ids` from the backing store; unknown ids are left out."""
+
+    async def get_many(self, ids, fresh: bool = False) -> dict[int, dict]:
+        """
+        Rows by id; unknown ids are left out. At most one fetch.
+        `fresh` skips the cache and refetches every id (refreshing it).
+        """
+        wanted = list(dict.fromkeys(int(i) for i in ids))
+        if fresh:
+            return await self._load(wanted) if wanted else {}
+
+        found = {}
+        missing = []
+
+        for key in wanted:
+            cached = self._cache.get(key, _UNSEEN)
+            if cached is _UNSEEN:
+                missing.append(key)
+            elif cached != NOT_FOUND:
+                found[key] = cached
+
+        if missing:
+            found.update(await self._load(missing))
+
+        return found
+
+    async def get(self, key: int) -> dict | None:
+        return (await self.get_many([key])).get(int(key))
+
+    async def _load(self, ids: list[int]) -> dict[int, dict]:
+        rows = {row["id"]: row for row in await self.fetch(ids)}
+        self.lookups += 1
+
+        for key in ids:
+            if key in rows:
+                self._cache.set(key, rows[key])
+            else:
+                self._cache.set(key, NOT_FOUND, ttl=self.negative_ttl)
+
+        return rows
+
+    def invalidate(self, key: int | None = None) -> int:
+        if key is None:
+            return self._cache.clear()
+
+        self._cache.delete(key)
+        return 1
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "negative_ttl_seconds": self.negative_ttl,
+        }
@@ -0,0 +1,92 @@
+"""
+Server-side shopping cart.
+
+The cart lives in the chat session state as a list of
+{"product_id", "quantity", "price"} items, where `price` is the price
+the shopper was last shown. Every read revalidates the whole cart
+against current catalog prices in one pass (one batched product
+lookup): items whose price moved are repriced and reported, items that
+no longer exist are dropped and reported.
+"""
+MAX_QUANTITY = 99
+
+# Product columns that stay server-side (checkout records them on the order)
+PRIVATE_FIELDS = ("cost",)
+
+
+def cart_items(state: dict) -> list[dict]:
+    # Sessions saved before carts existed have no "cart" key
+    return state.setdefault("cart", [])
+
+
+def add_item(state: dict, product: dict, quantity: int = 1) -> dict:
+    items = cart_items(state)
+
+    for item in items:
+        if item["product_id"] == product["id"]:
+            item["quantity"] = min(item["quantity"] + quantity, MAX_QUANTITY)
+            item["price"] = product["retail_price"]
+            return item
+
+    item = {
+        "product_id": product["id"],
+        "quantity": min(quantity, MAX_QUANTITY),
+        "price": product["retail_price"],
+    }
+    items.append(item)
+    return item
+
+
+def remove_item(state: dict, product_id: int) -> bool:
+    items = cart_items(state)
+    kept = [i for i in items if i["product_id"] != product_id]
+    removed = len(kept) != len(items)
+    items[:] = kept
+    return removed
+
+
+async def revalidate(state: dict, products, fresh: bool = False) -> dict:
+    """
+    Cart view with current prices. `products` is a ProductCache;
+    `fresh` reads past it, for the prices actually charged.
+    Updates the stored prices, so each change is reported once.
+    """
+    items = cart_items(state)
+    current = await products.get_many((i["product_id"] for i in items), fresh=fresh)
+
+    lines = []
+    changes = []
+    kept = []
+
+    for item in items:
+        product = current.get(item["product_id"])
+
+        if product is None:
+            changes.append({"product_id": item["product_id"], "change": "unavailable"})
+            continue
+
+        price = product["retail_price"]
+        if price != item["price"]:
+            changes.append({
+                "product_id": item["product_id"],
+                "change": "price",
+                "old_price": item["price"],
+                "new_price": price,
+            })
+            item["price"] = price
+
+        kept.append(item)
+        lines.append({
+            **{k: v for k, v in product.items() if k not in PRIVATE_FIELDS},
+            "quantity": item["quantity"],
+            "line_total": round(price * item["quantity"], 2),
+        })
+
+    items[:] = kept
+
+    return {
+        "cart": lines,
+        "count": sum(line["quantity"] for line in lines),
+        "total": round(sum(line["line_total"] for line in lines), 2),
+        "changes": changes,
+    }
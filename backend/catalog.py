@@ -0,0 +1,687 @@
+"""
+Catalog backends.
+
+Every query the chat endpoint needs goes through a CatalogBackend so the
+same handlers can run against:
+
+- "bigquery" (default): the public `thelook_ecommerce` dataset
+- "local": an in-memory SQLite copy of a CSV snapshot, for fast
+  searches and fully offline runs (CI, demos)
+
+Pick one with CATALOG_BACKEND. The local backend reads
+products.csv, distribution_centers.csv and users.csv from
+CATALOG_DATA_DIR; build them with `python catalog.py export <dir>`.
+
+All query methods are coroutines. BigQuery jobs are submitted and then
+polled with asyncio sleeps in between, so a slow job never pins a
+worker thread, and at most BQ_MAX_CONCURRENT_QUERIES jobs are in flight
+at once (extra callers wait in FIFO order).
+"""
+import asyncio
+import collections
+import csv
+import json
+import os
+import sqlite3
+import threading
+from contextlib import nullcontext
+
+from google.cloud import bigquery
+
+import metrics
+from cost_guard import CostGuard, QueryBudgetExceeded, current_intent, parse_budgets
+from query_plan import (
+    PRODUCT_COLUMNS,
+    PRODUCT_LOOKUP_COLUMNS,
+    Dialect,
+    ProductFilter,
+    QueryStats,
+    compile_product_search,
+    compile_store_ids,
+    fingerprint,
+)
+
+DATASET = "bigquery-public-data.thelook_ecommerce"
+
+BIGQUERY_DIALECT = Dialect(
+    "bigquery",
+    products=f"`{DATASET}.products`",
+    distribution_centers=f"`{DATASET}.distribution_centers`",
+    prefix="@",
+)
+SQLITE_DIALECT = Dialect(
+    "sqlite",
+    products="products",
+    distribution_centers="distribution_centers",
+    prefix=":",
+)
+
+SNAPSHOT_TABLES = {
+    "products": {
+        "id": "INTEGER",
+        "cost": "REAL",
+        "category": "TEXT",
+        "name": "TEXT",
+        "brand": "TEXT",
+        "retail_price": "REAL",
+        "department": "TEXT",
+        "sku": "TEXT",
+        "distribution_center_id": "INTEGER",
+    },
+    "distribution_centers": {
+        "id": "INTEGER",
+        "name": "TEXT",
+        "latitude": "REAL",
+        "longitude": "REAL",
+    },
+    "users": {
+        "id": "INTEGER",
+        "first_name": "TEXT",
+        "last_name": "TEXT",
+        "email": "TEXT",
+        "age": "INTEGER",
+        "gender": "TEXT",
+        "state": "TEXT",
+        "street_address": "TEXT",
+        "postal_code": "TEXT",
+        "city": "TEXT",
+        "country": "TEXT",
+        "latitude": "REAL",
+        "longitude": "REAL",
+        "traffic_source": "TEXT",
+        "created_at": "TEXT",
+    },
+}
+
+# Job polling backoff (seconds)
+POLL_INITIAL_DELAY = 0.05
+POLL_MAX_DELAY = 1.0
+
+
+class QueryLimiter:
+    """
+    Caps the number of in-flight queries.
+
+    Unlike a bare semaphore, a released slot is handed straight to the
+    oldest waiter, so late arrivals can never overtake the queue.
+    """
+
+    def __init__(self, max_in_flight: int):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._waiters = collections.deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    async def acquire(self):
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot may have been handed over right before we were
+            # cancelled; pass it on instead of leaking it.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class CatalogBackend:
+    """
+    Interface shared by all catalog backends.
+
+    Rows come back as plain dicts (or bare ids) so callers never depend
+    on the row type of the underlying engine. Distances are not computed
+    here; geo.StoreIndex ranks the returned center ids.
+    """
+
+    name = "base"
+
+    async def get_user(self, user_id: int) -> dict | None:
+        raise NotImplementedError
+
+    async def get_users(self, user_ids: list[int]) -> list[dict]:
+        raise NotImplementedError
+
+    async def get_products(self, product_ids: list[int]) -> list[dict]:
+        raise NotImplementedError
+
+    async def distribution_centers(self):
+        raise NotImplementedError
+
+    async def all_products(self):
+        raise NotImplementedError
+
+    async def stores_with_product(self, product_keyword: str) -> list[int]:
+        raise NotImplementedError
+
+    async def stores_matching(self, filters: dict, exclude_department=None) -> list[int]:
+        raise NotImplementedError
+
+    async def search_products(
+        self,
+        price=None,
+        price_op=None,
+        department=None,
+        size=None,
+        category=None,
+        limit: int = 5
+    ):
+        raise NotImplementedError
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls.
+
+    The first caller for a key starts the work as its own task; callers
+    arriving before it finishes await the same task instead of starting
+    another. A cancelled caller doesn't cancel the shared work.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.coalesced = 0
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    async def do(self, key, fn):
+        """Returns (result, coalesced)."""
+        task = self._calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.started += 1
+            return await asyncio.shield(task), False
+
+        self.coalesced += 1
+        return await asyncio.shield(task), True
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+# -------------------------
+# BIGQUERY
+# -------------------------
+class BigQueryCatalog(CatalogBackend):
+    name = "bigquery"
+
+    def __init__(self, project: str | None = None, max_in_flight: int = 20, cost_guard: CostGuard | None = None):
+        self.client = bigquery.Client(project=project)
+        self.cost_guard = cost_guard or CostGuard()
+        self.limiter = QueryLimiter(max_in_flight)
+        self.inflight = SingleFlight()
+        self.query_stats = QueryStats()
+
+    async def _rows(self, query: str, params=None, query_fingerprint: str | None = None):
+        # Identical concurrent queries (same SQL, same parameters) share one job
+        query_fingerprint = query_fingerprint or fingerprint(query)
+        key = (
+            query_fingerprint,
+            json.dumps([p.to_api_repr() for p in params or []], sort_keys=True, default=str),
+        )
+
+        with metrics.stage("query_coalesced") if key in self.inflight else nullcontext():
+            rows, coalesced = await self.inflight.do(
+                key, lambda: self._execute(query, params, query_fingerprint)
+            )
+
+        if coalesced:
+            self.query_stats.record_coalesced(query_fingerprint, query)
+            metrics.COALESCED_QUERIES.inc()
+
+        # Callers get their own list; the row dicts are shared read-only
+        return list(rows)
+
+    async def _execute(self, query: str, params, query_fingerprint: str):
+        intent = current_intent()
+        job_config = self.cost_guard.job_config(params)
+
+        with metrics.stage("query_queue"):
+            await self.limiter.acquire()
+
+        try:
+            if self.cost_guard.dry_run:
+                with metrics.stage("query_dry_run"):
+                    await asyncio.to_thread(
+                        self.cost_guard.check,
+                        self.client, query, params, query_fingerprint, intent
+                    )
+
+            with metrics.stage("query_submit"):
+                job = await asyncio.to_thread(
+                    self.client.query, query, job_config=job_config
+                )
+
+            # Only the short status RPCs run in a thread; the wait between
+            # them is an asyncio sleep.
+            with metrics.stage("query_wait"):
+                delay = POLL_INITIAL_DELAY
+                while not await asyncio.to_thread(job.done):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, POLL_MAX_DELAY)
+
+            # maximum_bytes_billed tripped: same outcome as a refused dry run
+            error = getattr(job, "error_result", None) or {}
+            if error.get("reason") == "bytesBilledLimitExceeded":
+                self.cost_guard.refused(intent)
+                raise QueryBudgetExceeded(intent, None, self.cost_guard.max_bytes_billed)
+
+            self.query_stats.record(
+                query_fingerprint,
+                query,
+                getattr(job, "cache_hit", None)
+            )
+            self.cost_guard.record(job, intent)
+
+            def fetch():
+                with metrics.stage("query_result"):
+                    rows = list(job.result())
+                with metrics.stage("row_convert"):
+                    return [dict(row) for row in rows]
+
+            return await asyncio.to_thread(fetch)
+        finally:
+            self.limiter.release()
+
+    USER_COLUMNS = """
+          id,
+          first_name,
+          last_name,
+          email,
+          age,
+          gender,
+          state,
+          street_address,
+          postal_code,
+          city,
+          country,
+          latitude,
+          longitude,
+          traffic_source,
+          created_at,
+          user_geom
+    """
+
+    async def get_user(self, user_id: int) -> dict | None:
+        query = f"""
+        SELECT {self.USER_COLUMNS}
+        FROM `{DATASET}.users`
+        WHERE id = @user_id
+        LIMIT 1
+        """
+
+        rows = await self._rows(query, [
+            bigquery.ScalarQueryParameter("user_id", "INT64", user_id)
+        ])
+        return rows[0] if rows else None
+
+    async def get_users(self, user_ids: list[int]) -> list[dict]:
+        if not user_ids:
+            return []
+
+        query = f"""
+        SELECT {self.USER_COLUMNS}
+        FROM `{DATASET}.users`
+        WHERE id IN UNNEST(@user_ids)
+        """
+
+        return await self._rows(query, [
+            bigquery.ArrayQueryParameter("user_ids", "INT64", list(user_ids))
+        ])
+
+    async def get_products(self, product_ids: list[int]) -> list[dict]:
+        if not product_ids:
+            return []
+
+        query = f"""
+        SELECT {PRODUCT_LOOKUP_COLUMNS}
+        FROM `{DATASET}.products` p
+        LEFT JOIN `{DATASET}.distribution_centers` dc ON p.distribution_center_id = dc.id
+        WHERE p.id IN UNNEST(@product_ids)
+        """
+
+        return await self._rows(query, [
+            bigquery.ArrayQueryParameter("product_ids", "INT64", list(product_ids))
+        ])
+
+    async def distribution_centers(self):
+        query = f"""
+        SELECT id, name, latitude, longitude
+        FROM `{DATASET}.distribution_centers`
+        """
+
+        return await self._rows(query)
+
+    async def all_products(self):
+        columns = ", ".join(SNAPSHOT_TABLES["products"])
+        return await self._rows(f"SELECT {columns} FROM `{DATASET}.products`")
+
+    async def _run(self, compiled):
+        params = [
+            bigquery.ArrayQueryParameter(p.name, p.type, p.value)
+            if p.array else
+            bigquery.ScalarQueryParameter(p.name, p.type, p.value)
+            for p in compiled.params
+        ]
+        return await self._rows(compiled.sql, params, compiled.fingerprint)
+
+    async def stores_with_product(self, product_keyword: str) -> list[int]:
+        compiled = compile_store_ids(
+            ProductFilter.build(product=product_keyword), BIGQUERY_DIALECT
+        )
+        return [r["id"] for r in await self._run(compiled)]
+
+    async def stores_matching(self, filters: dict, exclude_department=None) -> list[int]:
+        compiled = compile_store_ids(
+            ProductFilter.build(
+                product=filters["product"],
+                category=filters["category"],
+                size=filters["size"],
+                price=filters["price"],
+                price_op=filters["price_op"],
+                department=filters["department"],
+                exclude_department=exclude_department,
+            ),
+            BIGQUERY_DIALECT
+        )
+        return [r["id"] for r in await self._run(compiled)]
+
+    async def search_products(
+        self,
+        price=None,
+        price_op=None,
+        department=None,
+        size=None,
+        category=None,
+        limit: int = 5
+    ):
+        compiled = compile_product_search(
+            ProductFilter.build(
+                category=category,
+                size=size,
+                price=price,
+                price_op=price_op,
+                department=department,
+                # Single-department searches drop opposite-gender names
+                exclude_department=department if isinstance(department, str) else None,
+            ),
+            BIGQUERY_DIALECT,
+            limit=limit
+        )
+        return await self._run(compiled)
+
+    async def export_snapshot(self, out_dir: str, user_ids=()):
+        """
+        Dump the tables the local backend needs into CSV files.
+        Only the requested users are exported; the full users table is large.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+
+        for table, columns in SNAPSHOT_TABLES.items():
+            query = f"SELECT {', '.join(columns)} FROM `{DATASET}.{table}`"
+            params = []
+
+            if table == "users":
+                if not user_ids:
+                    continue
+                query += " WHERE id IN UNNEST(@user_ids)"
+                params.append(
+                    bigquery.ArrayQueryParameter("user_ids", "INT64", list(user_ids))
+                )
+
+            rows = await self._rows(query, params)
+
+            with open(os.path.join(out_dir, f"{table}.csv"), "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(columns))
+                writer.writeheader()
+                writer.writerows(rows)
+
+
+# -------------------------
+# LOCAL (SQLite)
+# -------------------------
+class LocalCatalog(CatalogBackend):
+    """
+    SQLite in-memory copy of a CSV snapshot.
+    The whole catalog fits in a few MB, so every query is a local scan
+    that finishes in milliseconds.
+    """
+
+    name = "local"
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.query_stats = QueryStats()
+
+        for table, columns in SNAPSHOT_TABLES.items():
+            self._load_table(table, columns)
+
+        self.conn.execute(
+            "CREATE INDEX idx_products_dc ON products (distribution_center_id)"
+        )
+
+    def _load_table(self, table: str, columns: dict):
+        ddl = ", ".join(f"{c} {t}" for c, t in columns.items())
+        self.conn.execute(f"CREATE TABLE {table} ({ddl})")
+
+        path = os.path.join(self.data_dir, f"{table}.csv")
+        if not os.path.exists(path):
+            if table == "users":
+                return
+            raise RuntimeError(f"Catalog snapshot file not found: {path}")
+
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            names = [c for c in columns if c in reader.fieldnames]
+            rows = [
+                [_cast(row[c], columns[c]) for c in names]
+                for row in reader
+            ]
+
+        placeholders = ", ".join("?" for _ in names)
+        self.conn.executemany(
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({placeholders})",
+            rows
+        )
+
+    async def _rows(self, query: str, params=None, query_fingerprint: str | None = None):
+        self.query_stats.record(query_fingerprint or fingerprint(query), query)
+
+        # In-memory queries finish in milliseconds, cheaper than a thread hop
+        with self.lock:
+            with metrics.stage("query"):
+                rows = self.conn.execute(query, params or {}).fetchall()
+            with metrics.stage("row_convert"):
+                return [dict(row) for row in rows]
+
+    async def get_user(self, user_id: int) -> dict | None:
+        rows = await self._rows(
+            "SELECT * FROM users WHERE id = :user_id LIMIT 1",
+            {"user_id": user_id}
+        )
+        return rows[0] if rows else None
+
+    async def get_users(self, user_ids: list[int]) -> list[dict]:
+        if not user_ids:
+            return []
+
+        params = {f"id{i}": int(u) for i, u in enumerate(user_ids)}
+        placeholders = ", ".join(f":{k}" for k in params)
+        return await self._rows(
+            f"SELECT * FROM users WHERE id IN ({placeholders})", params
+        )
+
+    async def get_products(self, product_ids: list[int]) -> list[dict]:
+        if not product_ids:
+            return []
+
+        params = {f"id{i}": int(p) for i, p in enumerate(product_ids)}
+        placeholders = ", ".join(f":{k}" for k in params)
+        return await self._rows(
+            f"SELECT {PRODUCT_LOOKUP_COLUMNS}\n"
+            "FROM products p\n"
+            "LEFT JOIN distribution_centers dc ON p.distribution_center_id = dc.id\n"
+            f"WHERE p.id IN ({placeholders})",
+            params
+        )
+
+    async def distribution_centers(self):
+        return await self._rows(
+            "SELECT id, name, latitude, longitude FROM distribution_centers"
+        )
+
+    async def all_products(self):
+        return await self._rows("SELECT * FROM products")
+
+    async def _run(self, compiled):
+        params = {p.name: p.value for p in compiled.params}
+        return await self._rows(compiled.sql, params, compiled.fingerprint)
+
+    async def stores_with_product(self, product_keyword: str) -> list[int]:
+        compiled = compile_store_ids(
+            ProductFilter.build(product=product_keyword), SQLITE_DIALECT
+        )
+        return [r["id"] for r in await self._run(compiled)]
+
+    async def stores_matching(self, filters: dict, exclude_department=None) -> list[int]:
+        compiled = compile_store_ids(
+            ProductFilter.build(
+                product=filters["product"],
+                category=filters["category"],
+                size=filters["size"],
+                price=filters["price"],
+                price_op=filters["price_op"],
+                department=filters["department"],
+                exclude_department=exclude_department,
+            ),
+            SQLITE_DIALECT
+        )
+        return [r["id"] for r in await self._run(compiled)]
+
+    async def search_products(
+        self,
+        price=None,
+        price_op=None,
+        department=None,
+        size=None,
+        category=None,
+        limit: int = 5
+    ):
+        compiled = compile_product_search(
+            ProductFilter.build(
+                category=category,
+                size=size,
+                price=price,
+                price_op=price_op,
+                department=department,
+                exclude_department=department if isinstance(department, str) else None,
+            ),
+            SQLITE_DIALECT,
+            limit=limit
+        )
+        return await self._run(compiled)
+
+
+def _cast(value: str, sql_type: str):
+    if value == "" or value is None:
+        return None
+    if sql_type == "INTEGER":
+        return int(float(value))
+    if sql_type == "REAL":
+        return float(value)
+    return value
+
+
+def get_catalog() -> CatalogBackend:
+    backend = os.getenv("CATALOG_BACKEND", "bigquery").lower()
+
+    if backend == "bigquery":
+        max_bytes_billed = os.getenv("BQ_MAX_BYTES_BILLED")
+        default_budget = os.getenv("BQ_QUERY_BUDGET_BYTES")
+
+        return BigQueryCatalog(
+            project=os.getenv("GOOGLE_CLOUD_PROJECT"),
+            max_in_flight=int(os.getenv("BQ_MAX_CONCURRENT_QUERIES", "20")),
+            cost_guard=CostGuard(
+                max_bytes_billed=int(float(max_bytes_billed)) if max_bytes_billed else None,
+                dry_run=os.getenv("BQ_DRY_RUN", "0") == "1",
+                default_budget=int(float(default_budget)) if default_budget else None,
+                intent_budgets=parse_budgets(os.getenv("BQ_INTENT_BUDGETS")),
+            )
+        )
+
+    if backend == "local":
+        data_dir = os.getenv("CATALOG_DATA_DIR")
+        if not data_dir:
+            raise RuntimeError(
+                "CATALOG_DATA_DIR must point to a catalog snapshot "
+                "when CATALOG_BACKEND=local."
+            )
+        return LocalCatalog(data_dir)
+
+    raise RuntimeError(
+        f"Unknown CATALOG_BACKEND '{backend}'. Use 'bigquery' or 'local'."
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Catalog snapshot tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Export a BigQuery snapshot to CSV")
+    export.add_argument("out_dir")
+    export.add_argument("--user-id", type=int, action="append", default=[])
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        asyncio.run(
+            BigQueryCatalog(project=os.getenv("GOOGLE_CLOUD_PROJECT")).export_snapshot(
+                args.out_dir,
+                user_ids=args.user_id
+            )
+        )
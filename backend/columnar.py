@@ -0,0 +1,422 @@
+"""
+Columnar catalog snapshot file.
+
+`products` and `distribution_centers` are written once into a compact
+file that every worker process maps read-only, so a worker boots without
+a single catalog query:
+
+- numbers are fixed-width little-endian arrays (NaN / -1 for NULL);
+- brand, category and department are dictionary-encoded (int32 codes
+  into a small list of distinct values);
+- names and other free text are an offsets array plus one UTF-8 blob.
+
+The derived arrays the chat snapshot searches with (the sorted price
+partitions, the ranking features and the quantized text-vector matrix)
+are computed at build time and stored too. A worker uses those, and the
+numeric product columns, as views over the mapping, so the OS keeps one
+copy of them no matter how many workers run. Row records, name postings
+and the name resolver are still built per worker.
+
+Layout: 8-byte magic, 8-byte header length, JSON header (tables,
+columns, dictionaries, indexes, byte offsets), then the 8-byte aligned
+arrays.
+
+    python columnar.py build catalog.snap --from-dir ./data     # CSV or Parquet
+    python columnar.py build catalog.snap --from-bigquery
+    python columnar.py info catalog.snap                         # startup time, RSS
+
+Point SNAPSHOT_FILE at the result to load the in-memory snapshot from it.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from price_index import PriceIndex
+from ranking import Ranker
+from search_index import ProductIndex
+from vector_index import DIM, VectorIndex
+
+MAGIC = b"CATSNAP1"
+
+# Column kinds per table: "int" (int64, -1 = NULL), "float" (float64,
+# NaN = NULL), "dict" (int32 codes, -1 = NULL), "text" (offsets + blob)
+SCHEMA = {
+    "products": {
+        "id": "int",
+        "cost": "float",
+        "category": "dict",
+        "name": "text",
+        "brand": "dict",
+        "retail_price": "float",
+        "department": "dict",
+        "sku": "text",
+        "distribution_center_id": "int",
+    },
+    "distribution_centers": {
+        "id": "int",
+        "name": "text",
+        "latitude": "float",
+        "longitude": "float",
+    },
+}
+
+ALIGN = 8
+
+
+def _data_start(header_length: int) -> int:
+    start = len(MAGIC) + 8 + header_length
+    return start + -start % ALIGN
+
+
+def _encode_column(kind: str, values: list) -> tuple[list[np.ndarray], dict]:
+    """Arrays to write for one column, plus its header entry."""
+    if kind == "int":
+        return [np.array([-1 if v is None else int(v) for v in values], dtype="<i8")], {}
+
+    if kind == "float":
+        return [np.array([np.nan if v is None else float(v) for v in values], dtype="<f8")], {}
+
+    if kind == "dict":
+        dictionary = sorted({v for v in values if v is not None})
+        codes = {v: i for i, v in enumerate(dictionary)}
+        return [np.array([-1 if v is None else codes[v] for v in values], dtype="<i4")], {
+            "dictionary": dictionary
+        }
+
+    # text: NULL is stored as an empty string with a cleared validity bit
+    encoded = [b"" if v is None else str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    valid = np.array([v is not None for v in values], dtype=np.uint8)
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return [offsets, valid, blob], {}
+
+
+def build_indexes(tables: dict[str, list[dict]], vector_dim: int = DIM) -> dict[str, tuple[dict, dict]]:
+    """(arrays, meta) of each derived index, built the way CatalogSnapshot builds them."""
+    stores = tables["distribution_centers"]
+    index = ProductIndex(tables["products"], store_names={s["id"]: s["name"] for s in stores})
+
+    return {
+        "price": index.price_index.to_arrays(),
+        "ranking": Ranker(index, stores).to_arrays(),
+        "vectors": VectorIndex(index.rows, dim=vector_dim).to_arrays(),
+    }
+
+
+def write_snapshot(path: str, tables: dict[str, list[dict]], vector_dim: int = DIM):
+    """Writes the tables atomically (temp file + rename), so readers never see half a file."""
+    header = {"tables": {}, "indexes": {}}
+    arrays = []
+    position = 0
+
+    def place(part: np.ndarray) -> list:
+        nonlocal position
+        part = np.ascontiguousarray(part, dtype=part.dtype.newbyteorder("<"))
+        position += -position % ALIGN
+        span = [position, part.dtype.str, int(part.size), list(part.shape)]
+        arrays.append((position, part))
+        position += part.nbytes
+        return span
+
+    for table, columns in SCHEMA.items():
+        rows = tables[table]
+        header["tables"][table] = {"rows": len(rows), "columns": {}}
+
+        for column, kind in columns.items():
+            parts, extra = _encode_column(kind, [r.get(column) for r in rows])
+            spans = [place(part) for part in parts]
+            header["tables"][table]["columns"][column] = {"kind": kind, "arrays": spans, **extra}
+
+    for name, (parts, meta) in build_indexes(tables, vector_dim).items():
+        header["indexes"][name] = {
+            "arrays": {key: place(part) for key, part in parts.items()},
+            "meta": meta,
+        }
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    data_start = _data_start(len(header_bytes))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+
+        for offset, part in arrays:
+            f.seek(data_start + offset)
+            f.write(part.tobytes())
+
+    os.replace(tmp, path)
+
+
+class TextColumn:
+    def __init__(self, offsets: np.ndarray, valid: np.ndarray, blob: memoryview):
+        self.offsets = offsets
+        self.valid = valid
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __getitem__(self, i: int) -> str | None:
+        if not self.valid[i]:
+            return None
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def to_list(self) -> list[str | None]:
+        return [self[i] for i in range(len(self))]
+
+
+class DictColumn:
+    def __init__(self, codes: np.ndarray, dictionary: list[str]):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str | None:
+        code = self.codes[i]
+        return None if code < 0 else self.dictionary[code]
+
+    def to_list(self) -> list[str | None]:
+        lookup = self.dictionary + [None]     # code -1 -> None
+        return [lookup[c] for c in self.codes.tolist()]
+
+
+class ColumnarSnapshot:
+    """A snapshot file mapped read-only; columns are views into the mapping."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise RuntimeError(f"{path} is not a catalog snapshot file")
+
+        (length,) = struct.unpack_from("<Q", self._map, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(bytes(self._map[start:start + length]))
+        self._data = _data_start(length)
+
+    def _array(self, span) -> np.ndarray:
+        offset, dtype, count = span[:3]
+        array = np.frombuffer(self._map, dtype=dtype, count=count, offset=self._data + offset)
+        return array.reshape(span[3]) if len(span) > 3 else array
+
+    def rows(self, table: str) -> int:
+        return self.header["tables"][table]["rows"]
+
+    def column(self, table: str, name: str):
+        spec = self.header["tables"][table]["columns"][name]
+        arrays = [self._array(s) for s in spec["arrays"]]
+
+        if spec["kind"] == "dict":
+            return DictColumn(arrays[0], spec["dictionary"])
+        if spec["kind"] == "text":
+            offsets, valid, blob = arrays
+            return TextColumn(offsets, valid, memoryview(blob))
+        return arrays[0]
+
+    def numeric_columns(self, table: str) -> dict[str, np.ndarray]:
+        """The table's int and float columns, as views into the mapping."""
+        return {
+            name: self.column(table, name)
+            for name, kind in SCHEMA[table].items()
+            if kind in ("int", "float")
+        }
+
+    def index(self, name: str) -> tuple[dict[str, np.ndarray], dict] | None:
+        """(arrays, meta) of a derived index stored by build_indexes(); None in older files."""
+        spec = self.header.get("indexes", {}).get(name)
+        if spec is None:
+            return None
+        return {key: self._array(s) for key, s in spec["arrays"].items()}, spec["meta"]
+
+    def records(self, table: str) -> list[dict]:
+        """The table as row dicts (NULLs back to None), for the chat snapshot."""
+        columns = {}
+        for name, kind in SCHEMA[table].items():
+            column = self.column(table, name)
+            if kind == "int":
+                values = [None if v == -1 else v for v in column.tolist()]
+            elif kind == "float":
+                values = [None if v != v else v for v in column.tolist()]
+            else:
+                values = column.to_list()
+            columns[name] = values
+
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    def close(self) -> bool:
+        """Unmaps the file; False while arrays viewing it are still alive."""
+        try:
+            self._map.close()
+        except BufferError:
+            return False
+        return True
+
+
+class ColumnarSource:
+    """
+    Feeds SnapshotManager from a snapshot file instead of the catalog.
+    The file is re-opened when it changes, so a rebuilt file (replaced
+    atomically) is picked up at the next snapshot refresh. The previous
+    mapping is closed as soon as no snapshot uses its arrays any more.
+    """
+
+    name = "columnar"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot = None
+        self._retired = []
+        # Loads run in worker threads; one at a time may swap the mapping
+        self._lock = threading.Lock()
+
+    def _current(self) -> ColumnarSnapshot:
+        with self._lock:
+            return self._reopen()
+
+    def _reopen(self) -> ColumnarSnapshot:
+        if self.snapshot is None or os.stat(self.path).st_mtime != self.snapshot.mtime:
+            if self.snapshot is not None:
+                self._retired.append(self.snapshot)
+            self.snapshot = ColumnarSnapshot(self.path)
+
+        # The chat snapshot built on a retired file keeps serving until
+        # the refresh swaps it out, so try again on every load
+        self._retired = [s for s in self._retired if not s.close()]
+        return self.snapshot
+
+    def _load(self) -> tuple[list[dict], list[dict], ColumnarSnapshot]:
+        snap = self._current()
+        return snap.records("distribution_centers"), snap.records("products"), snap
+
+    # Decoding rows takes a while; keep it off the event loop
+    async def load(self) -> tuple[list[dict], list[dict], ColumnarSnapshot]:
+        """Stores, products and the mapped file they came from, all of one version."""
+        return await asyncio.to_thread(self._load)
+
+    async def distribution_centers(self) -> list[dict]:
+        return await asyncio.to_thread(lambda: self._current().records("distribution_centers"))
+
+    async def all_products(self) -> list[dict]:
+        return await asyncio.to_thread(lambda: self._current().records("products"))
+
+
+def read_table(path: str, table: str) -> list[dict]:
+    """Rows of a local CSV or Parquet export, typed per SCHEMA."""
+    kinds = SCHEMA[table]
+
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading Parquet needs pyarrow: pip install pyarrow")
+        rows = pq.read_table(path, columns=[c for c in kinds]).to_pylist()
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+
+    def cast(value, kind):
+        if value is None or value == "":
+            return None
+        if kind == "int":
+            return int(float(value))
+        if kind == "float":
+            return float(value)
+        return str(value)
+
+    return [{c: cast(r.get(c), k) for c, k in kinds.items()} for r in rows]
+
+
+def find_table_file(data_dir: str, table: str) -> str:
+    for ext in (".parquet", ".csv"):
+        path = os.path.join(data_dir, table + ext)
+        if os.path.exists(path):
+            return path
+    raise RuntimeError(f"No {table}.parquet or {table}.csv in {data_dir}")
+
+
+def rss_bytes() -> int | None:
+    """Resident set size of this process (Linux), None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar catalog snapshot files")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Write a snapshot file")
+    build.add_argument("out")
+    source = build.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-dir", help="directory with products / distribution_centers .csv or .parquet")
+    source.add_argument("--from-bigquery", action="store_true")
+    build.add_argument("--vector-dim", type=int, default=int(os.getenv("VECTOR_DIM", str(DIM))))
+
+    info = sub.add_parser("info", help="Open a snapshot file and report startup time and RSS")
+    info.add_argument("path")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if args.from_dir:
+            tables = {t: read_table(find_table_file(args.from_dir, t), t) for t in SCHEMA}
+        else:
+            from catalog import BigQueryCatalog
+
+            bq = BigQueryCatalog(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
+
+            async def fetch():
+                return await asyncio.gather(bq.all_products(), bq.distribution_centers())
+
+            products, stores = asyncio.run(fetch())
+            tables = {"products": products, "distribution_centers": stores}
+
+        write_snapshot(args.out, tables, args.vector_dim)
+        print(json.dumps({
+            "path": args.out,
+            "bytes": os.path.getsize(args.out),
+            "rows": {t: len(r) for t, r in tables.items()},
+        }, indent=2))
+        return
+
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    snap = ColumnarSnapshot(args.path)
+    opened = time.perf_counter()
+    products = snap.records("products")
+    loaded = time.perf_counter()
+
+    print(json.dumps({
+        "path": args.path,
+        "bytes": os.path.getsize(args.path),
+        "rows": {t: snap.rows(t) for t in SCHEMA},
+        "open_ms": round((opened - started) * 1000, 3),
+        "records_ms": round((loaded - opened) * 1000, 3),
+        "rss_before_bytes": rss_before,
+        "rss_after_bytes": rss_bytes(),
+        "products_loaded": len(products),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
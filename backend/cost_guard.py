@@ -0,0 +1,159 @@
+"""
+BigQuery cost guard.
+
+Every BigQuery job the catalog runs goes through a CostGuard, which:
+
+- caps each job with `maximum_bytes_billed` (BQ_MAX_BYTES_BILLED), so
+  BigQuery itself fails a job that would bill more;
+- optionally dry-runs a query first (BQ_DRY_RUN=1) to get its byte
+  estimate. Estimates are cached per query fingerprint, because bytes
+  scanned depend on the tables and columns, not on parameter values;
+- refuses, with QueryBudgetExceeded, queries whose estimate is over the
+  budget of the chat intent that issued them (BQ_QUERY_BUDGET_BYTES,
+  BQ_INTENT_BUDGETS). Callers that can answer from the in-memory
+  snapshot downgrade to it instead;
+- records bytes processed and billed, slot-ms and cache hits per
+  intent, in stats() and as Prometheus counters.
+"""
+import threading
+
+from google.cloud import bigquery
+
+import metrics
+
+# Intent label for queries outside a chat request (snapshot loads, ...)
+BACKGROUND = "background"
+
+
+class QueryBudgetExceeded(Exception):
+    def __init__(self, intent: str, estimated_bytes: int | None, budget_bytes: int | None):
+        self.intent = intent
+        self.estimated_bytes = estimated_bytes
+        self.budget_bytes = budget_bytes
+        super().__init__(
+            f"Query for '{intent}' would process {estimated_bytes} bytes "
+            f"(budget {budget_bytes})"
+        )
+
+
+def parse_budgets(text: str | None) -> dict[str, int]:
+    """"store=1e9,price_search=5e8" -> {"store": 1000000000, ...}"""
+    budgets = {}
+    for part in (text or "").split(","):
+        if "=" in part:
+            intent, value = part.split("=", 1)
+            budgets[intent.strip()] = int(float(value))
+    return budgets
+
+
+def current_intent() -> str:
+    timer = metrics.current()
+    return timer.intent if timer is not None else BACKGROUND
+
+
+class CostGuard:
+    def __init__(
+        self,
+        max_bytes_billed: int | None = None,
+        dry_run: bool = False,
+        default_budget: int | None = None,
+        intent_budgets: dict[str, int] | None = None
+    ):
+        self.max_bytes_billed = max_bytes_billed
+        self.dry_run = dry_run
+        self.default_budget = default_budget
+        self.intent_budgets = intent_budgets or {}
+
+        self._estimates = {}
+        self._by_intent = {}
+        self._lock = threading.Lock()
+
+    def budget_for(self, intent: str) -> int | None:
+        if intent == BACKGROUND:
+            return self.intent_budgets.get(BACKGROUND)
+        return self.intent_budgets.get(intent, self.default_budget)
+
+    def job_config(self, params=None) -> bigquery.QueryJobConfig:
+        config = bigquery.QueryJobConfig(query_parameters=params or [])
+        if self.max_bytes_billed:
+            config.maximum_bytes_billed = self.max_bytes_billed
+        return config
+
+    def estimate(self, client, query: str, params, query_fingerprint: str) -> tuple[int, bool]:
+        """(bytes the query would process, whether it was a fresh dry run). Blocking."""
+        cached = self._estimates.get(query_fingerprint)
+        if cached is not None:
+            return cached, False
+
+        config = bigquery.QueryJobConfig(
+            query_parameters=params or [], dry_run=True, use_query_cache=False
+        )
+        job = client.query(query, job_config=config)
+        estimate = int(job.total_bytes_processed or 0)
+
+        self._estimates[query_fingerprint] = estimate
+        return estimate, True
+
+    def check(self, client, query: str, params, query_fingerprint: str, intent: str) -> int | None:
+        """Raises QueryBudgetExceeded before submitting an over-budget query. Blocking."""
+        limits = [b for b in (self.budget_for(intent), self.max_bytes_billed) if b]
+        if not self.dry_run or not limits:
+            return None
+
+        estimate, fresh = self.estimate(client, query, params, query_fingerprint)
+        if fresh:
+            with self._lock:
+                self._entry(intent)["dry_runs"] += 1
+
+        if estimate > min(limits):
+            self.refused(intent)
+            raise QueryBudgetExceeded(intent, estimate, min(limits))
+        return estimate
+
+    def refused(self, intent: str):
+        with self._lock:
+            self._entry(intent)["refused"] += 1
+        metrics.QUERIES_REFUSED.labels(intent).inc()
+
+    def record(self, job, intent: str):
+        """Bytes, slot time and cache hit of a finished job."""
+        processed = int(getattr(job, "total_bytes_processed", None) or 0)
+        billed = int(getattr(job, "total_bytes_billed", None) or 0)
+        slot_ms = int(getattr(job, "slot_millis", None) or 0)
+        cache_hit = bool(getattr(job, "cache_hit", False))
+
+        with self._lock:
+            entry = self._entry(intent)
+            entry["jobs"] += 1
+            entry["cache_hits"] += cache_hit
+            entry["bytes_processed"] += processed
+            entry["bytes_billed"] += billed
+            entry["slot_ms"] += slot_ms
+
+        metrics.QUERY_JOBS.labels(intent, str(cache_hit).lower()).inc()
+        metrics.QUERY_BYTES_BILLED.labels(intent).inc(billed)
+        metrics.QUERY_SLOT_MS.labels(intent).inc(slot_ms)
+
+    def _entry(self, intent: str) -> dict:
+        entry = self._by_intent.get(intent)
+        if entry is None:
+            entry = self._by_intent[intent] = {
+                "jobs": 0,
+                "cache_hits": 0,
+                "bytes_processed": 0,
+                "bytes_billed": 0,
+                "slot_ms": 0,
+                "dry_runs": 0,
+                "refused": 0,
+            }
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_bytes_billed": self.max_bytes_billed,
+                "dry_run": self.dry_run,
+                "default_budget": self.default_budget,
+                "intent_budgets": self.intent_budgets,
+                "intents": {k: dict(v) for k, v in self._by_intent.items()},
+            }
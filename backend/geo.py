@@ -0,0 +1,118 @@
+"""
+In-memory spatial index over distribution centers.
+
+There are only a handful of centers and they never move, so they are
+loaded once and every distance question is answered with one
+vectorized haversine pass instead of an ST_DISTANCE query.
+"""
+import numpy as np
+
+# Mean earth radius used by BigQuery's ST_DISTANCE
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """
+    Great-circle distance from one point to many.
+    All inputs are in degrees; `lats` / `lngs` may be arrays.
+    """
+    phi1 = np.radians(lat)
+    phi2 = np.radians(lats)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(np.asarray(lngs) - lng)
+
+    a = (
+        np.sin(d_phi / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class StoreIndex:
+    def __init__(self, stores: list[dict]):
+        # Centers without coordinates can't be ranked by distance
+        located = [
+            s for s in stores
+            if s.get("latitude") is not None and s.get("longitude") is not None
+        ]
+
+        self.stores = [
+            {
+                "id": s["id"],
+                "name": s["name"],
+                "latitude": s["latitude"],
+                "longitude": s["longitude"],
+            }
+            for s in located
+        ]
+        self.by_id = {s["id"]: s for s in self.stores}
+        self.ids = np.array([s["id"] for s in self.stores], dtype=np.int64)
+
+        lats = np.array([s["latitude"] for s in self.stores], dtype=np.float64)
+        lngs = np.array([s["longitude"] for s in self.stores], dtype=np.float64)
+
+        # Precomputed terms of the haversine formula
+        self._phi = np.radians(lats)
+        self._cos_phi = np.cos(self._phi)
+        self._lambda = np.radians(lngs)
+
+    def __len__(self):
+        return len(self.stores)
+
+    def get(self, store_id: int) -> dict | None:
+        return self.by_id.get(store_id)
+
+    def distances_km(self, lat: float, lng: float) -> np.ndarray:
+        phi = np.radians(lat)
+        d_phi = self._phi - phi
+        d_lambda = self._lambda - np.radians(lng)
+
+        a = (
+            np.sin(d_phi / 2) ** 2
+            + np.cos(phi) * self._cos_phi * np.sin(d_lambda / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    def nearest(self, lat: float, lng: float, k: int = 1, store_ids=None):
+        """
+        The `k` closest centers, closest first.
+        `store_ids` restricts the search to a subset (e.g. centers that
+        stock a product).
+        """
+        if k <= 0 or not len(self):
+            return []
+
+        distances = self.distances_km(lat, lng)
+        candidates = self._candidates(store_ids)
+
+        if len(candidates) > k:
+            part = np.argpartition(distances[candidates], k - 1)[:k]
+            candidates = candidates[part]
+
+        order = candidates[np.argsort(distances[candidates], kind="stable")]
+        return self._rows(order, distances)
+
+    def within(self, lat: float, lng: float, radius_km: float, store_ids=None):
+        """All centers within `radius_km`, closest first."""
+        if not len(self):
+            return []
+
+        distances = self.distances_km(lat, lng)
+        candidates = self._candidates(store_ids)
+        candidates = candidates[distances[candidates] <= radius_km]
+
+        order = candidates[np.argsort(distances[candidates], kind="stable")]
+        return self._rows(order, distances)
+
+    def _candidates(self, store_ids) -> np.ndarray:
+        if store_ids is None:
+            return np.arange(len(self.stores))
+
+        wanted = np.fromiter(store_ids, dtype=np.int64)
+        return np.flatnonzero(np.isin(self.ids, wanted))
+
+    def _rows(self, positions, distances):
+        return [
+            {**self.stores[i], "distance_km": float(distances[i])}
+            for i in positions
+        ]
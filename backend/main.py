@@ -1,11 +1,64 @@
-from datetime import datetime
-from fastapi import FastAPI, Request, Body, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, Body, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from google.cloud import bigquery
+from fastapi.responses import JSONResponse, StreamingResponse
+from cache import TTLCache
+from catalog import SingleFlight, get_catalog
+from columnar import ColumnarSource
+from cost_guard import QueryBudgetExceeded
+from geo import StoreIndex
+from message_parser import parse_message, route
+from orders import BigQueryOrderSink, OrderExporter, OrderStore
+from pagination import IndexResults, ResultSet, RowResults, decode_cursor, encode_cursor
+from products import ProductCache
+from query_plan import ProductFilter
+from ranking import RankedResults, RankingWeights
+from serialization import FastJSONResponse, dumps
+from sessions import (
+    SESSION_COOKIE,
+    SESSION_HEADER,
+    get_session_store,
+    new_session_id,
+    new_state,
+    valid_session_id,
+)
+from snapshot import SnapshotManager
+from users import UserProfiles
+from vector_index import DIM as VECTOR_DIM
+import asyncio
+import cart
+import hmac
+import logging
+import metrics
+import numpy as np
 import os
 import re
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail fast on boot instead of on the first chat message
+    if USER_ID is not None and not await get_user(USER_ID):
+        raise RuntimeError(f"User {USER_ID} not found in database")
+    if USER_PREFETCH_IDS:
+        await USERS.prefetch(USER_PREFETCH_IDS)
+    await ensure_store_index()
+    await SNAPSHOT.get()
+    SNAPSHOT.start()
+    await asyncio.to_thread(ORDERS.open)
+    if ORDER_EXPORTER:
+        ORDER_EXPORTER.start()
+    yield
+    await SNAPSHOT.stop()
+    if ORDER_EXPORTER:
+        await ORDER_EXPORTER.stop()
+        # Last chance to hand over what is still pending
+        try:
+            await ORDER_EXPORTER.flush()
+        except Exception:
+            logger.exception("Final order export failed")
+    ORDERS.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # ✅ CORS
 app.add_middleware(
@@ -16,199 +69,193 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
-client = bigquery.Client(project=PROJECT_ID)
+# 💸 Queries the cost guard refused and nothing could downgrade
+OVER_BUDGET_STATUS = 429
+OVER_BUDGET_DETAIL = "Query over budget"
+
+@app.exception_handler(QueryBudgetExceeded)
+async def query_over_budget(request: Request, exc: QueryBudgetExceeded):
+    logger.warning("Refused over-budget query: %s", exc)
+    return JSONResponse(
+        {
+            "detail": OVER_BUDGET_DETAIL,
+            "reply": "That request is too expensive to run right now. Try narrowing it down 🙏",
+        },
+        status_code=OVER_BUDGET_STATUS
+    )
 
-# -------------------------
-# INTENT DETECTION
-# -------------------------
-def detect_intent(message: str):
-    msg = message.lower()
+# ⏱️ Per-stage timings: Server-Timing header on every response,
+# Prometheus histograms for /chat
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    timer = metrics.start_request()
+    response = await call_next(request)
+
+    response.headers["Server-Timing"] = timer.server_timing()
+    response.headers["Timing-Allow-Origin"] = "*"
+    if request.url.path == "/chat":
+        timer.observe(response.status_code)
+
+    return response
+
+# BigQuery by default, local snapshot with CATALOG_BACKEND=local
+catalog = get_catalog()
+
+# Full product search result sets keyed on the normalized filters;
+# "show more" pages through the cached set instead of searching again
+SEARCH_CACHE = TTLCache(
+    ttl=float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300")),
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+)
+
+SEARCHES = SingleFlight()
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "5"))
+STORE_PAGE_SIZE = int(os.getenv("STORE_PAGE_SIZE", "10"))
+# Rows kept from the SQL fallback (the name index keeps every match)
+SEARCH_FETCH_LIMIT = int(os.getenv("SEARCH_FETCH_LIMIT", "100"))
+
+# Relevance weights for product search order, e.g. "name=1,price=0.5"
+RANK_WEIGHTS = RankingWeights.parse(os.getenv("RANK_WEIGHTS"))
+
+# Scored result sets per (search, shopper location), so pages reuse them
+RANKINGS = TTLCache(
+    ttl=SEARCH_CACHE.ttl,
+    max_entries=int(os.getenv("RANK_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("RANK_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+)
 
-    if "gift" in msg or "present" in msg or "surprise" in msg:
-        return "gift"
+def clear_search_caches() -> int:
+    RANKINGS.clear()
+    return SEARCH_CACHE.clear()
+
+STORE_PRODUCT_FIELDS = [
+    "id", "name", "brand", "category", "department",
+    "retail_price", "sku", "distribution_name",
+]
+
+# Products + per-store aggregates, rebuilt in the background.
+# A new snapshot invalidates cached searches. With SNAPSHOT_FILE set,
+# workers read the mmap'd columnar file (see columnar.py) instead of
+# querying the catalog at startup.
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE")
+
+SNAPSHOT = SnapshotManager(
+    ColumnarSource(SNAPSHOT_FILE) if SNAPSHOT_FILE else catalog,
+    refresh_seconds=float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "3600")),
+    on_refresh=lambda snapshot: clear_search_caches(),
+    vector_dim=int(os.getenv("VECTOR_DIM", str(VECTOR_DIM))),
+)
+
+# Current product rows for carts and checkout, fetched by id in batches
+PRODUCTS = ProductCache(
+    catalog,
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "60")),
+    negative_ttl=float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL_SECONDS", "30")),
+    max_entries=int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "50000")),
+)
+
+# Orders commit locally; an exporter copies them to BigQuery in batches
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+ORDERS = OrderStore(os.getenv("ORDER_DB_PATH", os.path.join(DATA_DIR, "orders.db")))
+ORDER_ANALYTICS_DATASET = os.getenv("ORDER_ANALYTICS_DATASET")
+ORDER_EXPORTER = (
+    OrderExporter(
+        ORDERS,
+        BigQueryOrderSink(catalog.client, ORDER_ANALYTICS_DATASET),
+        interval_seconds=float(os.getenv("ORDER_EXPORT_INTERVAL_SECONDS", "5")),
+        batch_size=int(os.getenv("ORDER_EXPORT_BATCH_SIZE", "500")),
+    )
+    if ORDER_ANALYTICS_DATASET and catalog.name == "bigquery" else None
+)
 
-    if "compare" in msg or "difference" in msg:
-        return "compare"
+# Shopper profiles, looked up per request
+USERS = UserProfiles(
+    catalog,
+    ttl=float(os.getenv("USER_CACHE_TTL_SECONDS", "600")),
+    negative_ttl=float(os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "60")),
+    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000")),
+)
+USER_PREFETCH_IDS = [
+    int(u) for u in os.getenv("USER_PREFETCH_IDS", "").split(",") if u.strip()
+]
+
+# Conversation state per chat session (memory or Redis)
+SESSIONS = get_session_store()
 
-    if "under $" in msg or "under" in msg:
-        return "price_search"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-    if any(size in msg for size in ["small", "medium", "large", "xl", "xxl"]):
-        return "size_search"
+logger = logging.getLogger(__name__)
 
-    return "search"
+# -------------------------
+# INTENT DETECTION
+# -------------------------
+# Each helper is a view over the single-pass, cached parse_message()
+def detect_intent(message: str):
+    return parse_message(message).intent
 
 def is_show_cart_intent(message: str) -> bool:
-    msg = message.lower()
-    keywords = [
-        "show cart",
-        "see cart",
-        "view cart",
-        "my cart",
-        "items in cart",
-        "show me cart",
-        "show me items",
-        "let me see my cart",
-    ]
-    return any(k in msg for k in keywords)
+    return parse_message(message).is_show_cart
 
 def is_gift_intent(message: str) -> bool:
-    msg = message.lower()
-    return any(k in msg for k in [
-        "gift", "present", "buy for", "for my",
-        "brother", "sister", "girlfriend", "boyfriend",
-        "wife", "husband", "mom", "dad", "father", "mother"
-    ])
+    return parse_message(message).is_gift
 
 def has_explicit_recipient(message: str) -> bool:
-    msg = message.lower()
-    return any(k in msg for k in [
-        "for my father", "for my dad", "for my brother",
-        "for my husband", "for my son",
-        "for my mother", "for my mom", "for my sister",
-        "for my wife", "for my daughter"
-    ])
+    return parse_message(message).has_explicit_recipient
 
 def is_relax_price_intent(message: str) -> bool:
-    return message.lower() in [
-        "increase budget",
-        "raise budget",
-        "higher budget",
-        "remove price limit",
-        "remove size filter",
-        "show similar items"
-    ]
+    return parse_message(message).is_relax_price
 
 def is_closest_store_with_product_intent(message: str) -> bool:
-    msg = message.lower()
-    keywords = [
-        "closest store with",
-        "nearest store with",
-        "closest shop with",
-        "nearest shop with"
-    ]
-    return any(k in msg for k in keywords)
+    return parse_message(message).is_closest_store_with_product
 
 def is_closest_store_intent(message: str) -> bool:
-    msg = message.lower()
-    keywords = [
-        "closest store",
-        "nearest store",
-        "closest shop",
-        "nearest shop",
-        "closest distribution",
-        "nearest distribution",
-        "where is the closest store",
-        "where is nearest store"
-    ]
-    return any(k in msg for k in keywords)
+    return parse_message(message).is_closest_store
 
 def is_cheapest_store_intent(message: str) -> bool:
-    msg = message.lower()
-    return (
-        "cheapest" in msg
-        and any(k in msg for k in [
-            "store", "stores", "shop", "nearby", "nearest", "closest"
-        ])
-    )
+    return parse_message(message).is_cheapest_store
 
 # -------------------------
 # HELPERS
 # -------------------------
-def attach_user_location(payload: dict):
+def attach_user_location(payload: dict, user: dict):
     payload["user_location"] = {
-        "latitude": USER["latitude"],
-        "longitude": USER["longitude"]
+        "latitude": user["latitude"],
+        "longitude": user["longitude"]
     }
     return payload
 
 def extract_nearest_store_limit(message: str) -> int:
-    msg = message.lower()
+    number = parse_message(message).number
 
     # explicit number
-    match = re.search(r"\b(\d+)\b", msg)
-    if match:
-        return min(int(match.group(1)), 10)  # safety cap
+    if number is not None:
+        return min(number, 10)  # safety cap
 
     # default
     return 1
 
-def extract_product_for_store_search(message: str):
-    original = message.strip()
-
-    # 1️⃣ Remove intent phrases (case-insensitive, from original text)
-    intent_patterns = [
-        r"closest store with",
-        r"nearest store with",
-        r"closest shop with",
-        r"nearest shop with",
-        r"closest store",
-        r"nearest store",
-        r"closest",
-        r"nearest",
-    ]
-
-    cleaned = original
-    for p in intent_patterns:
-        cleaned = re.sub(p, "", cleaned, flags=re.IGNORECASE).strip()
-
-    # 2️⃣ Category-based detection (cheap & reliable)
-    categories = [
-        "winter jacket", "winter jackets",
-        "jacket", "jackets",
-        "coat", "coats",
-        "hoodie", "hoodies",
-        "sweater", "sweaters",
-        "shirt", "shirts",
-        "dress", "pants"
-    ]
-
-    lowered = cleaned.lower()
-    for c in categories:
-        if c in lowered:
-            return c
-
-    # 3️⃣ Exact product name via capitalized words
-    words = cleaned.split()
+def extract_radius_km(message: str) -> float | None:
+    return parse_message(message).radius_km
 
-    product_words = [
-        w for w in words
-        if w[:1].isupper() and len(w) > 2
-    ]
-
-    if len(product_words) >= 3:
-        return " ".join(product_words)
-
-    return None
+def extract_product_for_store_search(message: str):
+    return parse_message(message).store_product
 
 def extract_store_filters(message: str, user_gender: str):
-    price, price_op = extract_price_constraint(message)
-    size = detect_size(message)
-    category = detect_category_keyword(message)
-    product = extract_product_for_store_search(message)
-
-    department = detect_target_gender(message, user_gender)
+    parsed = parse_message(message)
 
     return {
-        "product": product,
-        "category": category,
-        "price": price,
-        "price_op": price_op,
-        "size": size,
-        "department": department,
+        "product": parsed.store_product,
+        "category": parsed.category,
+        "price": parsed.price,
+        "price_op": parsed.price_op,
+        "size": parsed.size,
+        "department": parsed.target_gender,
     }
 
 def has_search_filters(message: str) -> bool:
-    msg = message.lower()
-
-    filter_keywords = [
-        "$", "under", "over", "below", "above", "less than", "more than",
-        "small", "medium", "large", "xl", "xxl",
-        "jacket", "coat", "hoodie", "sweater", "shirt", "dress", "pants"
-    ]
-
-    return any(k in msg for k in filter_keywords)
+    return parse_message(message).has_search_filters
 
 def looks_like_product_name(text: str) -> bool:
     """
@@ -223,429 +270,793 @@ def looks_like_product_name(text: str) -> bool:
     capital_words = sum(1 for w in text.split() if w[:1].isupper())
     return capital_words >= 3
 
-def extract_comparison_products(message: str):
-    if " and " not in message.lower():
-        return None, None
-
-    left, right = message.split(" and ", 1)
-    left, right = left.strip(), right.strip()
+# "A and B", "A vs B", "A, B and C"
+COMPARE_SPLIT_RE = re.compile(r"\s*,\s*(?:and\s+)?|\s+(?:and|vs\.?|versus)\s+", re.IGNORECASE)
+COMPARE_PREFIX_RE = re.compile(r"^\s*(?:compare|difference between)\s+", re.IGNORECASE)
 
-    if looks_like_product_name(left) and looks_like_product_name(right):
-        return left, right
-
-    return None, None
-
-def extract_price_constraint(message: str):
-    msg = message.lower()
-
-    price_match = re.search(r"\$(\d+(\.\d+)?)", msg)
-    if not price_match:
-        return None, None
+def extract_comparison_products(message: str, resolver=None) -> list[str]:
+    """
+    Product names in a comparison message; empty unless every part looks
+    like one. With the catalog's resolver, separators inside a product
+    name ("Black and White Tee") are kept.
+    """
+    text = COMPARE_PREFIX_RE.sub("", message).strip()
+    if not COMPARE_SPLIT_RE.search(text):
+        return []
 
-    price = float(price_match.group(1))
+    parts = resolver.split(text, COMPARE_SPLIT_RE) if resolver and looks_like_product_name(text) else None
+    if parts is None:
+        parts = COMPARE_SPLIT_RE.split(text)
+    parts = [p.strip() for p in parts if p.strip()]
 
-    if "over" in msg or "above" in msg or "more than" in msg:
-        return price, "over"
+    if len(parts) >= 2 and all(looks_like_product_name(p) for p in parts):
+        return parts
 
-    if "under" in msg or "below" in msg or "less than" in msg:
-        return price, "under"
+    return []
 
-    # "$4 jackets", "priced $4"
-    return price, "exact"
+def extract_price_constraint(message: str):
+    parsed = parse_message(message)
+    return parsed.price, parsed.price_op
 
-def resolve_recipient_departments(message: str):
-    msg = message.lower()
-    LAST_CONTEXT["recipients"] = []
-    LAST_CONTEXT["departments"] = []
-    LAST_CONTEXT["last_recipient"] = None
-    LAST_CONTEXT["last_recipient_source"] = None
-    recipients = []
-    departments = []
+def resolve_recipient_departments(message: str, context: dict):
+    parsed = parse_message(message)
+    context["recipients"] = []
+    context["departments"] = []
+    context["last_recipient"] = None
+    context["last_recipient_source"] = None
 
     # explicit parents
-    if "parents" in msg:
-        LAST_CONTEXT["recipients"] = ["parents"]
-        LAST_CONTEXT["departments"] = ["Men", "Women"]
-        LAST_CONTEXT["last_recipient"] = "parents"
-        LAST_CONTEXT["last_recipient_source"] = "product"
+    if parsed.has_parents:
+        context["recipients"] = ["parents"]
+        context["departments"] = ["Men", "Women"]
+        context["last_recipient"] = "parents"
+        context["last_recipient_source"] = "product"
         return ["Men", "Women"]
 
     # explicit named recipients
-    for word, dept in RECIPIENT_MAP.items():
-        if word in msg:
-            recipients.append(word)
-            if dept not in departments:
-                departments.append(dept)
-
-    if recipients:
-        LAST_CONTEXT["recipients"] = recipients
-        LAST_CONTEXT["departments"] = departments
-        LAST_CONTEXT["last_recipient"] = recipients[-1]
-        LAST_CONTEXT["last_recipient_source"] = "product"
-        return departments
+    if parsed.recipients:
+        context["recipients"] = list(parsed.recipients)
+        context["departments"] = list(parsed.recipient_departments)
+        context["last_recipient"] = parsed.recipients[-1]
+        context["last_recipient_source"] = "product"
+        return list(parsed.recipient_departments)
 
     # pronouns (fallback)
-    for pronoun, dept in PRONOUN_MAP.items():
-        if (
-            pronoun in msg
-            and LAST_CONTEXT["last_recipient"]
-            and LAST_CONTEXT.get("last_recipient_source") == "product"
-        ):
-            LAST_CONTEXT["recipients"] = [LAST_CONTEXT["last_recipient"]]
-            LAST_CONTEXT["departments"] = [dept]
-            return [dept]
+    if (
+        parsed.pronoun_departments
+        and context["last_recipient"]
+        and context.get("last_recipient_source") == "product"
+    ):
+        dept = parsed.pronoun_departments[0]
+        context["recipients"] = [context["last_recipient"]]
+        context["departments"] = [dept]
+        return [dept]
 
     return None
 
 def detect_gender_department(message: str):
-    msg = message.lower()
-
-    women_keywords = ["girlfriend", "wife", "mother", "mom", "sister", "grandmother"]
-    men_keywords = ["boyfriend", "man", "father", "dad", "son", "grandfather", "him"]
-
-    if any(k in msg for k in women_keywords):
-        return "Women"
-    if any(k in msg for k in men_keywords):
-        return "Men"
-
-    return None
+    return parse_message(message).gender_department
 
 def detect_target_gender(message: str, user_gender: str | None):
-    msg = message.lower()
-
-    female_targets = [
-        "girlfriend", "wife", "mother", "mom",
-        "sister", "daughter", "grandmother"
-    ]
-
-    male_targets = [
-        "boyfriend", "husband", "father", "dad",
-        "brother", "son", "grandfather", "him"
-    ]
-
-    if any(k in msg for k in female_targets):
-        return "Women"
-
-    if any(k in msg for k in male_targets):
-        return "Men"
-
-    return None
+    return parse_message(message).target_gender
 
 def detect_parent_group(message: str) -> list[str] | None:
-    msg = message.lower()
-    if "parents" in msg:
+    if parse_message(message).has_parents:
         return ["Men", "Women"]
     return None
 
 def detect_size(message: str):
-    msg = message.lower()
-    size_map = {
-        "small": "s",
-        "medium": "m",
-        "large": "l",
-        "xl": "xl",
-        "xxl": "xxl",
-    }
-    for k, v in size_map.items():
-        if k in msg:
-            return v
-    return None
+    return parse_message(message).size
 
 def detect_category_keyword(message: str):
-    keywords = ["jacket", "coat", "hoodie", "sweater", "shirt", "dress", "pants"]
-    for k in keywords:
-        if k in message.lower():
-            return k
-    return None
+    return parse_message(message).category
 
-def get_user(user_id: int) -> dict | None:
-    query = """
-    SELECT
-      id,
-      first_name,
-      last_name,
-      email,
-      age,
-      gender,
-      state,
-      street_address,
-      postal_code,
-      city,
-      country,
-      latitude,
-      longitude,
-      traffic_source,
-      created_at,
-      user_geom
-    FROM `bigquery-public-data.thelook_ecommerce.users`
-    WHERE id = @user_id
-    LIMIT 1
-    """
+async def get_user(user_id: int) -> dict | None:
+    return await USERS.get(user_id)
 
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_id", "INT64", user_id)
-        ]
-    )
-
-    results = client.query(query, job_config=job_config).result()
-    rows = list(results)
+# Default shopper when a request doesn't send X-User-Id
+USER_ID_ENV = os.getenv("USER_ID")
+USER_ID = int(USER_ID_ENV) if USER_ID_ENV else None
 
-    if not rows:
-        return None
+async def resolve_user(user_id: int | None) -> dict:
+    user_id = user_id if user_id is not None else USER_ID
 
-    return dict(rows[0])
+    if user_id is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Send an X-User-Id header or set the USER_ID environment variable"
+        )
 
-USER_ID_ENV = os.getenv("USER_ID")
+    user = await get_user(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found")
 
-if not USER_ID_ENV:
-    raise RuntimeError(
-        "USER_ID environment variable is not set. "
-        "Please define USER_ID in your environment or .env file."
-    )
-
-USER_ID = int(USER_ID_ENV)
-USER = get_user(USER_ID)
-
-if not USER:
-    raise RuntimeError(f"User {USER_ID} not found in database")
-
-LAST_SEARCH = {}
-
-LAST_CONTEXT = {
-    "recipients": [],         # ["girlfriend", "brother"]
-    "departments": [],        # ["Women", "Men"]
-    "last_recipient": None,    # for pronouns (him / her)
-    "last_recipient_source": None
-}
-
-RECIPIENT_MAP = {
-    # Male
-    "father": "Men",
-    "dad": "Men",
-    "brother": "Men",
-    "son": "Men",
-    "husband": "Men",
-    "grandfather": "Men",
-
-    # Female
-    "mother": "Women",
-    "mom": "Women",
-    "sister": "Women",
-    "daughter": "Women",
-    "wife": "Women",
-    "grandmother": "Women",
-}
-
-PRONOUN_MAP = {
-    "him": "Men",
-    "his": "Men",
-    "her": "Women",
-    "hers": "Women",
-}
+    return user
 
 def user_has_location(user: dict) -> bool:
     return user.get("latitude") is not None and user.get("longitude") is not None
 
-def find_nearest_stores(user_lat: float, user_lng: float, limit: int = 1):
-    query = f"""
-    SELECT
-      id,
-      name,
-      latitude,
-      longitude,
-      ST_DISTANCE(
-        ST_GEOGPOINT(longitude, latitude),
-        ST_GEOGPOINT(@user_lng, @user_lat)
-      ) / 1000 AS distance_km
-    FROM `bigquery-public-data.thelook_ecommerce.distribution_centers`
-    WHERE latitude IS NOT NULL
-      AND longitude IS NOT NULL
-    ORDER BY distance_km ASC
-    LIMIT {limit}
-    """
+STORE_INDEX = None
 
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_lat", "FLOAT64", user_lat),
-            bigquery.ScalarQueryParameter("user_lng", "FLOAT64", user_lng),
-        ]
-    )
+async def ensure_store_index() -> StoreIndex:
+    # Distribution centers never change: load them once
+    global STORE_INDEX
+
+    if STORE_INDEX is None:
+        STORE_INDEX = StoreIndex(await catalog.distribution_centers())
 
-    results = client.query(query, job_config=job_config).result()
-    return [dict(row) for row in results]
+    return STORE_INDEX
 
-def find_nearest_stores_with_product(
+async def find_nearest_stores(user_lat: float, user_lng: float, limit: int = 1):
+    index = await ensure_store_index()
+    return index.nearest(user_lat, user_lng, k=limit)
+
+async def find_stores_within(user_lat: float, user_lng: float, radius_km: float):
+    index = await ensure_store_index()
+    return index.within(user_lat, user_lng, radius_km)
+
+async def find_nearest_stores_with_product(
     user_lat: float,
     user_lng: float,
     product_keyword: str,
     limit: int = 5
 ):
-    query = f"""
-    SELECT DISTINCT
-      dc.id,
-      dc.name,
-      dc.latitude,
-      dc.longitude,
-      ST_DISTANCE(
-        ST_GEOGPOINT(dc.longitude, dc.latitude),
-        ST_GEOGPOINT(@user_lng, @user_lat)
-      ) / 1000 AS distance_km
-    FROM `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-    JOIN `bigquery-public-data.thelook_ecommerce.products` p
-      ON dc.id = p.distribution_center_id
-    WHERE dc.latitude IS NOT NULL
-      AND dc.longitude IS NOT NULL
-      AND LOWER(p.name) LIKE @product
-    ORDER BY distance_km ASC
-    LIMIT {limit}
-    """
+    index = await ensure_store_index()
 
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("user_lat", "FLOAT64", user_lat),
-            bigquery.ScalarQueryParameter("user_lng", "FLOAT64", user_lng),
-            bigquery.ScalarQueryParameter(
-                "product",
-                "STRING",
-                f"%{product_keyword.lower()}%"
-            ),
-        ]
+    store_ids = (await SNAPSHOT.get()).name_index.store_ids_matching(
+        product=product_keyword
     )
+    if store_ids is None:
+        try:
+            store_ids = await catalog.stores_with_product(product_keyword)
+        except QueryBudgetExceeded:
+            # Too expensive in BigQuery: same LIKE filter over the snapshot
+            name_index = (await SNAPSHOT.get()).name_index
+            store_ids = name_index.stores_of(
+                name_index.scan(ProductFilter.build(product=product_keyword))
+            )
 
-    results = client.query(query, job_config=job_config).result()
-    return [dict(row) for row in results]
+    return index.nearest(user_lat, user_lng, k=limit, store_ids=store_ids)
 
-def extract_store_id(message: str) -> int | None:
-    match = re.search(r"\b(\d+)\b", message)
-    if match:
-        return int(match.group(1))
-    return None
+async def find_nearest_stores_matching(
+    user_lat: float,
+    user_lng: float,
+    filters: dict,
+    exclude_department=None,
+    limit: int = 1
+):
+    index = await ensure_store_index()
+
+    store_ids = (await SNAPSHOT.get()).name_index.store_ids_matching(
+        product=filters["product"],
+        category=filters["category"],
+        size=filters["size"],
+        department=filters["department"],
+        exclude_department=exclude_department,
+        price=filters["price"],
+        price_op=filters["price_op"],
+    )
+    if store_ids is None:
+        try:
+            store_ids = await catalog.stores_matching(filters, exclude_department)
+        except QueryBudgetExceeded:
+            name_index = (await SNAPSHOT.get()).name_index
+            store_ids = name_index.stores_of(name_index.scan(ProductFilter.build(
+                product=filters["product"],
+                category=filters["category"],
+                size=filters["size"],
+                price=filters["price"],
+                price_op=filters["price_op"],
+                department=filters["department"],
+                exclude_department=exclude_department,
+            )))
+
+    stores = index.nearest(user_lat, user_lng, k=limit, store_ids=store_ids)
+
+    for s in stores:
+        s["distance_km"] = round(s["distance_km"], 2)
+    return stores
+
+async def find_cheapest_stores(user_lat: float, user_lng: float, limit: int = 5):
+    index = await ensure_store_index()
+    min_prices = (await SNAPSHOT.get()).min_prices()
+
+    stores = index.nearest(
+        user_lat, user_lng, k=len(index), store_ids=min_prices.keys()
+    )
+    for s in stores:
+        s["distance_km"] = round(s["distance_km"], 2)
+        s["cheapest_price"] = min_prices[s["id"]]
+
+    stores.sort(key=lambda s: (s["cheapest_price"], s["distance_km"]))
+    return stores[:limit]
+
+def search_cache_key(price, price_op, department, size, category):
+    # Same normalization as the SQL compiler: equal questions, equal keys
+    return ProductFilter.build(
+        category=category,
+        size=size,
+        price=price,
+        price_op=price_op,
+        department=department,
+    )
+
+async def search_results(
+    price=None,
+    price_op=None,
+    department=None,
+    size=None,
+    category=None
+) -> ResultSet:
+    """Every match for the filters, kept in SEARCH_CACHE for later pages."""
+    key = search_cache_key(price, price_op, department, size, category)
+
+    cached = SEARCH_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    # Identical searches running at once (e.g. across a /chat/batch) share one
+    results, _ = await SEARCHES.do(
+        key, lambda: load_search_results(key, price, price_op, department, size, category)
+    )
+    return results
+
+async def load_search_results(key, price, price_op, department, size, category) -> ResultSet:
+    # Name index first; SQL only when a filter has no indexable words
+    index = (await SNAPSHOT.get()).name_index
+    positions = index.filter_positions(
+        category=category,
+        size=size,
+        department=department,
+        exclude_department=department,
+        price=price,
+        price_op=price_op
+    )
+
+    if positions is not None:
+        results = IndexResults(index, positions)
+    else:
+        try:
+            results = RowResults(await catalog.search_products(
+                price=price,
+                price_op=price_op,
+                department=department,
+                size=size,
+                category=category,
+                limit=SEARCH_FETCH_LIMIT
+            ))
+        except QueryBudgetExceeded:
+            # Too expensive in BigQuery: same LIKE filters over the snapshot
+            results = IndexResults(index, index.scan(ProductFilter.build(
+                category=category,
+                size=size,
+                price=price,
+                price_op=price_op,
+                department=department,
+                exclude_department=department if isinstance(department, str) else None,
+            )))
+
+    SEARCH_CACHE.set(key, results)
+    return results
+
+async def ranked_search_results(search: dict, user: dict) -> ResultSet:
+    """The cached matches for `search`, read best first for this shopper."""
+    results = await search_results(**search)
+
+    snapshot = await SNAPSHOT.get()
+    # SQL fallback rows, or a result set from before a snapshot refresh
+    if not isinstance(results, IndexResults) or results.index is not snapshot.name_index:
+        return results
+
+    location = None
+    if user.get("latitude") is not None and user.get("longitude") is not None:
+        location = (user["latitude"], user["longitude"])
+
+    key = (search_cache_key(**search), location)
+    ranked = RANKINGS.get(key)
+
+    # A ranking of an evicted result set would page stale positions
+    if ranked is None or ranked.results is not results:
+        with metrics.stage("rank"):
+            ranked = RankedResults(
+                results,
+                snapshot.ranker,
+                RANK_WEIGHTS,
+                query=search["category"],
+                price=search["price"],
+                location=location,
+            )
+        RANKINGS.set(key, ranked)
+
+    return ranked
+
+def department_mask(index, department) -> np.ndarray | None:
+    if not department:
+        return None
+    departments = department if isinstance(department, list) else [department]
+    return np.isin(index.department_values, departments)
 
-def get_store_details(store_id: int):
-    query = """
-    SELECT
-      dc.id,
-      dc.name,
-      dc.latitude,
-      dc.longitude,
-      COUNT(p.id) AS product_count,
-      MIN(p.retail_price) AS cheapest_price,
-      MAX(p.retail_price) AS most_expensive_price
-    FROM `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-    LEFT JOIN `bigquery-public-data.thelook_ecommerce.products` p
-      ON p.distribution_center_id = dc.id
-    WHERE dc.id = @store_id
-    GROUP BY dc.id, dc.name, dc.latitude, dc.longitude
+def vector_matches(snapshot, matches) -> list[dict]:
+    return [{**snapshot.name_index.rows[i], "score": round(score, 4)} for i, score in matches]
+
+async def similar_items(filters: dict, user: dict):
+    """
+    "Show similar items": the products nearest to what the last search
+    showed, or to its words when it found nothing. Same department;
+    size and price are let go.
     """
+    snapshot = await SNAPSHOT.get()
+    results = await ranked_search_results(filters, user)
+    mask = department_mask(snapshot.name_index, filters.get("department"))
+
+    with metrics.stage("vector_search"):
+        if isinstance(results, RankedResults) and results.total:
+            matches = snapshot.vectors.similar(results.positions(0, SEARCH_PAGE_SIZE), SEARCH_PAGE_SIZE, mask)
+        elif filters.get("category"):
+            matches = snapshot.vectors.search([filters["category"]], SEARCH_PAGE_SIZE, mask)[0]
+        else:
+            matches = []
 
-    results = list(client.query(
-        query,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("store_id", "INT64", store_id)
-            ]
-        )
-    ).result())
+    if not matches:
+        return {"reply": "I couldn’t find anything similar 😕"}
+
+    description = " ".join(describe_search(
+        filters.get("category"), [], filters.get("department"), None, None, None
+    )) or "your search"
 
-    if not results:
+    return attach_user_location({
+        "reply": f"Here are items similar to {description}.",
+        "products": [snapshot.name_index.rows[i] for i, _ in matches],
+    }, user)
+
+def extract_store_id(message: str) -> int | None:
+    return parse_message(message).number
+
+async def get_store_details(store_id: int):
+    s = (await SNAPSHOT.get()).store(store_id)
+
+    if not s:
         return {"reply": "Store not found 😕"}
 
-    s = results[0]
+    if not s.product_count:
+        return {"reply": f"🏪 {s.name}\n• Products: 0"}
+
+    lines = [f"🏪 {s.name}", f"• Products: {s.product_count}"]
+    # Products without a price count, but have no price to show
+    if s.cheapest_price is not None:
+        lines += [
+            f"• Cheapest item: ${round(s.cheapest_price, 2)}",
+            f"• Most expensive item: ${round(s.most_expensive_price, 2)}",
+        ]
 
     return {
-        "reply": (
-            f"🏪 {s.name}\n"
-            f"• Products: {s.product_count}\n"
-            f"• Cheapest item: ${round(s.cheapest_price, 2)}\n"
-            f"• Most expensive item: ${round(s.most_expensive_price, 2)}"
-        ),
+        "reply": "\n".join(lines),
         "stores": [{
             "id": s.id,
             "name": s.name,
             "latitude": s.latitude,
             "longitude": s.longitude,
-            "distance_km": 0
+            "distance_km": 0,
+            "categories": s.categories,
+            "departments": s.departments,
         }]
     }
 
-def search_products_in_store(store_id: int):
-    query = """
-    SELECT
-      p.id,
-      p.name,
-      p.brand,
-      p.category,
-      p.department,
-      p.retail_price,
-      p.sku,
-      dc.name AS distribution_name
-    FROM `bigquery-public-data.thelook_ecommerce.products` p
-    JOIN `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-      ON p.distribution_center_id = dc.id
-    WHERE dc.id = @store_id
-    ORDER BY p.retail_price ASC
-    LIMIT 10
+def store_product(row: dict) -> dict:
+    # The product fields a store listing shows
+    return {f: row.get(f) for f in STORE_PRODUCT_FIELDS}
+
+async def store_products_page(store_id: int, cursor: str | None = None, limit: int = STORE_PAGE_SIZE):
+    """
+    One page of a store's products, cheapest first. The cursor carries
+    the (price, id) of the last row shown, so later pages seek straight
+    to it in the snapshot's per-store price order.
     """
+    after = decode_cursor(cursor)
+    key = (after["price"], after["id"]) if after else None
 
-    products = list(client.query(
-        query,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("store_id", "INT64", store_id)
-            ]
-        )
-    ).result())
+    rows, next_key = (await SNAPSHOT.get()).name_index.store_page(store_id, after=key, limit=limit)
+    next_cursor = (
+        encode_cursor({"price": next_key[0], "id": next_key[1]})
+        if next_key else None
+    )
+
+    return [store_product(r) for r in rows], next_cursor
+
+async def search_products_in_store(store_id: int, state: dict | None = None):
+    s = (await SNAPSHOT.get()).store(store_id)
+    products, next_cursor = (
+        await store_products_page(store_id) if s else ([], None)
+    )
 
     if not products:
         return {"reply": "No products found in this store 😕"}
 
-    return {
+    response = {
         "reply": "🛍 Products available in this store:",
-        "products": [dict(p) for p in products]
+        "products": products
     }
 
+    if state is not None:
+        state["last_search"]["page"] = {
+            "kind": "store",
+            "store_id": store_id,
+            "cursor": next_cursor,
+        }
+    if next_cursor:
+        response["quick_replies"] = ["Show more"]
+
+    return response
+
+async def show_more(state: dict, user: dict):
+    page = state["last_search"].get("page")
+
+    if not page:
+        return {"reply": "Search for something first, then I can show you more 🙂"}
+
+    if page["kind"] == "store":
+        if not page["cursor"]:
+            return {"reply": "That’s everything in this store."}
+
+        products, page["cursor"] = await store_products_page(page["store_id"], page["cursor"])
+        response = {
+            "reply": "🛍 More products from this store:",
+            "products": products
+        }
+        if page["cursor"]:
+            response["quick_replies"] = ["Show more"]
+        return response
+
+    # Same filters, so this is the result set cached by the first page
+    results = await ranked_search_results(page["filters"], user)
+    offset = page["offset"]
+    with metrics.stage("rank"):
+        products = results.page(offset, SEARCH_PAGE_SIZE)
+
+    if not products:
+        return {"reply": "That’s everything I found."}
+
+    page["offset"] = offset + len(products)
+    response = {
+        "reply": "Here are more " + page["description"] + ".",
+        "products": products
+    }
+    if page["offset"] < results.total:
+        response["quick_replies"] = ["Show more"]
+
+    return attach_user_location(response, user)
+
+def describe_search(category, recipients, department, size, price, price_op, size_label="in size"):
+    """Words describing a product search: "jackets for men in size S under $50"."""
+    parts = []
+
+    if category:
+        parts.append(category + "s")
+
+    if recipients:
+        if recipients == ["parents"]:
+            parts.append("for parents")
+        else:
+            parts.append("for " + " and ".join(recipients))
+    elif department == "Women":
+        parts.append("for women")
+    elif department == "Men":
+        parts.append("for men")
+
+    if size:
+        parts.append(f"{size_label} {size.upper()}")
+
+    if price is not None:
+        if price_op == "under":
+            parts.append(f"under ${price}")
+        elif price_op == "over":
+            parts.append(f"over ${price}")
+        elif price_op == "exact":
+            parts.append(f"priced at ${price}")
+
+    return parts
+
 # -------------------------
 # CHAT ENDPOINT
 # -------------------------
+def resolve_session_id(request: Request) -> tuple[str, bool]:
+    session_id = (
+        request.headers.get(SESSION_HEADER)
+        or request.cookies.get(SESSION_COOKIE)
+    )
+
+    if valid_session_id(session_id):
+        return session_id, False
+    return new_session_id(), True
+
+def attach_session(response: Response, session_id: str, is_new: bool):
+    if is_new:
+        response.set_cookie(
+            SESSION_COOKIE, session_id,
+            max_age=int(SESSIONS.ttl), httponly=True, samesite="lax"
+        )
+    response.headers["X-Session-Id"] = session_id
+
 @app.get("/chat")
-def chat(message: str):
-    msg = message.lower()
+async def chat(
+    message: str,
+    request: Request,
+    x_user_id: int | None = Header(default=None)
+):
+    with metrics.stage("user"):
+        user = await resolve_user(x_user_id)
+
+    session_id, is_new = resolve_session_id(request)
+    with metrics.stage("session"):
+        state = await SESSIONS.load(session_id)
+
+    with metrics.stage("handler"):
+        reply = await handle_message(message, state, user)
+
+    with metrics.stage("session"):
+        await SESSIONS.save(session_id, state)
+
+    # Rendered here instead of by FastAPI so it is timed as its own stage
+    with metrics.stage("serialize"):
+        response = FastJSONResponse(reply)
+
+    attach_session(response, session_id, is_new)
+    return response
+
+# Records sent one event each, in this order, by /chat/stream
+STREAMED_RECORDS = [("stores", "store"), ("products", "product")]
+
+def encode_event(event: dict, fmt: str) -> str:
+    data = dumps(event).decode()
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@app.get("/chat/stream")
+async def chat_stream(
+    message: str,
+    request: Request,
+    format: str | None = None,
+    x_user_id: int | None = Header(default=None)
+):
+    """
+    Same answer as /chat, as a stream of events:
+    intent -> ack (product searches) -> one event per store / product -> done.
+    NDJSON by default; SSE with ?format=sse or Accept: text/event-stream.
+    """
+    if format is None:
+        accept = request.headers.get("accept", "")
+        format = "sse" if "text/event-stream" in accept else "ndjson"
+
+    user = await resolve_user(x_user_id)
+    session_id, is_new = resolve_session_id(request)
+    state = await SESSIONS.load(session_id)
+
+    async def events():
+        queue = asyncio.Queue()
+
+        # Known from the text alone: sent before any lookup runs
+        yield encode_event({"event": "intent", "intent": route(parse_message(message))}, format)
+
+        task = asyncio.create_task(handle_message(message, state, user, emit=queue.put))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        try:
+            while (event := await queue.get()) is not None:
+                yield encode_event(event, format)
+
+            reply = task.result()
+        except Exception:
+            logger.exception("Streaming chat failed")
+            yield encode_event({"event": "error", "detail": "Something went wrong"}, format)
+            return
+        finally:
+            if not task.done():
+                task.cancel()
+
+        await SESSIONS.save(session_id, state)
+
+        reply = dict(reply)
+        for key, name in STREAMED_RECORDS:
+            for record in reply.pop(key, None) or []:
+                yield encode_event({"event": name, name: record}, format)
+
+        yield encode_event({"event": "done", **reply}, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    response = StreamingResponse(events(), media_type=media_type)
+    response.headers["Cache-Control"] = "no-cache"
+    attach_session(response, session_id, is_new)
+    return response
+
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "5000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+
+async def run_batch_session(items, user_id, persist: bool, results: dict, limit: asyncio.Semaphore):
+    """One session's messages, in order, sharing its state."""
+    session_id = items[0][1].get("session_id")
+
+    try:
+        async with limit:
+            state = await SESSIONS.load(session_id) if persist else new_state()
+
+            for index, item in items:
+                message = item["message"]
+                entry = {"index": index, "session_id": session_id, "message": message}
+
+                # Own timer per message (this task's context only), so
+                # intents, stages and query telemetry aren't mixed up
+                metrics.start_request()
+
+                try:
+                    user = await resolve_user(item.get("user_id", user_id))
+                    entry["intent"] = route(parse_message(message))
+                    entry.update(await handle_message(message, state, user))
+                except HTTPException as e:
+                    entry["error"] = {"status": e.status_code, "detail": e.detail}
+                except QueryBudgetExceeded as e:
+                    logger.warning("Refused over-budget query: %s", e)
+                    entry["error"] = {"status": OVER_BUDGET_STATUS, "detail": OVER_BUDGET_DETAIL}
+                except Exception:
+                    logger.exception("Batch chat message %s failed", index)
+                    entry["error"] = {"status": 500, "detail": "Something went wrong"}
+
+                results[index].set_result(entry)
+
+            if persist:
+                await SESSIONS.save(session_id, state)
+    finally:
+        # Never leave the stream waiting on a message that won't run
+        for index, item in items:
+            if not results[index].done():
+                results[index].set_result({
+                    "index": index,
+                    "session_id": session_id,
+                    "message": item["message"],
+                    "error": {"status": 500, "detail": "Something went wrong"},
+                })
+
+@app.post("/chat/batch")
+async def chat_batch(
+    messages: list = Body(..., embed=True),
+    x_user_id: int | None = Header(default=None)
+):
+    """
+    Replays many messages at once. Each item is a message string or
+    {"message", "session_id"?, "user_id"?}. Messages of one session run
+    in order against its stored state; sessions (and messages without a
+    session, which get a fresh state each) run concurrently. Results are
+    streamed as NDJSON, one line per message, in input order.
+    """
+    if len(messages) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_MESSAGES} messages per batch")
+
+    items = []
+    for i, item in enumerate(messages):
+        if isinstance(item, str):
+            item = {"message": item}
+        if not isinstance(item, dict) or not isinstance(item.get("message"), str):
+            raise HTTPException(status_code=400, detail=f"Item {i} needs a message")
+        if item.get("session_id") is not None and not valid_session_id(item["session_id"]):
+            raise HTTPException(status_code=400, detail=f"Item {i} has an invalid session_id")
+        if item.get("user_id") is not None and not isinstance(item["user_id"], int):
+            raise HTTPException(status_code=400, detail=f"Item {i} has an invalid user_id")
+        items.append((i, item))
+
+    # Parse every distinct text once up front; handlers then hit the parser cache
+    for message in {item["message"] for _, item in items}:
+        parse_message(message)
+
+    # One catalog query for all the shoppers named in the batch
+    user_ids = {item.get("user_id", x_user_id) for _, item in items}
+    user_ids.discard(None)
+    if USER_ID is not None:
+        user_ids.add(USER_ID)
+    if user_ids:
+        await USERS.prefetch(user_ids)
+
+    groups = {}
+    for i, item in items:
+        groups.setdefault(item.get("session_id") or ("", i), []).append((i, item))
+
+    metrics.set_intent("batch")
+    loop = asyncio.get_running_loop()
+    results = {i: loop.create_future() for i, _ in items}
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    tasks = [
+        asyncio.create_task(run_batch_session(
+            group, x_user_id, isinstance(key, str), results, limit
+        ))
+        for key, group in groups.items()
+    ]
+
+    async def lines():
+        try:
+            for i, _ in items:
+                yield dumps(await results[i]) + b"\n"
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/stores/{store_id}/products")
+async def store_products(store_id: int, cursor: str | None = None, limit: int = STORE_PAGE_SIZE):
+    if (await SNAPSHOT.get()).store(store_id) is None:
+        raise HTTPException(status_code=404, detail="Store not found")
+
+    products, next_cursor = await store_products_page(store_id, cursor, max(1, min(limit, 100)))
+    return {"products": products, "next_cursor": next_cursor}
+
+@app.get("/products/search")
+async def product_text_search(q: str, limit: int = 10):
+    """Free-text search over name, brand, category and department."""
+    snapshot = await SNAPSHOT.get()
+    with metrics.stage("vector_search"):
+        matches = snapshot.vectors.search([q], max(1, min(limit, 100)))[0]
+    return {"products": vector_matches(snapshot, matches)}
+
+@app.get("/products/{product_id}/similar")
+async def similar_products(product_id: int, limit: int = 10):
+    snapshot = await SNAPSHOT.get()
+    position = snapshot.position_of(product_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    with metrics.stage("vector_search"):
+        matches = snapshot.vectors.similar([position], max(1, min(limit, 100)))
+    return {"products": vector_matches(snapshot, matches)}
+
+async def handle_message(message: str, state: dict, user: dict, emit=None):
+    with metrics.stage("parse"):
+        parsed = parse_message(message)
+    last_search = state["last_search"]
+    context = state["last_context"]
     is_quick_reply = (
         is_relax_price_intent(message)
-        and "filters" in LAST_SEARCH
+        and "filters" in last_search
     )
     # ================================
     # 🏬 STORE UI ACTIONS (HIGH PRIORITY)
     # ================================
     if message.startswith("store details"):
+        metrics.set_intent("store_details")
         store_id = extract_store_id(message)
-        return get_store_details(store_id)
+        return await get_store_details(store_id)
 
     if message.startswith("search store"):
+        metrics.set_intent("store_products")
         store_id = extract_store_id(message)
-        return search_products_in_store(store_id)
+        return await search_products_in_store(store_id, state)
+
+    # 📄 NEXT PAGE OF THE LAST RESULTS
+    if parsed.is_show_more:
+        metrics.set_intent("show_more")
+        return await show_more(state, user)
 
     department = None
-    prev_department = LAST_CONTEXT.get("departments")
+    prev_department = context.get("departments")
     # Only resolve recipients for real user messages, not quick replies
     if not is_quick_reply:
-        recipient_departments = resolve_recipient_departments(message)
+        recipient_departments = resolve_recipient_departments(message, context)
     else:
-        recipient_departments = LAST_CONTEXT.get("departments")
+        recipient_departments = context.get("departments")
     # 🔒 HARD FREEZE multi-recipient departments
     if isinstance(recipient_departments, list) and len(recipient_departments) > 1:
         department = recipient_departments
-        LAST_CONTEXT["department"] = recipient_departments  # 🔒 LOCK
+        context["department"] = recipient_departments  # 🔒 LOCK
     else:
-        LAST_CONTEXT["department"] = recipient_departments
+        context["department"] = recipient_departments
 
     has_recipient = bool(recipient_departments)
 
     if (
-        any(p in msg for p in ["him", "her"])
+        parsed.mentions_pronoun
         and not recipient_departments
     ):
+        metrics.set_intent("clarify")
         return {
             "reply": "Who are you referring to?"
         }
@@ -657,11 +1068,11 @@ def chat(message: str):
         and len(prev_department) == 2
         and len(recipient_departments) == 1
     ):
-        LAST_CONTEXT["department"] = recipient_departments
+        context["department"] = recipient_departments
         department = recipient_departments
 
-    if is_relax_price_intent(message) and "filters" in LAST_SEARCH:
-        filters = LAST_SEARCH["filters"]
+    if is_relax_price_intent(message) and "filters" in last_search:
+        filters = last_search["filters"]
 
         category = filters.get("category")
         size = filters.get("size")
@@ -669,7 +1080,7 @@ def chat(message: str):
         price = filters.get("price")
         price_op = filters.get("price_op")
 
-        action = message.lower()
+        action = parsed.lowered
 
         if action == "increase budget":
             price = None
@@ -683,46 +1094,20 @@ def chat(message: str):
             size = None
 
         elif action == "show similar items":
-            size = None
-            price = None
-            price_op = None
+            metrics.set_intent("similar_items")
+            return await similar_items(filters, user)
 
     # 🏷️ CHEAPEST NEARBY STORE
     if is_cheapest_store_intent(message):
-        if not user_has_location(USER):
+        metrics.set_intent("cheapest_store")
+        if not user_has_location(user):
             return {"reply": "I don’t have your location to find nearby stores."}
 
-        query = """
-        SELECT
-        dc.id,
-        dc.name,
-        dc.latitude,
-        dc.longitude,
-        MIN(p.retail_price) AS cheapest_price,
-        ROUND(
-            ST_DISTANCE(
-            ST_GEOGPOINT(dc.longitude, dc.latitude),
-            ST_GEOGPOINT(@user_lng, @user_lat)
-            ) / 1000,
-            2
-        ) AS distance_km
-        FROM `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-        JOIN `bigquery-public-data.thelook_ecommerce.products` p
-        ON p.distribution_center_id = dc.id
-        WHERE dc.latitude IS NOT NULL
-        AND dc.longitude IS NOT NULL
-        GROUP BY dc.id, dc.name, dc.latitude, dc.longitude
-        ORDER BY cheapest_price ASC, distance_km ASC
-        LIMIT 5
-        """
-
-        results = list(client.query(
-            query,
-            job_config=bigquery.QueryJobConfig(query_parameters=[
-                bigquery.ScalarQueryParameter("user_lat", "FLOAT64", USER["latitude"]),
-                bigquery.ScalarQueryParameter("user_lng", "FLOAT64", USER["longitude"]),
-            ])
-        ).result())
+        results = await find_cheapest_stores(
+            user["latitude"],
+            user["longitude"],
+            limit=5
+        )
 
         if not results:
             return {"reply": "I couldn’t find nearby stores 😕"}
@@ -732,28 +1117,29 @@ def chat(message: str):
 
         for i, s in enumerate(results, 1):
             reply += (
-                f"{i}. {s.name} — "
-                f"${round(s.cheapest_price, 2)} "
-                f"({s.distance_km} km)\n"
+                f"{i}. {s['name']} — "
+                f"${round(s['cheapest_price'], 2)} "
+                f"({s['distance_km']} km)\n"
             )
 
             stores.append({
-                "id": s.id,
-                "name": s.name,
-                "latitude": s.latitude,
-                "longitude": s.longitude,
-                "distance_km": float(s.distance_km),
-                "cheapest_price": float(s.cheapest_price),
+                "id": s["id"],
+                "name": s["name"],
+                "latitude": s["latitude"],
+                "longitude": s["longitude"],
+                "distance_km": float(s["distance_km"]),
+                "cheapest_price": float(s["cheapest_price"]),
             })
 
         return attach_user_location({
             "reply": reply,
             "stores": stores
-        })
+        }, user)
 
     # 🏪 CLOSEST STORE WITH PRODUCT
     if is_closest_store_with_product_intent(message):
-        if not user_has_location(USER):
+        metrics.set_intent("store_with_product")
+        if not user_has_location(user):
             return {
                 "reply": "I don’t have your location to find nearby stores."
             }
@@ -772,9 +1158,9 @@ def chat(message: str):
 
         limit = extract_nearest_store_limit(message)
 
-        stores = find_nearest_stores_with_product(
-            USER["latitude"],
-            USER["longitude"],
+        stores = await find_nearest_stores_with_product(
+            user["latitude"],
+            user["longitude"],
             product,
             limit=limit
         )
@@ -809,17 +1195,18 @@ def chat(message: str):
                 + "\n".join(lines)
             ),
             "stores": store_payload
-        })
+        }, user)
 
     # 🏪 CLOSEST STORE (plain + filtered + product)
     if is_closest_store_intent(message):
+        metrics.set_intent("closest_store")
 
-        if not user_has_location(USER):
+        if not user_has_location(user):
             return {
                 "reply": "Sorry, I don’t have your location to find nearby stores."
             }
 
-        filters = extract_store_filters(message, USER["gender"])
+        filters = extract_store_filters(message, user["gender"])
         limit = extract_nearest_store_limit(message)
 
         has_filters = any([
@@ -831,7 +1218,7 @@ def chat(message: str):
         ])
 
         # ❓ "closest store with this product"
-        if "this product" in message.lower() and not filters["product"]:
+        if parsed.mentions_this_product and not filters["product"]:
             return {
                 "reply": "Which product are you looking for? Please provide the product name."
             }
@@ -840,111 +1227,13 @@ def chat(message: str):
         # 🔎 FILTERED STORE SEARCH (JOIN products)
         # ======================================================
         if has_filters:
-            query = f"""
-            SELECT
-            dc.id AS store_id,
-            dc.name AS store_name,
-            dc.latitude,
-            dc.longitude,
-            ROUND(
-            ST_DISTANCE(
-            ST_GEOGPOINT(dc.longitude, dc.latitude),
-            ST_GEOGPOINT(@user_lng, @user_lat)
-            ) / 1000,
-            2
-            ) AS distance_km
-            FROM `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-            JOIN `bigquery-public-data.thelook_ecommerce.products` p
-            ON p.distribution_center_id = dc.id
-            WHERE dc.latitude IS NOT NULL
-            AND dc.longitude IS NOT NULL
-            """
-
-            params = [
-                bigquery.ScalarQueryParameter("user_lat", "FLOAT64", USER["latitude"]),
-                bigquery.ScalarQueryParameter("user_lng", "FLOAT64", USER["longitude"]),
-            ]
-
-            # 🎯 Product
-            if filters["product"]:
-                query += " AND LOWER(p.name) LIKE @product"
-                params.append(
-                    bigquery.ScalarQueryParameter(
-                        "product", "STRING", f"%{filters['product'].lower()}%"
-                    )
-                )
-
-            # 🧥 Category
-            if filters["category"]:
-                query += " AND LOWER(p.name) LIKE @category"
-                params.append(
-                    bigquery.ScalarQueryParameter(
-                        "category", "STRING", f"%{filters['category']}%"
-                    )
-                )
-
-            # 👕 Size
-            if filters["size"]:
-                query += " AND LOWER(p.name) LIKE @size"
-                params.append(
-                    bigquery.ScalarQueryParameter(
-                        "size", "STRING", f"%{filters['size']}%"
-                    )
-                )
-
-            # 💰 Price
-            if filters["price"] is not None:
-                if filters["price_op"] == "under":
-                    query += " AND p.retail_price <= @price"
-                elif filters["price_op"] == "over":
-                    query += " AND p.retail_price >= @price"
-                else:
-                    query += " AND p.retail_price BETWEEN @low AND @high"
-
-                if filters["price_op"] == "exact":
-                    params.extend([
-                        bigquery.ScalarQueryParameter("low", "FLOAT64", filters["price"] - 0.01),
-                        bigquery.ScalarQueryParameter("high", "FLOAT64", filters["price"] + 0.01),
-                    ])
-                else:
-                    params.append(
-                        bigquery.ScalarQueryParameter("price", "FLOAT64", filters["price"])
-                    )
-
-            # 🧍 Department
-            dept = filters["department"]
-
-            if isinstance(dept, list):
-                query += " AND p.department IN UNNEST(@dept_list)"
-                params.append(
-                    bigquery.ArrayQueryParameter("dept_list", "STRING", dept)
-                )
-            elif dept:
-                query += " AND p.department = @dept"
-                params.append(
-                    bigquery.ScalarQueryParameter("dept", "STRING", dept)
-                )
-
-            # 🚫 Extra safety: exclude opposite-gender keywords in product name
-            if isinstance(department, str):
-                if department == "Men":
-                    query += " AND LOWER(p.name) NOT LIKE '%ladies%'"
-                    query += " AND LOWER(p.name) NOT LIKE '%women%'"
-
-                elif department == "Women":
-                    query += " AND LOWER(p.name) NOT LIKE '%men%'"
-                    query += " AND LOWER(p.name) NOT LIKE '%male%'"
-
-            query += f"""
-            GROUP BY dc.id, dc.name, dc.latitude, dc.longitude
-            ORDER BY distance_km
-            LIMIT {limit}
-            """
-
-            stores = list(client.query(
-                query,
-                job_config=bigquery.QueryJobConfig(query_parameters=params)
-            ).result())
+            stores = await find_nearest_stores_matching(
+                user["latitude"],
+                user["longitude"],
+                filters,
+                exclude_department=department,
+                limit=limit
+            )
 
             if not stores:
                 return {
@@ -955,27 +1244,54 @@ def chat(message: str):
             store_payload = []
 
             for i, s in enumerate(stores, 1):
-                reply += f"{i}️⃣ {s.store_name} — {s.distance_km} km\n"
+                reply += f"{i}️⃣ {s['name']} — {s['distance_km']} km\n"
 
                 store_payload.append({
-                    "id": s.store_id,
-                    "name": s.store_name,
-                    "latitude": s.latitude,
-                    "longitude": s.longitude,
-                    "distance_km": float(s.distance_km),
+                    "id": s["id"],
+                    "name": s["name"],
+                    "latitude": s["latitude"],
+                    "longitude": s["longitude"],
+                    "distance_km": float(s["distance_km"]),
                 })
 
             return attach_user_location({
                 "reply": reply,
                 "stores": store_payload
-            })
+            }, user)
 
         # ======================================================
         # 📍 PLAIN NEAREST STORES (no product join)
         # ======================================================
-        stores = find_nearest_stores(
-            USER["latitude"],
-            USER["longitude"],
+        radius_km = extract_radius_km(message)
+
+        if radius_km is not None:
+            stores = await find_stores_within(
+                user["latitude"],
+                user["longitude"],
+                radius_km
+            )
+
+            if not stores:
+                return {
+                    "reply": f"I couldn’t find any stores within {round(radius_km)} km."
+                }
+
+            lines = [
+                f"{i}. {s['name']} — {round(s['distance_km'], 2)} km"
+                for i, s in enumerate(stores[:10], 1)
+            ]
+
+            return attach_user_location({
+                "reply": (
+                    f"📍 Here are the stores within {round(radius_km)} km of you:\n\n"
+                    + "\n".join(lines)
+                ),
+                "stores": stores[:10]
+            }, user)
+
+        stores = await find_nearest_stores(
+            user["latitude"],
+            user["longitude"],
             limit=limit
         )
 
@@ -997,7 +1313,7 @@ def chat(message: str):
                     "longitude": s["longitude"],
                     "distance_km": float(s["distance_km"]),
                 }]
-            })
+            }, user)
 
         lines = [
             f"{i}. {s['name']} — {round(s['distance_km'], 2)} km"
@@ -1021,13 +1337,16 @@ def chat(message: str):
                 + "\n".join(lines)
             ),
             "stores": store_payload
-        })
+        }, user)
 
     # 🛒 SHOW CART
     if is_show_cart_intent(message):
+        metrics.set_intent("cart")
+        view = await cart.revalidate(state, PRODUCTS)
         return {
-            "reply": "Here’s what’s currently in your cart 👇",
-            "action": "show_cart"
+            "reply": cart_reply(view, "Here’s what’s currently in your cart 👇"),
+            "action": "show_cart",
+            **view
         }
 
     # 🔍 Extract filters FIRST
@@ -1036,8 +1355,8 @@ def chat(message: str):
     gift_intent = is_gift_intent(message)
     # 🎁 NEW GIFT INTENT SHOULD RESET PREVIOUS RECIPIENT CONTEXT
     if gift_intent and recipient_departments is None:
-        LAST_CONTEXT["recipient"] = None
-        LAST_CONTEXT["department"] = None
+        context["recipient"] = None
+        context["department"] = None
 
     size = detect_size(message)
     category = detect_category_keyword(message)
@@ -1047,8 +1366,8 @@ def chat(message: str):
         department = recipient_departments  # 🔒 HARD LOCK
     elif gift_intent:
         department = None
-    elif LAST_CONTEXT.get("department"):
-        department = LAST_CONTEXT["department"]
+    elif context.get("department"):
+        department = context["department"]
     elif department:
         pass  # keep existing department
 
@@ -1057,16 +1376,16 @@ def chat(message: str):
         not department
         and not gift_intent
         and not has_recipient
-        and not LAST_CONTEXT.get("recipients")
+        and not context.get("recipients")
     ):
-        if USER.get("gender") == "M":
+        if user.get("gender") == "M":
             department = "Men"
-        elif USER.get("gender") == "F":
+        elif user.get("gender") == "F":
             department = "Women"
 
     # 💾 Save ONLY non-gift product searches
     if not is_quick_reply:
-        LAST_SEARCH["filters"] = {
+        last_search["filters"] = {
             "category": category,
             "size": size,
             "department": department,
@@ -1075,149 +1394,68 @@ def chat(message: str):
         }
     
     # 🔎 Extract possible product names
-    p1, p2 = extract_comparison_products(message)
+    names = extract_comparison_products(message, (await SNAPSHOT.get()).names)
 
     # 🆚 COMPARISON MODE
-    is_explicit_compare = "compare" in msg or "difference" in msg
-    is_implicit_compare = p1 and p2 and not has_search_filters(message)
+    is_explicit_compare = parsed.is_explicit_compare
+    is_implicit_compare = names and not has_search_filters(message)
 
     if is_explicit_compare or is_implicit_compare:
-        if not p1 or not p2:
+        metrics.set_intent("compare")
+        if not names:
             return {
                 "reply": "Which two products would you like me to compare? Please provide their full names."
             }
 
-        query = """
-        SELECT p.id, p.name, p.category, p.brand, p.department, p.retail_price, p.sku, p.distribution_center_id, dc.name AS distribution_name
-        FROM `bigquery-public-data.thelook_ecommerce.products` p
-        LEFT JOIN `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-        ON p.distribution_center_id = dc.id
-        WHERE
-        LOWER(p.name) LIKE @p1
-        OR LOWER(p.name) LIKE @p2
-        QUALIFY ROW_NUMBER() OVER (PARTITION BY p.id ORDER BY p.id) = 1
-        """
-
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("p1", "STRING", f"%{p1.lower()}%"),
-                bigquery.ScalarQueryParameter("p2", "STRING", f"%{p2.lower()}%"),
-            ]
-        )
-
-        results = client.query(query, job_config=job_config).result()
-        products = [dict(row) for row in results]
+        # Names resolve to product ids in memory; no catalog scan
+        with metrics.stage("resolve"):
+            products = (await SNAPSHOT.get()).resolve_products(names)
 
-        if len(products) < 2:
+        if None in products or len({p["id"] for p in products}) < len(products):
             return {
                 "reply": "I couldn’t confidently match both products. Please try clearer product names."
+                if len(names) == 2 else
+                "I couldn’t confidently match all the products. Please try clearer product names."
             }
 
         return {
-            "reply": "Here’s a comparison of the two products you mentioned:",
+            "reply": "Here’s a comparison of the two products you mentioned:"
+            if len(products) == 2 else
+            f"Here’s a comparison of the {len(products)} products you mentioned:",
             "products": products
         }
 
-    # 🧱 Build dynamic SQL
-    query = """
-    SELECT p.id, p.name, p.category, p.brand, p.department, p.retail_price, p.sku, p.distribution_center_id, dc.name AS distribution_name
-    FROM `bigquery-public-data.thelook_ecommerce.products` p
-    LEFT JOIN `bigquery-public-data.thelook_ecommerce.distribution_centers` dc
-    ON p.distribution_center_id = dc.id
-    WHERE 1=1
-    """
-    params = []
-
-    # 💰 Price logic
-    if price is not None:
-        if price_op == "under":
-            query += " AND p.retail_price <= @price"
-            params.append(
-                bigquery.ScalarQueryParameter("price", "FLOAT64", price)
-            )
+    # 🔎 Product search
+    metrics.set_intent("quick_reply" if is_quick_reply else parsed.intent)
 
-        elif price_op == "over":
-            query += " AND p.retail_price >= @price"
-            params.append(
-                bigquery.ScalarQueryParameter("price", "FLOAT64", price)
-            )
-
-        elif price_op == "exact":
-            query += " AND p.retail_price BETWEEN @low AND @high"
-            params.extend([
-                bigquery.ScalarQueryParameter("low", "FLOAT64", price - 0.01),
-                bigquery.ScalarQueryParameter("high", "FLOAT64", price + 0.01),
-            ])
-
-    # 👕 Department
-    if isinstance(department, list):
-        query += " AND p.department IN UNNEST(@dept_list)"
-        params.append(
-            bigquery.ArrayQueryParameter("dept_list", "STRING", department)
-        )
-    elif department:
-        query += " AND p.department = @dept"
-        params.append(
-            bigquery.ScalarQueryParameter("dept", "STRING", department)
+    if emit:
+        # Streaming clients can show this while the search runs
+        looking_for = describe_search(
+            category, context.get("recipients", []), department,
+            size, price, price_op
         )
-    # 🚫 Extra safety: exclude opposite-gender keywords in product name
-    if isinstance(department, str):
-        if department == "Men":
-            query += " AND LOWER(p.name) NOT LIKE '%ladies%'"
-            query += " AND LOWER(p.name) NOT LIKE '%women%'"
-
-        elif department == "Women":
-            query += " AND LOWER(p.name) NOT LIKE '%men%'"
-            query += " AND LOWER(p.name) NOT LIKE '%male%'"
-
-    # 📏 Size (from name)
-    if size:
-        query += " AND LOWER(p.name) LIKE @size"
-        params.append(
-            bigquery.ScalarQueryParameter("size", "STRING", f"%{size}%")
-        )
-
-    # 🧥 Category
-    if category:
-        query += " AND LOWER(p.name) LIKE @category"
-        params.append(
-            bigquery.ScalarQueryParameter("category", "STRING", f"%{category}%")
-        )
-
-    query += " LIMIT 5"
+        await emit({
+            "event": "ack",
+            "reply": "Looking for " + (" ".join(looking_for) or "products") + "…"
+        })
 
-    job_config = bigquery.QueryJobConfig(query_parameters=params)
-    results = client.query(query, job_config=job_config).result()
-    products = [dict(row) for row in results]
+    search = {
+        "price": price,
+        "price_op": price_op,
+        "department": department,
+        "size": size,
+        "category": category,
+    }
+    results = await ranked_search_results(search, user)
+    with metrics.stage("rank"):
+        products = results.page(0, SEARCH_PAGE_SIZE)
 
     # ❌ NO RESULTS
     if not products:
-        reasons = []
-
-        if category:
-            reasons.append(category + "s")
-
-        recipients = LAST_CONTEXT.get("recipients", [])
-        if recipients:
-            if recipients == ["parents"]:
-                reasons.append("for parents")
-            else:
-                reasons.append("for " + " and ".join(recipients))
-        elif department == "Women":
-            reasons.append("for women")
-        elif department == "Men":
-            reasons.append("for men")
-
-        if size:
-            reasons.append(f"size {size.upper()}")
-
-        if price is not None:
-            if price_op == "under":
-                reasons.append(f"under ${price}")
-            elif price_op == "over":
-                reasons.append(f"over ${price}")
-            elif price_op == "exact":
-                reasons.append(f"priced at ${price}")
+        reasons = describe_search(
+            category, context.get("recipients", []), department,
+            size, price, price_op, size_label="size"
+        )
 
         reason_text = " ".join(reasons)
 
@@ -1234,174 +1472,282 @@ def chat(message: str):
         }
 
     # ✅ RESULTS FOUND
-    reply_parts = ["Here are"]
+    reply_parts = ["Here are"] + describe_search(
+        category, context.get("recipients", []), department,
+        size, price, price_op
+    )
 
-    if category:
-        reply_parts.append(category + "s")
+    reply = " ".join(reply_parts) + "."
 
-    recipients = LAST_CONTEXT.get("recipients", [])
-    if recipients:
-        if recipients == ["parents"]:
-            reply_parts.append("for parents")
-        else:
-            reply_parts.append("for " + " and ".join(recipients))
-    elif department == "Women":
-        reply_parts.append("for women")
-    elif department == "Men":
-        reply_parts.append("for men")
+    response = {
+        "reply": reply,
+        "products": products
+    }
 
-    if size:
-        reply_parts.append(f"in size {size.upper()}")
+    # Remember where this result set ends so "show more" can continue it
+    last_search["page"] = {
+        "kind": "search",
+        "filters": search,
+        "offset": len(products),
+        "description": " ".join(reply_parts[1:]) or "products",
+    }
+    if len(products) < results.total:
+        response["quick_replies"] = ["Show more"]
 
-    if price is not None:
-        if price_op == "under":
-            reply_parts.append(f"under ${price}")
-        elif price_op == "over":
-            reply_parts.append(f"over ${price}")
-        elif price_op == "exact":
-            reply_parts.append(f"priced at ${price}")
+    return attach_user_location(response, user)
 
-    reply = " ".join(reply_parts) + "."
+def cart_reply(view: dict, heading: str | None = None) -> str:
+    if not view["cart"]:
+        reply = "🛒 Your cart is empty."
+    else:
+        reply = heading or f"🛒 You have {view['count']} item(s) in your cart:"
 
-    return attach_user_location({
-        "reply": reply,
-        "products": products
-    })
+    repriced = sum(1 for c in view["changes"] if c["change"] == "price")
+    removed = len(view["changes"]) - repriced
+
+    if repriced:
+        reply += f"\n• Prices changed for {repriced} item(s) since you added them."
+    if removed:
+        reply += f"\n• {removed} item(s) are no longer available and were removed."
+
+    return reply
+
+async def cart_response(request: Request, update=None, status_code: int = 200) -> FastJSONResponse:
+    """Runs `update(state)` on the session's cart, then replies with the revalidated cart."""
+    session_id, is_new = resolve_session_id(request)
+    state = await SESSIONS.load(session_id)
+
+    if update is not None:
+        await update(state)
+
+    view = await cart.revalidate(state, PRODUCTS)
+    await SESSIONS.save(session_id, state)
+
+    response = FastJSONResponse({"reply": cart_reply(view), **view}, status_code=status_code)
+    attach_session(response, session_id, is_new)
+    return response
+
+@app.get("/cart")
+async def get_cart(request: Request):
+    return await cart_response(request)
+
+@app.post("/cart/items")
+async def add_cart_item(
+    request: Request,
+    product_id: int = Body(..., embed=True),
+    quantity: int = Body(1, embed=True)
+):
+    if quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+
+    product = await PRODUCTS.get(product_id)
+    if product is None:
+        raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+
+    async def add(state):
+        cart.add_item(state, product, quantity)
+
+    return await cart_response(request, add)
+
+@app.delete("/cart/items/{product_id}")
+async def remove_cart_item(product_id: int, request: Request):
+    async def remove(state):
+        if not cart.remove_item(state, product_id):
+            raise HTTPException(status_code=404, detail=f"Product {product_id} is not in the cart")
+
+    return await cart_response(request, remove)
+
+async def fill_cart(state: dict, items: list):
+    """Replaces the session cart with a client-side cart (older clients)."""
+    wanted = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            raise HTTPException(status_code=400, detail="Cart items need an id")
+        wanted[item["id"]] = item
+
+    cart.cart_items(state).clear()
+    current = await PRODUCTS.get_many(wanted)
+
+    for product_id, item in wanted.items():
+        if product_id not in current:
+            continue
+
+        # Keep the price the shopper saw, so a change gets reported
+        seen = item.get("retail_price")
+        if not isinstance(seen, (int, float)):
+            seen = current[product_id]["retail_price"]
+
+        quantity = item.get("quantity")
+        quantity = quantity if isinstance(quantity, int) and quantity > 0 else 1
+
+        cart.add_item(state, {**current[product_id], "retail_price": seen}, quantity)
 
 @app.post("/cart")
-def show_cart(cart: list = Body(...)):
-    if not cart:
-        return {
-            "reply": "🛒 Your cart is empty.",
-            "cart": []
-        }
+async def replace_cart(request: Request, items: list = Body(...)):
+    async def replace(state):
+        await fill_cart(state, items)
 
-    return {
-        "reply": f"🛒 You have {len(cart)} item(s) in your cart:",
-        "cart": cart
-    }
+    return await cart_response(request, replace)
 
 @app.post("/checkout")
-async def checkout(request: Request):
+async def checkout(request: Request, x_user_id: int | None = Header(default=None)):
+    user = await resolve_user(x_user_id)
+
     try:
-        data = await request.json()
+        data = await request.json() if await request.body() else {}
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    cart = data.get("cart")
+    session_id, is_new = resolve_session_id(request)
+    state = await SESSIONS.load(session_id)
+
+    # Clients that keep the cart themselves still send it along
+    if not cart.cart_items(state) and isinstance(data, dict) and isinstance(data.get("cart"), list):
+        await fill_cart(state, data["cart"])
+
+    # Prices straight from the catalog: the cache may be up to a TTL stale
+    view = await cart.revalidate(state, PRODUCTS, fresh=True)
+    await SESSIONS.save(session_id, state)
+
+    if view["changes"]:
+        # Never charge a price the shopper hasn't seen
+        response = FastJSONResponse(
+            {
+                "detail": "Your cart changed. Please review it before checking out.",
+                "reply": cart_reply(view),
+                **view,
+            },
+            status_code=409
+        )
+        attach_session(response, session_id, is_new)
+        return response
 
-    if not isinstance(cart, list) or len(cart) == 0:
+    if not view["cart"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
-    fake_order_id = int(datetime.utcnow().timestamp())
+    # One local transaction; analytics gets the order later (write-behind)
+    # Unit costs stay out of the cart view; the rows were just refetched
+    products = await PRODUCTS.get_many(line["id"] for line in view["cart"])
+    costs = {i: p.get("cost") for i, p in products.items()}
+
+    with metrics.stage("order"):
+        order = await ORDERS.place_order(user, view["cart"], costs)
+    cart.cart_items(state).clear()
+    await SESSIONS.save(session_id, state)
+
+    response = FastJSONResponse({
+        "order_id": order["order_id"],
+        "total": order["total"],
+        "message": "✅ Order placed successfully"
+    })
+    attach_session(response, session_id, is_new)
+    return response
+
+# -------------------------
+# ADMIN
+# -------------------------
+def require_admin(token: str | None):
+    # Fail closed: without a configured token the admin API is off
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin API disabled: ADMIN_TOKEN is not set")
+    if token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/admin/cache")
+async def cache_stats(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return {
+        "search": {
+            **SEARCH_CACHE.stats(),
+            "keys": list(SEARCH_CACHE.keys()),
+            "in_flight": SEARCHES.stats(),
+        },
+        "rankings": RANKINGS.stats(),
+        "products": PRODUCTS.stats(),
+    }
+
+@app.delete("/admin/cache")
+async def flush_cache(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return {"flushed": clear_search_caches()}
+
+@app.get("/admin/snapshot")
+async def snapshot_stats(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return SNAPSHOT.stats()
+
+@app.post("/admin/snapshot/refresh")
+async def refresh_snapshot(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
 
+    await SNAPSHOT.refresh()
+    return SNAPSHOT.stats()
+
+@app.get("/admin/users")
+async def user_cache_stats(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return USERS.stats()
+
+@app.post("/admin/users/prefetch")
+async def prefetch_users(
+    user_ids: list[int] = Body(..., embed=True),
+    x_admin_token: str | None = Header(default=None)
+):
+    require_admin(x_admin_token)
+
+    users = await USERS.prefetch(user_ids)
     return {
-        "order_id": fake_order_id,
-        "message": "✅ Order placed successfully (demo mode)"
+        "found": sorted(users),
+        "missing": sorted(set(user_ids) - set(users)),
     }
 
-##Enable Billing in gcloud to make real checkout work
-# @app.post("/checkout")
-# async def checkout(request: Request):
-#     data = await request.json()
-#     cart = data["cart"]
-
-#     num_of_item = len(cart)
-
-#     # 1️⃣ Insert order
-#     order_query = """
-#     INSERT INTO `bigquery-public-data.thelook_ecommerce.orders`
-#       (user_id, status, gender, created_at, num_of_item)
-#     VALUES
-#       (@user_id, 'Processing', @gender, CURRENT_TIMESTAMP(), @num)
-#     """
-
-#     job_config = bigquery.QueryJobConfig(
-#         query_parameters=[
-#             bigquery.ScalarQueryParameter("user_id", "INT64", USER["id"]),
-#             bigquery.ScalarQueryParameter("gender", "STRING", USER["gender"]),
-#             bigquery.ScalarQueryParameter("num", "INT64", num_of_item),
-#         ]
-#     )
-
-#     client.query(order_query, job_config=job_config).result()
-
-#     # 2️⃣ Get order_id
-#     order_id = client.query("""
-#     SELECT order_id
-#     FROM `bigquery-public-data.thelook_ecommerce.orders`
-#     WHERE user_id = @user_id
-#     ORDER BY created_at DESC
-#     LIMIT 1
-#     """, job_config=bigquery.QueryJobConfig(
-#         query_parameters=[
-#             bigquery.ScalarQueryParameter("user_id", "INT64", USER["id"])
-#         ]
-#     )).result().to_dataframe().iloc[0]["order_id"]
-
-#     # 3️⃣ Loop products
-#     for p in cart:
-#         # inventory_items
-#         inventory_query = """
-#         INSERT INTO `bigquery-public-data.thelook_ecommerce.inventory_items`
-#           (product_id, created_at, cost, product_retail_price,
-#            product_name, product_brand, product_category,
-#            product_department, product_sku, product_distribution_center_id)
-#         VALUES
-#           (@pid, CURRENT_TIMESTAMP(), @cost, @price,
-#            @name, @brand, @category, @dept, @sku, @dc)
-#         """
-
-#         inventory_config = bigquery.QueryJobConfig(
-#             query_parameters=[
-#                 bigquery.ScalarQueryParameter("pid", "INT64", p["id"]),
-#                 bigquery.ScalarQueryParameter("cost", "FLOAT64", p.get("cost", 0)),
-#                 bigquery.ScalarQueryParameter("price", "FLOAT64", p["retail_price"]),
-#                 bigquery.ScalarQueryParameter("name", "STRING", p["name"]),
-#                 bigquery.ScalarQueryParameter("brand", "STRING", p["brand"]),
-#                 bigquery.ScalarQueryParameter("category", "STRING", p["category"]),
-#                 bigquery.ScalarQueryParameter("dept", "STRING", p["department"]),
-#                 bigquery.ScalarQueryParameter("sku", "STRING", p["sku"]),
-#                 bigquery.ScalarQueryParameter("dc", "INT64", p["distribution_center_id"]),
-#             ]
-#         )
-
-#         client.query(inventory_query, job_config=inventory_config).result()
-
-#         inventory_id = client.query("""
-#           SELECT id
-#             FROM `bigquery-public-data.thelook_ecommerce.inventory_items`
-#             WHERE product_id = @pid
-#             ORDER BY created_at DESC
-#             LIMIT 1
-#         """, job_config=bigquery.QueryJobConfig(
-#             query_parameters=[
-#                 bigquery.ScalarQueryParameter("pid", "INT64", p["id"])
-#             ]
-#         )).result().to_dataframe().iloc[0]["id"]
-
-#         # order_items
-#         order_item_query = """
-#         INSERT INTO `bigquery-public-data.thelook_ecommerce.order_items`
-#           (order_id, user_id, product_id, inventory_item_id,
-#            status, sale_price, created_at)
-#         VALUES
-#           (@oid, @uid, @pid, @iid,
-#            'Processing', @price, CURRENT_TIMESTAMP())
-#         """
-
-#         client.query(order_item_query, job_config=bigquery.QueryJobConfig(
-#             query_parameters=[
-#                 bigquery.ScalarQueryParameter("oid", "INT64", order_id),
-#                 bigquery.ScalarQueryParameter("uid", "INT64", USER["id"]),
-#                 bigquery.ScalarQueryParameter("pid", "INT64", p["id"]),
-#                 bigquery.ScalarQueryParameter("iid", "INT64", inventory_id),
-#                 bigquery.ScalarQueryParameter("price", "FLOAT64", p["retail_price"]),
-#             ]
-#         )).result()
-
-#     return {"order_id": order_id}
+@app.get("/admin/queries")
+async def query_stats(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    # Executions and BigQuery cache hits per canonical query fingerprint
+    return catalog.query_stats.stats()
+
+@app.get("/admin/orders")
+async def order_stats(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return {
+        **ORDERS.stats(),
+        "export": ORDER_EXPORTER.stats() if ORDER_EXPORTER else None,
+    }
+
+@app.post("/admin/orders/export")
+async def export_orders(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    if not ORDER_EXPORTER:
+        raise HTTPException(status_code=409, detail="Set ORDER_ANALYTICS_DATASET to export orders")
+    return {"exported": await ORDER_EXPORTER.flush()}
+
+@app.get("/admin/costs")
+async def query_costs(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    # Bytes, slot-ms, cache hits and refusals per intent (BigQuery only)
+    guard = getattr(catalog, "cost_guard", None)
+    return guard.stats() if guard else {"backend": catalog.name}
+
+@app.get("/admin/sessions")
+async def session_stats(x_admin_token: str | None = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return await SESSIONS.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
\ No newline at end of file
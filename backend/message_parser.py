@@ -0,0 +1,483 @@
+"""
+Single-pass chat message parser.
+
+Every keyword list the chat cares about (intents, sizes, categories,
+recipients, pronouns, store phrases) is compiled into one Aho-Corasick
+automaton, so a message is scanned once no matter how many keywords
+there are. Numbers (price, store count / id, radius) come from one
+precompiled regex. The result is an immutable ParsedMessage that the
+helper functions in main.py read from.
+"""
+import re
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+
+# -------------------------
+# KEYWORDS
+# -------------------------
+GIFT_INTENT_KEYWORDS = ["gift", "present", "surprise"]
+COMPARE_KEYWORDS = ["compare", "difference"]
+PRICE_INTENT_KEYWORDS = ["under"]
+SIZE_INTENT_KEYWORDS = ["small", "medium", "large", "xl", "xxl"]
+
+SHOW_CART_KEYWORDS = [
+    "show cart",
+    "see cart",
+    "view cart",
+    "my cart",
+    "items in cart",
+    "show me cart",
+    "show me items",
+    "let me see my cart",
+]
+
+GIFT_KEYWORDS = [
+    "gift", "present", "buy for", "for my",
+    "brother", "sister", "girlfriend", "boyfriend",
+    "wife", "husband", "mom", "dad", "father", "mother"
+]
+
+EXPLICIT_RECIPIENT_KEYWORDS = [
+    "for my father", "for my dad", "for my brother",
+    "for my husband", "for my son",
+    "for my mother", "for my mom", "for my sister",
+    "for my wife", "for my daughter"
+]
+
+# Quick-reply buttons; matched on the whole message, not a substring
+RELAX_PRICE_ACTIONS = frozenset([
+    "increase budget",
+    "raise budget",
+    "higher budget",
+    "remove price limit",
+    "remove size filter",
+    "show similar items"
+])
+
+CLOSEST_STORE_WITH_PRODUCT_KEYWORDS = [
+    "closest store with",
+    "nearest store with",
+    "closest shop with",
+    "nearest shop with"
+]
+
+CLOSEST_STORE_KEYWORDS = [
+    "closest store",
+    "nearest store",
+    "closest shop",
+    "nearest shop",
+    "closest distribution",
+    "nearest distribution",
+    "where is the closest store",
+    "where is nearest store",
+    "stores within",
+    "store within"
+]
+
+CHEAPEST_STORE_KEYWORDS = [
+    "store", "stores", "shop", "nearby", "nearest", "closest"
+]
+
+FILTER_KEYWORDS = [
+    "$", "under", "over", "below", "above", "less than", "more than",
+    "small", "medium", "large", "xl", "xxl",
+    "jacket", "coat", "hoodie", "sweater", "shirt", "dress", "pants"
+]
+
+OVER_KEYWORDS = ["over", "above", "more than"]
+UNDER_KEYWORDS = ["under", "below", "less than"]
+
+SIZE_MAP = {
+    "small": "s",
+    "medium": "m",
+    "large": "l",
+    "xl": "xl",
+    "xxl": "xxl",
+}
+
+CATEGORY_KEYWORDS = ["jacket", "coat", "hoodie", "sweater", "shirt", "dress", "pants"]
+
+# Phrases stripped before looking for a product in store searches
+STORE_SEARCH_PHRASES = [
+    "closest store with",
+    "nearest store with",
+    "closest shop with",
+    "nearest shop with",
+    "closest store",
+    "nearest store",
+    "closest",
+    "nearest",
+]
+
+STORE_SEARCH_PHRASE_SET = frozenset(STORE_SEARCH_PHRASES)
+STORE_SEARCH_PHRASE_RE = re.compile(
+    "|".join(re.escape(p) for p in STORE_SEARCH_PHRASES), re.IGNORECASE
+)
+
+STORE_SEARCH_CATEGORIES = [
+    "winter jacket", "winter jackets",
+    "jacket", "jackets",
+    "coat", "coats",
+    "hoodie", "hoodies",
+    "sweater", "sweaters",
+    "shirt", "shirts",
+    "dress", "pants"
+]
+
+WOMEN_KEYWORDS = ["girlfriend", "wife", "mother", "mom", "sister", "grandmother"]
+MEN_KEYWORDS = ["boyfriend", "man", "father", "dad", "son", "grandfather", "him"]
+
+FEMALE_TARGETS = [
+    "girlfriend", "wife", "mother", "mom",
+    "sister", "daughter", "grandmother"
+]
+
+MALE_TARGETS = [
+    "boyfriend", "husband", "father", "dad",
+    "brother", "son", "grandfather", "him"
+]
+
+RECIPIENT_MAP = {
+    # Male
+    "father": "Men",
+    "dad": "Men",
+    "brother": "Men",
+    "son": "Men",
+    "husband": "Men",
+    "grandfather": "Men",
+
+    # Female
+    "mother": "Women",
+    "mom": "Women",
+    "sister": "Women",
+    "daughter": "Women",
+    "wife": "Women",
+    "grandmother": "Women",
+}
+
+PRONOUN_MAP = {
+    "him": "Men",
+    "his": "Men",
+    "her": "Women",
+    "hers": "Women",
+}
+
+SHOW_MORE_KEYWORDS = ["show more", "see more", "load more", "more results", "next page"]
+
+# Words a paging request may carry besides the phrase itself; anything
+# else ("show more jackets under $50") makes it a new search
+SHOW_MORE_FILLER = {
+    "please", "pls", "ok", "okay", "yes", "can", "could", "you", "i", "we",
+    "want", "to", "see", "me", "us", "some", "the", "of", "them", "those",
+    "these", "results", "items", "products", "page", "more", "next",
+}
+SHOW_MORE_WORD_RE = re.compile(r"[a-z0-9$]+")
+
+OTHER_KEYWORDS = ["cheapest", "parents", "this product", "filters"]
+
+ALL_KEYWORDS = sorted(set(
+    GIFT_INTENT_KEYWORDS
+    + COMPARE_KEYWORDS
+    + PRICE_INTENT_KEYWORDS
+    + SIZE_INTENT_KEYWORDS
+    + SHOW_CART_KEYWORDS
+    + GIFT_KEYWORDS
+    + EXPLICIT_RECIPIENT_KEYWORDS
+    + CLOSEST_STORE_WITH_PRODUCT_KEYWORDS
+    + CLOSEST_STORE_KEYWORDS
+    + CHEAPEST_STORE_KEYWORDS
+    + FILTER_KEYWORDS
+    + OVER_KEYWORDS
+    + UNDER_KEYWORDS
+    + list(SIZE_MAP)
+    + CATEGORY_KEYWORDS
+    + STORE_SEARCH_PHRASES
+    + STORE_SEARCH_CATEGORIES
+    + WOMEN_KEYWORDS
+    + MEN_KEYWORDS
+    + FEMALE_TARGETS
+    + MALE_TARGETS
+    + list(RECIPIENT_MAP)
+    + list(PRONOUN_MAP)
+    + SHOW_MORE_KEYWORDS
+    + OTHER_KEYWORDS
+))
+
+# Price and radius are lookaheads so their digits are still seen as plain
+# numbers (store count / id), exactly like the old separate searches.
+NUMBERS_RE = re.compile(
+    r"\$(?=(?P<price>\d+(\.\d+)?))"
+    r"|within\s+(?=(?P<radius>\d+(?:\.\d+)?)\s*(?P<unit>km|kilometers?|kilometres?|mi|miles?)\b)"
+    r"|\b(?P<number>\d+)\b"
+)
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton reporting every (overlapping) keyword hit."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.output[state] += (keyword,)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] += self.output[self.fail[nxt]]
+
+    def find(self, text: str):
+        """(start, keyword) for every occurrence, in order of end position."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        hits = []
+
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+
+            for keyword in output[state]:
+                hits.append((i - len(keyword) + 1, keyword))
+
+        return hits
+
+
+MATCHER = KeywordMatcher(ALL_KEYWORDS)
+
+
+@dataclass(frozen=True)
+class ParsedMessage:
+    text: str
+    lowered: str
+    keywords: frozenset
+
+    intent: str
+    is_show_cart: bool
+    is_gift: bool
+    has_explicit_recipient: bool
+    is_relax_price: bool
+    is_closest_store_with_product: bool
+    is_closest_store: bool
+    is_cheapest_store: bool
+    is_explicit_compare: bool
+    is_show_more: bool
+    has_search_filters: bool
+    mentions_pronoun: bool
+    mentions_this_product: bool
+
+    price: float | None
+    price_op: str | None
+    size: str | None
+    category: str | None
+    number: int | None
+    radius_km: float | None
+
+    has_parents: bool
+    recipients: tuple
+    recipient_departments: tuple
+    pronoun_departments: tuple
+    gender_department: str | None
+    target_gender: str | None
+    store_product: str | None
+
+    def has(self, keyword: str) -> bool:
+        return keyword in self.keywords
+
+
+def _is_show_more(lowered: str, keywords) -> bool:
+    """A paging phrase and nothing else that could be a search of its own."""
+    if not any(k in keywords for k in SHOW_MORE_KEYWORDS):
+        return False
+
+    for phrase in SHOW_MORE_KEYWORDS:
+        lowered = lowered.replace(phrase, " ")
+    return all(w in SHOW_MORE_FILLER for w in SHOW_MORE_WORD_RE.findall(lowered))
+
+
+def _first(candidates, keywords, default=None):
+    return next((c for c in candidates if c in keywords), default)
+
+
+def _store_product(original: str) -> str | None:
+    # Drop the store phrases, then look for a category, then for a
+    # product name written in capitalized words.
+    lowered = original.lower()
+
+    if len(lowered) == len(original):
+        hits = MATCHER.find(lowered)
+        removed = bytearray(len(original))
+
+        for start, keyword in hits:
+            if keyword in STORE_SEARCH_PHRASE_SET:
+                removed[start:start + len(keyword)] = b"\x01" * len(keyword)
+
+        kept = {
+            keyword for start, keyword in hits
+            if not any(removed[start:start + len(keyword)])
+        }
+        cleaned = "".join(
+            ch for ch, gone in zip(original, removed) if not gone
+        ).strip()
+    else:
+        # lower() changed the length (rare unicode): spans don't line up
+        cleaned = STORE_SEARCH_PHRASE_RE.sub("", original).strip()
+        kept = {keyword for _, keyword in MATCHER.find(cleaned.lower())}
+
+    category = _first(STORE_SEARCH_CATEGORIES, kept)
+    if category:
+        return category
+
+    product_words = [
+        w for w in cleaned.split()
+        if w[:1].isupper() and len(w) > 2
+    ]
+
+    if len(product_words) >= 3:
+        return " ".join(product_words)
+
+    return None
+
+
+@lru_cache(maxsize=4096)
+def parse_message(message: str) -> ParsedMessage:
+    lowered = message.lower()
+    hits = MATCHER.find(lowered)
+    keywords = frozenset(k for _, k in hits)
+
+    # 🔢 Numbers
+    price = None
+    price_op = None
+    number = None
+    radius_km = None
+
+    for m in NUMBERS_RE.finditer(lowered):
+        if m.group("price") is not None:
+            if price is None:
+                price = float(m.group("price"))
+        elif m.group("radius") is not None:
+            if radius_km is None:
+                radius_km = float(m.group("radius"))
+                if m.group("unit").startswith("mi"):
+                    radius_km *= 1.609344
+        elif number is None:
+            number = int(m.group("number"))
+
+    if price is not None:
+        if any(k in keywords for k in OVER_KEYWORDS):
+            price_op = "over"
+        elif any(k in keywords for k in UNDER_KEYWORDS):
+            price_op = "under"
+        else:
+            # "$4 jackets", "priced $4"
+            price_op = "exact"
+
+    # 🎯 Intent
+    if any(k in keywords for k in GIFT_INTENT_KEYWORDS):
+        intent = "gift"
+    elif any(k in keywords for k in COMPARE_KEYWORDS):
+        intent = "compare"
+    elif any(k in keywords for k in PRICE_INTENT_KEYWORDS):
+        intent = "price_search"
+    elif any(k in keywords for k in SIZE_INTENT_KEYWORDS):
+        intent = "size_search"
+    else:
+        intent = "search"
+
+    # 👤 Recipients
+    recipients = tuple(w for w in RECIPIENT_MAP if w in keywords)
+    recipient_departments = tuple(dict.fromkeys(RECIPIENT_MAP[w] for w in recipients))
+    pronoun_departments = tuple(PRONOUN_MAP[p] for p in PRONOUN_MAP if p in keywords)
+
+    if any(k in keywords for k in WOMEN_KEYWORDS):
+        gender_department = "Women"
+    elif any(k in keywords for k in MEN_KEYWORDS):
+        gender_department = "Men"
+    else:
+        gender_department = None
+
+    if any(k in keywords for k in FEMALE_TARGETS):
+        target_gender = "Women"
+    elif any(k in keywords for k in MALE_TARGETS):
+        target_gender = "Men"
+    else:
+        target_gender = None
+
+    return ParsedMessage(
+        text=message,
+        lowered=lowered,
+        keywords=keywords,
+        intent=intent,
+        is_show_cart=any(k in keywords for k in SHOW_CART_KEYWORDS),
+        is_gift=any(k in keywords for k in GIFT_KEYWORDS),
+        has_explicit_recipient=any(k in keywords for k in EXPLICIT_RECIPIENT_KEYWORDS),
+        is_relax_price=lowered in RELAX_PRICE_ACTIONS,
+        is_closest_store_with_product=any(
+            k in keywords for k in CLOSEST_STORE_WITH_PRODUCT_KEYWORDS
+        ),
+        is_closest_store=any(k in keywords for k in CLOSEST_STORE_KEYWORDS),
+        is_cheapest_store=(
+            "cheapest" in keywords
+            and any(k in keywords for k in CHEAPEST_STORE_KEYWORDS)
+        ),
+        is_explicit_compare=any(k in keywords for k in COMPARE_KEYWORDS),
+        is_show_more=_is_show_more(lowered, keywords),
+        has_search_filters=any(k in keywords for k in FILTER_KEYWORDS),
+        mentions_pronoun="him" in keywords or "her" in keywords,
+        mentions_this_product="this product" in keywords,
+        price=price,
+        price_op=price_op,
+        size=next((v for k, v in SIZE_MAP.items() if k in keywords), None),
+        category=_first(CATEGORY_KEYWORDS, keywords),
+        number=number,
+        radius_km=radius_km,
+        has_parents="parents" in keywords,
+        recipients=recipients,
+        recipient_departments=recipient_departments,
+        pronoun_departments=pronoun_departments,
+        gender_department=gender_department,
+        target_gender=target_gender,
+        store_product=_store_product(message.strip()),
+    )
+
+
+def route(parsed: ParsedMessage) -> str:
+    """Which kind of answer a message gets, before any state is consulted."""
+    if (
+        parsed.text.startswith(("store details", "search store"))
+        or parsed.is_cheapest_store
+        or parsed.is_closest_store
+        or parsed.is_closest_store_with_product
+    ):
+        return "store"
+    if parsed.is_show_cart:
+        return "cart"
+    if parsed.is_show_more:
+        return "show_more"
+    if parsed.is_relax_price:
+        return "quick_reply"
+    if parsed.intent == "compare":
+        return "compare"
+    if parsed.intent == "gift" or parsed.is_gift:
+        return "gift"
+    if parsed.price is not None or parsed.intent == "price_search":
+        return "price_search"
+    return "search"
@@ -0,0 +1,156 @@
+"""
+Per-stage request timings.
+
+Every request gets a RequestTimer (held in a context variable, so the
+catalog and helpers can report stages without passing it around).
+Stages add up per request and are exported two ways:
+
+- a `Server-Timing` header on the response (visible in browser devtools)
+- Prometheus histograms on GET /metrics, labelled by stage and by the
+  chat branch that answered (store, compare, gift, price_search, ...)
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+
+REGISTRY = CollectorRegistry()
+
+# 0.5 ms .. 10 s: in-memory answers up to slow BigQuery jobs
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds",
+    "Time spent in each stage of a chat request",
+    ["stage", "intent"],
+    buckets=BUCKETS,
+    registry=REGISTRY,
+)
+
+REQUEST_SECONDS = Histogram(
+    "chat_request_seconds",
+    "End-to-end chat request time",
+    ["intent"],
+    buckets=BUCKETS,
+    registry=REGISTRY,
+)
+
+REQUESTS = Counter(
+    "chat_requests",
+    "Chat requests by answering branch and status code",
+    ["intent", "status"],
+    registry=REGISTRY,
+)
+
+COALESCED_QUERIES = Counter(
+    "catalog_queries_coalesced",
+    "Catalog queries answered by sharing an identical in-flight query",
+    registry=REGISTRY,
+)
+
+QUERY_JOBS = Counter(
+    "catalog_query_jobs",
+    "BigQuery jobs by issuing chat intent and result-cache hit",
+    ["intent", "cache_hit"],
+    registry=REGISTRY,
+)
+
+QUERY_BYTES_BILLED = Counter(
+    "catalog_query_bytes_billed",
+    "Bytes billed by BigQuery jobs, by issuing chat intent",
+    ["intent"],
+    registry=REGISTRY,
+)
+
+QUERY_SLOT_MS = Counter(
+    "catalog_query_slot_ms",
+    "Slot milliseconds used by BigQuery jobs, by issuing chat intent",
+    ["intent"],
+    registry=REGISTRY,
+)
+
+QUERIES_REFUSED = Counter(
+    "catalog_queries_refused",
+    "Queries refused by the cost guard for exceeding their byte budget",
+    ["intent"],
+    registry=REGISTRY,
+)
+
+_current = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.intent = "unknown"
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        parts = [
+            f"{name};dur={seconds * 1000:.2f}"
+            for name, seconds in self.stages.items()
+        ]
+        parts.append(f"total;dur={self.total() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def observe(self, status: int):
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.labels(name, self.intent).observe(seconds)
+        REQUEST_SECONDS.labels(self.intent).observe(self.total())
+        REQUESTS.labels(self.intent, str(status)).inc()
+
+
+def start_request() -> RequestTimer:
+    timer = RequestTimer()
+    _current.set(timer)
+    return timer
+
+
+def current() -> RequestTimer | None:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block against the current request; no-op outside requests."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+
+    with timer.stage(name):
+        yield
+
+
+def set_intent(intent: str):
+    timer = _current.get()
+    if timer is not None:
+        timer.intent = intent
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,149 @@
+"""
+Product-name resolver for comparisons.
+
+Maps a name as the shopper typed it to the best catalog product, entirely
+in memory, trying in order:
+
+1. exact match on the normalized name (hash lookup)
+2. prefix match (binary search over the sorted names; shortest wins)
+3. trigram similarity (Dice coefficient over shared trigrams)
+"""
+import bisect
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+# Below this trigram similarity a name is not a confident match
+MIN_SIMILARITY = 0.5
+
+# Prefix matches looked at before settling on the shortest
+MAX_PREFIX_CANDIDATES = 64
+
+
+def normalize_name(text: str | None) -> str:
+    if not text:
+        return ""
+    return NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+def trigrams(normalized: str) -> set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class NameMatch:
+    position: int
+    score: float
+    method: str     # "exact", "prefix" or "trigram"
+
+
+class NameResolver:
+    def __init__(self, names: list[str | None]):
+        normalized = [normalize_name(n) for n in names]
+
+        self.exact = {}
+        for pos, name in enumerate(normalized):
+            if name:
+                self.exact.setdefault(name, pos)
+
+        self.sorted_names = sorted(self.exact)
+        self.lengths = np.array([len(n) for n in normalized], dtype=np.int32)
+
+        postings = defaultdict(list)
+        gram_counts = np.zeros(len(normalized), dtype=np.int32)
+
+        for pos, name in enumerate(normalized):
+            if not name:
+                continue
+            grams = trigrams(name)
+            gram_counts[pos] = len(grams)
+            for gram in grams:
+                postings[gram].append(pos)
+
+        self.postings = {
+            g: np.array(v, dtype=np.int32) for g, v in postings.items()
+        }
+        self.gram_counts = gram_counts
+
+    def resolve(self, text: str) -> NameMatch | None:
+        query = normalize_name(text)
+        if not query:
+            return None
+
+        pos = self.exact.get(query)
+        if pos is not None:
+            return NameMatch(pos, 1.0, "exact")
+
+        match = self._prefix(query)
+        if match is not None:
+            return match
+
+        return self._similar(query)
+
+    def resolve_many(self, texts) -> list[NameMatch | None]:
+        return [self.resolve(t) for t in texts]
+
+    def split(self, text: str, separator: re.Pattern) -> list[str] | None:
+        """
+        Splits a list of product names ("A, B and C") at `separator`, but
+        only where the pieces on both sides resolve, longest span first, so
+        "Levi's Black and White Tee" stays one name. A span that crosses
+        a separator must match exactly or by prefix; a fuzzy match there
+        would as easily be two names. None if no split resolves.
+        """
+        pieces = separator.split(text)
+        separators = separator.findall(text)
+
+        def span(i, j):
+            joined = pieces[i] + "".join(separators[k - 1] + pieces[k] for k in range(i + 1, j))
+            return joined.strip()
+
+        def resolves(i, j):
+            match = self.resolve(span(i, j))
+            return match is not None and (j - i == 1 or match.method != "trigram")
+
+        memo = {len(pieces): []}
+
+        def parse(i):
+            if i not in memo:
+                memo[i] = None
+                for j in range(len(pieces), i, -1):
+                    if resolves(i, j) and (rest := parse(j)) is not None:
+                        memo[i] = [span(i, j)] + rest
+                        break
+            return memo[i]
+
+        return parse(0)
+
+    def _prefix(self, query: str) -> NameMatch | None:
+        start = bisect.bisect_left(self.sorted_names, query)
+        best = None
+
+        for name in self.sorted_names[start:start + MAX_PREFIX_CANDIDATES]:
+            if not name.startswith(query):
+                break
+            if best is None or len(name) < len(best):
+                best = name
+
+        if best is None:
+            return None
+        return NameMatch(self.exact[best], len(query) / len(best), "prefix")
+
+    def _similar(self, query: str) -> NameMatch | None:
+        grams = trigrams(query)
+        hits = [self.postings[g] for g in grams if g in self.postings]
+        if not hits:
+            return None
+
+        positions, shared = np.unique(np.concatenate(hits), return_counts=True)
+        scores = 2 * shared / (len(grams) + self.gram_counts[positions])
+
+        best = int(np.argmax(scores))
+        if scores[best] < MIN_SIMILARITY:
+            return None
+        return NameMatch(int(positions[best]), round(float(scores[best]), 4), "trigram")
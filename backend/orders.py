@@ -0,0 +1,347 @@
+"""
+Order pipeline.
+
+Checkout writes to a local SQLite database, not to BigQuery. The order
+row, one inventory_items row per unit and the matching order_items rows
+go in as a single transaction with bulk inserts. Ids are allocated
+inside that transaction, so nothing has to be read back and concurrent
+checkouts can't see each other's rows.
+
+Local ids start above LOCAL_ID_BASE, so they can't collide with the ids
+already in the analytics tables.
+
+Committed orders are copied to the analytics store afterwards by an
+OrderExporter task. It sends them in batches, and marks an order as
+exported only once the sink has accepted it. A failed batch is retried
+on the next round, so checkout latency never depends on BigQuery. The
+retry is at-least-once; every streamed row carries a stable insert id,
+so BigQuery drops the duplicates of a batch it had already accepted.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    gender TEXT,
+    created_at TEXT NOT NULL,
+    num_of_item INTEGER NOT NULL,
+    exported_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_unexported
+    ON orders (order_id) WHERE exported_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS inventory_items (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    sold_at TEXT,
+    cost REAL,
+    product_category TEXT,
+    product_name TEXT,
+    product_brand TEXT,
+    product_retail_price REAL,
+    product_department TEXT,
+    product_sku TEXT,
+    product_distribution_center_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders (order_id),
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    inventory_item_id INTEGER NOT NULL REFERENCES inventory_items (id),
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    sale_price REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id);
+"""
+
+# Local order / inventory / order item ids are LOCAL_ID_BASE + 1, + 2, ...
+LOCAL_ID_BASE = 1_000_000_000_000
+
+# Column whose value makes each exported row's insert id
+ROW_ID_COLUMNS = {"orders": "order_id", "inventory_items": "id", "order_items": "id"}
+
+ORDER_COLUMNS = ["order_id", "user_id", "status", "gender", "created_at", "num_of_item"]
+
+INVENTORY_COLUMNS = [
+    "id", "product_id", "created_at", "sold_at", "cost", "product_category",
+    "product_name", "product_brand", "product_retail_price",
+    "product_department", "product_sku", "product_distribution_center_id",
+]
+
+ORDER_ITEM_COLUMNS = [
+    "id", "order_id", "user_id", "product_id", "inventory_item_id",
+    "status", "created_at", "sale_price",
+]
+
+
+def _insert(table: str, columns: list[str]) -> str:
+    placeholders = ", ".join(f":{c}" for c in columns)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+class OrderStore:
+    """
+    The database is opened by open() (the app calls it at startup) or on
+    first use, never at import, so importing the app creates no file.
+    """
+
+    def __init__(self, path: str, id_base: int = LOCAL_ID_BASE):
+        self.path = path
+        self.id_base = id_base
+        # Reentrant: `conn` opens the database under it on first use
+        self.lock = threading.RLock()
+        self._conn = None
+
+    def open(self):
+        with self.lock:
+            if self._conn is not None:
+                return
+
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.open()
+        return self._conn
+
+    async def place_order(self, user: dict, lines: list[dict], costs: dict | None = None) -> dict:
+        """
+        `lines` are revalidated cart lines: product columns plus quantity.
+        `costs` maps product id to unit cost, for the inventory rows.
+        """
+        return await asyncio.to_thread(self._place_order, user, lines, costs or {})
+
+    def _next_id(self, table: str, column: str = "id") -> int:
+        return self.conn.execute(
+            f"SELECT COALESCE(MAX({column}), ?) + 1 FROM {table}", (self.id_base,)
+        ).fetchone()[0]
+
+    def _place_order(self, user: dict, lines: list[dict], costs: dict) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        units = [line for line in lines for _ in range(line["quantity"])]
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                order_id = self._next_id("orders", "order_id")
+                first_inventory_id = self._next_id("inventory_items")
+                first_item_id = self._next_id("order_items")
+
+                order = {
+                    "order_id": order_id,
+                    "user_id": user["id"],
+                    "status": "Processing",
+                    "gender": user.get("gender"),
+                    "created_at": now,
+                    "num_of_item": len(units),
+                }
+                inventory = [
+                    {
+                        "id": first_inventory_id + i,
+                        "product_id": p["id"],
+                        "created_at": now,
+                        "sold_at": now,
+                        "cost": costs.get(p["id"], p.get("cost")),
+                        "product_category": p.get("category"),
+                        "product_name": p.get("name"),
+                        "product_brand": p.get("brand"),
+                        "product_retail_price": p["retail_price"],
+                        "product_department": p.get("department"),
+                        "product_sku": p.get("sku"),
+                        "product_distribution_center_id": p.get("distribution_center_id"),
+                    }
+                    for i, p in enumerate(units)
+                ]
+                items = [
+                    {
+                        "id": first_item_id + i,
+                        "order_id": order_id,
+                        "user_id": user["id"],
+                        "product_id": p["id"],
+                        "inventory_item_id": first_inventory_id + i,
+                        "status": "Processing",
+                        "created_at": now,
+                        "sale_price": p["retail_price"],
+                    }
+                    for i, p in enumerate(units)
+                ]
+
+                self.conn.execute(_insert("orders", ORDER_COLUMNS), order)
+                self.conn.executemany(_insert("inventory_items", INVENTORY_COLUMNS), inventory)
+                self.conn.executemany(_insert("order_items", ORDER_ITEM_COLUMNS), items)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        return {
+            **order,
+            "total": round(sum(i["sale_price"] for i in items), 2),
+            "items": items,
+        }
+
+    def unexported(self, limit: int = 500) -> dict:
+        """Oldest committed orders not yet in analytics, with their rows."""
+        with self.lock:
+            orders = [
+                dict(r) for r in self.conn.execute(
+                    f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders "
+                    "WHERE exported_at IS NULL ORDER BY order_id LIMIT ?",
+                    (limit,)
+                )
+            ]
+            if not orders:
+                return {"orders": [], "inventory_items": [], "order_items": []}
+
+            ids = [o["order_id"] for o in orders]
+            marks = ", ".join("?" * len(ids))
+            items = [
+                dict(r) for r in self.conn.execute(
+                    f"SELECT {', '.join(ORDER_ITEM_COLUMNS)} FROM order_items "
+                    f"WHERE order_id IN ({marks}) ORDER BY id",
+                    ids
+                )
+            ]
+            inventory = [
+                dict(r) for r in self.conn.execute(
+                    f"SELECT {', '.join('i.' + c for c in INVENTORY_COLUMNS)} "
+                    "FROM inventory_items i JOIN order_items o ON o.inventory_item_id = i.id "
+                    f"WHERE o.order_id IN ({marks}) ORDER BY i.id",
+                    ids
+                )
+            ]
+
+        return {"orders": orders, "inventory_items": inventory, "order_items": items}
+
+    def mark_exported(self, order_ids: list[int]):
+        if not order_ids:
+            return
+
+        now = datetime.now(timezone.utc).isoformat()
+        marks = ", ".join("?" * len(order_ids))
+        with self.lock:
+            self.conn.execute(
+                f"UPDATE orders SET exported_at = ? WHERE order_id IN ({marks})",
+                [now, *order_ids]
+            )
+
+    def stats(self) -> dict:
+        with self.lock:
+            total, pending = self.conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(exported_at) FROM orders"
+            ).fetchone()
+        return {"path": self.path, "orders": total, "pending_export": pending}
+
+
+class BigQueryOrderSink:
+    """Streams order batches into `dataset`'s orders / inventory_items / order_items."""
+
+    def __init__(self, client, dataset: str):
+        self.client = client
+        self.dataset = dataset
+
+    async def write(self, batch: dict):
+        await asyncio.to_thread(self._write, batch)
+
+    def _write(self, batch: dict):
+        for table, rows in batch.items():
+            if not rows:
+                continue
+            # Stable insert ids: a retried batch is deduplicated by BigQuery
+            column = ROW_ID_COLUMNS[table]
+            errors = self.client.insert_rows_json(
+                f"{self.dataset}.{table}",
+                rows,
+                row_ids=[f"{table}-{row[column]}" for row in rows],
+            )
+            if errors:
+                raise RuntimeError(f"BigQuery insert into {table} failed: {errors[:3]}")
+
+
+class OrderExporter:
+    """Background write-behind from the OrderStore to an analytics sink."""
+
+    def __init__(self, store: OrderStore, sink, interval_seconds: float = 5, batch_size: int = 500):
+        self.store = store
+        self.sink = sink
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.exported = 0
+        self.batches = 0
+        self.last_error = None
+
+        self._task = None
+
+    async def flush(self) -> int:
+        """Exports every pending order now; returns how many were sent."""
+        sent = 0
+
+        while True:
+            batch = await asyncio.to_thread(self.store.unexported, self.batch_size)
+            if not batch["orders"]:
+                return sent
+
+            await self.sink.write(batch)
+            ids = [o["order_id"] for o in batch["orders"]]
+            await asyncio.to_thread(self.store.mark_exported, ids)
+
+            sent += len(ids)
+            self.exported += len(ids)
+            self.batches += 1
+
+    def start(self):
+        if self._task is None and self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._export_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _export_loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.flush()
+                self.last_error = None
+            except Exception as exc:
+                # Orders stay pending and go out with the next round
+                self.last_error = repr(exc)
+                logger.exception("Order export failed")
+
+    def stats(self) -> dict:
+        return {
+            "exported": self.exported,
+            "batches": self.batches,
+            "interval_seconds": self.interval_seconds,
+            "last_error": self.last_error,
+        }
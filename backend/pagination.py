@@ -0,0 +1,81 @@
+"""
+Paged search results.
+
+A search keeps every match (index positions, or the rows of the SQL
+fallback) in a ResultSet that sits in the search cache, so "show more"
+slices the next page out of it instead of running the search again.
+Store listings page with a keyset on (price, id) that travels in an
+opaque cursor, so they need no server-side handle at all.
+"""
+import base64
+import json
+import math
+
+from fastapi import HTTPException
+
+
+class ResultSet:
+    total = 0
+
+    def page(self, offset: int, limit: int) -> list[dict]:
+        raise NotImplementedError
+
+    def estimated_size(self) -> int:
+        raise NotImplementedError
+
+
+class IndexResults(ResultSet):
+    """Matches from the in-memory name index; rows are built per page."""
+
+    def __init__(self, index, positions):
+        self.index = index
+        self.positions = positions
+        self.total = len(positions)
+
+    def page(self, offset: int, limit: int) -> list[dict]:
+        return [self.index.rows[i] for i in self.positions[offset:offset + limit]]
+
+    def estimated_size(self) -> int:
+        return int(self.positions.nbytes)
+
+
+class RowResults(ResultSet):
+    """Rows fetched by the SQL fallback, up to its fetch limit."""
+
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        self.total = len(rows)
+
+    def page(self, offset: int, limit: int) -> list[dict]:
+        return self.rows[offset:offset + limit]
+
+    def estimated_size(self) -> int:
+        return len(json.dumps(self.rows, default=str))
+
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> dict | None:
+    """The (price, id) keyset of a store listing cursor; 400 for anything else."""
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    price = data.get("price") if isinstance(data, dict) else None
+    last_id = data.get("id") if isinstance(data, dict) else None
+
+    if (
+        not isinstance(price, (int, float)) or isinstance(price, bool) or not math.isfinite(price)
+        or not isinstance(last_id, int) or isinstance(last_id, bool)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return {"price": float(price), "id": last_id}
@@ -0,0 +1,131 @@
+"""
+Sorted price index.
+
+Prices are kept sorted (with the product positions alongside) once per
+department, per (department, category) and for the whole catalog, so a
+price filter is two binary searches and a slice instead of a comparison
+against every product, and "cheapest N" is the first N of a partition.
+"""
+import numpy as np
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+# Partition key part meaning "any value"; None is a real (NULL) department or category
+ALL = object()
+
+# Same tolerance as the SQL path's "priced at $x"
+EXACT_TOLERANCE = 0.01
+
+
+class PricePartition:
+    __slots__ = ("prices", "positions")
+
+    def __init__(self, prices: np.ndarray, positions: np.ndarray):
+        self.prices = prices
+        self.positions = positions
+
+    def bounds(self, price: float, price_op: str) -> tuple[int, int]:
+        if price_op == "under":
+            return 0, int(np.searchsorted(self.prices, price, side="right"))
+        if price_op == "over":
+            return int(np.searchsorted(self.prices, price, side="left")), len(self.prices)
+        # exact
+        low = np.searchsorted(self.prices, price - EXACT_TOLERANCE, side="left")
+        high = np.searchsorted(self.prices, price + EXACT_TOLERANCE, side="right")
+        return int(low), int(high)
+
+    def range(self, price: float, price_op: str) -> np.ndarray:
+        low, high = self.bounds(price, price_op)
+        return self.positions[low:high]
+
+
+class PriceIndex:
+    PRICE_OPS = ("under", "over", "exact")
+
+    def __init__(self, prices: np.ndarray, departments, categories, ids: np.ndarray | None = None):
+        priced = np.flatnonzero(~np.isnan(prices))
+        # Cheapest first, ties by id so slices are stable across rebuilds
+        tiebreak = ids[priced] if ids is not None else priced
+        order = priced[np.lexsort((tiebreak, prices[priced]))].astype(np.int32)
+
+        departments = np.asarray(departments, dtype=object)[order]
+        categories = np.asarray(categories, dtype=object)[order]
+
+        self.partitions = {(ALL, ALL): self._partition(prices, order)}
+
+        for department in set(departments.tolist()):
+            in_department = order[departments == department]
+            self.partitions[(department, ALL)] = self._partition(prices, in_department)
+
+            department_categories = categories[departments == department]
+            for category in set(department_categories.tolist()):
+                in_category = in_department[department_categories == category]
+                self.partitions[(department, category)] = self._partition(prices, in_category)
+
+    @staticmethod
+    def _partition(prices, positions) -> PricePartition:
+        return PricePartition(prices[positions], positions)
+
+    def to_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Every partition concatenated, plus where each one starts and ends."""
+        spans, start = [], 0
+        for (department, category), part in self.partitions.items():
+            # ALL is left out of the span, so NULL and "any" stay distinct
+            span = {"start": start, "end": start + len(part.positions)}
+            if department is not ALL:
+                span["department"] = department
+            if category is not ALL:
+                span["category"] = category
+            spans.append(span)
+            start += len(part.positions)
+
+        parts = list(self.partitions.values())
+        arrays = {
+            "prices": np.concatenate([p.prices for p in parts]),
+            "positions": np.concatenate([p.positions for p in parts]).astype(np.int32),
+        }
+        return arrays, {"partitions": spans}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], meta: dict) -> "PriceIndex":
+        """A PriceIndex over to_arrays() output; partitions are slices, not copies."""
+        index = cls.__new__(cls)
+        index.partitions = {
+            (span.get("department", ALL), span.get("category", ALL)): PricePartition(
+                arrays["prices"][span["start"]:span["end"]],
+                arrays["positions"][span["start"]:span["end"]],
+            )
+            for span in meta["partitions"]
+        }
+        return index
+
+    def _partitions(self, department=None, category=None) -> list[PricePartition]:
+        """None means no filter on that column."""
+        departments = department if isinstance(department, list) else [department]
+        category = ALL if category is None else category
+        found = [self.partitions.get((ALL if d is None else d, category)) for d in departments]
+        return [p for p in found if p is not None]
+
+    def range(self, price: float, price_op: str, department=None, category=None) -> np.ndarray:
+        """
+        Positions priced within the constraint, cheapest first per
+        partition. `department` may be one name or a list; `category` is
+        the catalog's category column.
+        """
+        parts = [p.range(price, price_op) for p in self._partitions(department, category)]
+        if not parts:
+            return EMPTY
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def cheapest(self, n: int, department=None, category=None) -> np.ndarray:
+        """Positions of the n cheapest products, cheapest first."""
+        parts = self._partitions(department, category)
+        if len(parts) == 1:
+            return parts[0].positions[:n]
+        if not parts:
+            return EMPTY
+
+        # Several departments: merge their heads only
+        prices = np.concatenate([p.prices[:n] for p in parts])
+        positions = np.concatenate([p.positions[:n] for p in parts])
+        return positions[np.argsort(prices, kind="stable")[:n]]
@@ -0,0 +1,31 @@
+"""
+Cached product lookups by id.
+
+Carts and checkout need current prices for a handful of ids at a time.
+Ids missing from the cache are fetched together in one catalog query,
+and the short TTL bounds how stale a displayed price can be; checkout
+bypasses the cache (`get_many(ids, fresh=True)`). Unknown ids (e.g.
+discontinued products) are cached too, for a shorter time.
+"""
+import time
+
+from cache import BatchedLoader
+
+
+class ProductCache(BatchedLoader):
+    def __init__(
+        self,
+        catalog,
+        ttl: float = 60,
+        negative_ttl: float = 30,
+        max_entries: int = 50000,
+        clock=time.monotonic
+    ):
+        super().__init__(ttl, negative_ttl, max_entries, clock)
+        self.catalog = catalog
+
+    async def fetch(self, product_ids: list[int]) -> list[dict]:
+        return await self.catalog.get_products(product_ids)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "batched_lookups": self.lookups}
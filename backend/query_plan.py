@@ -0,0 +1,253 @@
+"""
+Canonical product-filter queries.
+
+Filters go in as a ProductFilter and come out as one canonical SQL text
+per filter *shape*: clauses always in the same order, every value
+(including LIMIT and the gender exclusions) a query parameter. The same
+question therefore always produces byte-identical SQL, which is what
+BigQuery's result cache keys on, and the SQL hashes to a stable
+fingerprint that QueryStats reports cache hits against.
+"""
+import hashlib
+import threading
+from dataclasses import dataclass
+
+# Opposite-gender words kept out of single-department results
+GENDER_EXCLUSIONS = {
+    "Men": ("ladies", "women"),
+    "Women": ("men", "male"),
+}
+
+PRICE_OPS = ("under", "over", "exact")
+
+PRODUCT_COLUMNS = (
+    "p.id, p.name, p.category, p.brand, p.department, p.retail_price, "
+    "p.sku, p.distribution_center_id, dc.name AS distribution_name"
+)
+
+# Product lookups by id (carts, checkout) also need the unit cost, which
+# order inventory rows record; searches never show it
+PRODUCT_LOOKUP_COLUMNS = PRODUCT_COLUMNS + ", p.cost"
+
+
+@dataclass(frozen=True)
+class Dialect:
+    name: str
+    products: str
+    distribution_centers: str
+    prefix: str     # parameter marker: "@" (BigQuery) or ":" (SQLite)
+
+    def param(self, name: str) -> str:
+        return self.prefix + name
+
+
+@dataclass(frozen=True)
+class QueryParam:
+    name: str
+    type: str       # BigQuery type: STRING, FLOAT64, INT64
+    value: object
+    array: bool = False
+
+
+@dataclass(frozen=True)
+class CompiledQuery:
+    sql: str
+    params: tuple
+    fingerprint: str
+
+    def param_values(self) -> tuple:
+        return tuple(
+            (p.name, tuple(p.value) if p.array else p.value)
+            for p in self.params
+        )
+
+
+def _text(value) -> str | None:
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    return value or None
+
+
+@dataclass(frozen=True)
+class ProductFilter:
+    product: str | None = None
+    category: str | None = None
+    size: str | None = None
+    price: float | None = None
+    price_op: str | None = None
+    departments: tuple = ()
+    exclude_department: str | None = None
+
+    @classmethod
+    def build(
+        cls,
+        product=None,
+        category=None,
+        size=None,
+        price=None,
+        price_op=None,
+        department=None,
+        exclude_department=None
+    ) -> "ProductFilter":
+        """Normalize loose chat filters so equal questions compare equal."""
+        if price is None:
+            price_op = None
+        else:
+            price = round(float(price), 2)
+            if price_op not in PRICE_OPS:
+                price_op = "exact"
+
+        if isinstance(department, (list, tuple, set)):
+            departments = tuple(sorted({d for d in department if d}))
+        elif department:
+            departments = (department,)
+        else:
+            departments = ()
+
+        if exclude_department not in GENDER_EXCLUSIONS:
+            exclude_department = None
+
+        return cls(
+            product=_text(product),
+            category=_text(category),
+            size=_text(size),
+            price=price,
+            price_op=price_op,
+            departments=departments,
+            exclude_department=exclude_department,
+        )
+
+    def where(self, dialect: Dialect) -> tuple[list[str], list[QueryParam]]:
+        clauses = []
+        params = []
+
+        def like(column_param, value, negate=False):
+            op = "NOT LIKE" if negate else "LIKE"
+            clauses.append(f"LOWER(p.name) {op} {dialect.param(column_param)}")
+            params.append(QueryParam(column_param, "STRING", f"%{value}%"))
+
+        # Fixed order: name filters, price, department, exclusions
+        if self.product:
+            like("product", self.product)
+        if self.category:
+            like("category", self.category)
+        if self.size:
+            like("size", self.size)
+
+        if self.price_op == "under":
+            clauses.append(f"p.retail_price <= {dialect.param('price_max')}")
+            params.append(QueryParam("price_max", "FLOAT64", self.price))
+        elif self.price_op == "over":
+            clauses.append(f"p.retail_price >= {dialect.param('price_min')}")
+            params.append(QueryParam("price_min", "FLOAT64", self.price))
+        elif self.price_op == "exact":
+            clauses.append(
+                f"p.retail_price BETWEEN {dialect.param('price_min')} "
+                f"AND {dialect.param('price_max')}"
+            )
+            params.append(QueryParam("price_min", "FLOAT64", round(self.price - 0.01, 2)))
+            params.append(QueryParam("price_max", "FLOAT64", round(self.price + 0.01, 2)))
+
+        if self.departments:
+            if dialect.name == "bigquery":
+                clauses.append(f"p.department IN UNNEST({dialect.param('departments')})")
+                params.append(QueryParam("departments", "STRING", list(self.departments), array=True))
+            else:
+                names = [f"department_{i}" for i in range(len(self.departments))]
+                clauses.append(
+                    f"p.department IN ({', '.join(dialect.param(n) for n in names)})"
+                )
+                params.extend(
+                    QueryParam(n, "STRING", d) for n, d in zip(names, self.departments)
+                )
+
+        if self.exclude_department:
+            for i, word in enumerate(GENDER_EXCLUSIONS[self.exclude_department]):
+                like(f"exclude_{i}", word, negate=True)
+
+        return clauses, params
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()[:16]
+
+
+def _compile(select: str, clauses: list[str], params: list[QueryParam], tail: str = "") -> CompiledQuery:
+    sql = select
+    if clauses:
+        sql += "\nWHERE " + "\n  AND ".join(clauses)
+    sql += tail
+
+    return CompiledQuery(sql=sql, params=tuple(params), fingerprint=fingerprint(sql))
+
+
+def compile_product_search(f: ProductFilter, dialect: Dialect, limit: int = 5) -> CompiledQuery:
+    clauses, params = f.where(dialect)
+    params.append(QueryParam("limit", "INT64", int(limit)))
+
+    select = (
+        f"SELECT {PRODUCT_COLUMNS}\n"
+        f"FROM {dialect.products} p\n"
+        f"LEFT JOIN {dialect.distribution_centers} dc ON p.distribution_center_id = dc.id"
+    )
+    return _compile(select, clauses, params, f"\nLIMIT {dialect.param('limit')}")
+
+
+def compile_store_ids(f: ProductFilter, dialect: Dialect) -> CompiledQuery:
+    clauses, params = f.where(dialect)
+
+    select = (
+        "SELECT DISTINCT p.distribution_center_id AS id\n"
+        f"FROM {dialect.products} p"
+    )
+    return _compile(select, clauses, params)
+
+
+class QueryStats:
+    """Executions, BigQuery cache hits and coalesced callers per fingerprint."""
+
+    def __init__(self):
+        self._by_fingerprint = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, fp: str, sql: str) -> dict:
+        entry = self._by_fingerprint.get(fp)
+        if entry is None:
+            entry = self._by_fingerprint[fp] = {
+                "sql": " ".join(sql.split()),
+                "executions": 0,
+                "cache_hits": 0,
+                "cache_misses": 0,
+                "coalesced": 0,
+            }
+        return entry
+
+    def record(self, fp: str, sql: str, cache_hit: bool | None = None):
+        with self._lock:
+            entry = self._entry(fp, sql)
+            entry["executions"] += 1
+            if cache_hit is True:
+                entry["cache_hits"] += 1
+            elif cache_hit is False:
+                entry["cache_misses"] += 1
+
+    def record_coalesced(self, fp: str, sql: str):
+        """A caller that shared another caller's in-flight query."""
+        with self._lock:
+            self._entry(fp, sql)["coalesced"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for fp, entry in self._by_fingerprint.items():
+                known = entry["cache_hits"] + entry["cache_misses"]
+                result[fp] = {
+                    **entry,
+                    "hit_rate": round(entry["cache_hits"] / known, 4) if known else None,
+                }
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._by_fingerprint.clear()
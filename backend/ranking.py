@@ -0,0 +1,202 @@
+"""
+Relevance ranking for product searches.
+
+The filters decide which products match; this decides which of them are
+shown first. Every candidate is scored in one vectorized pass:
+
+- name: share of the product name's words that are search words
+  ("Men's Jacket" beats "Carhartt Men's Duck Active Jacket" for "jacket");
+- category: the catalog category itself names a search word;
+- price: closeness to the price the shopper asked for;
+- proximity: closeness of the product's distribution center to the shopper.
+
+Only the top k are put in order (argpartition, then a sort of those k),
+and k grows with the page being read, so the first page never pays for
+sorting the whole candidate set. A ranked set is cached per search and
+shopper location, so "show more" doesn't score the candidates again.
+"""
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from geo import haversine_km
+from pagination import IndexResults, ResultSet
+from search_index import tokenize
+
+
+# Scores closer than this count as a tie (broken by catalog order)
+SCORE_RESOLUTION = 1_000_000
+
+
+@dataclass(frozen=True)
+class RankingWeights:
+    name: float = 1.0
+    category: float = 0.5
+    price: float = 0.5
+    proximity: float = 0.25
+
+    @classmethod
+    def parse(cls, text: str | None) -> "RankingWeights":
+        """"name=1,proximity=0.5" -> RankingWeights(name=1.0, ..., proximity=0.5)"""
+        known = {f.name for f in fields(cls)}
+        values = {}
+        for part in (text or "").split(","):
+            if "=" in part:
+                key, value = part.split("=", 1)
+                if key.strip() not in known:
+                    raise ValueError(f"Unknown ranking weight: {key.strip()}")
+                values[key.strip()] = float(value)
+        return cls(**values)
+
+
+class Ranker:
+    def __init__(self, index, stores: list[dict], proximity_km: float = 500.0):
+        self.index = index
+        self.proximity_km = proximity_km
+
+        self.name_lengths = np.array(
+            [max(len(tokenize(r.get("name"))), 1) for r in index.rows], dtype=np.float64
+        )
+
+        categories = [r.get("category") for r in index.rows]
+        self.category_names = sorted({c for c in categories if c is not None})
+        codes = {c: i for i, c in enumerate(self.category_names)}
+        self.category_codes = np.array([codes.get(c, -1) for c in categories], dtype=np.int32)
+        self.category_tokens = [set(tokenize(c)) for c in self.category_names]
+
+        slots = self._locate(stores)
+        self.store_slots = np.array(
+            [slots.get(int(i), -1) for i in index.store_ids], dtype=np.int32
+        )
+
+    def _locate(self, stores: list[dict]) -> dict[int, int]:
+        """Coordinates of the located stores; returns each one's slot."""
+        located = [
+            s for s in stores
+            if s.get("latitude") is not None and s.get("longitude") is not None
+        ]
+        self.store_lats = np.array([s["latitude"] for s in located], dtype=np.float64)
+        self.store_lngs = np.array([s["longitude"] for s in located], dtype=np.float64)
+        return {s["id"]: i for i, s in enumerate(located)}
+
+    def to_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        """The per-product features, for storing in a snapshot file."""
+        arrays = {
+            "name_lengths": self.name_lengths,
+            "category_codes": self.category_codes,
+            "store_slots": self.store_slots,
+        }
+        return arrays, {"category_names": self.category_names}
+
+    @classmethod
+    def from_arrays(
+        cls,
+        index,
+        stores: list[dict],
+        arrays: dict[str, np.ndarray],
+        meta: dict,
+        proximity_km: float = 500.0
+    ) -> "Ranker":
+        """A Ranker over to_arrays() output of the same catalog and stores."""
+        ranker = cls.__new__(cls)
+        ranker.index = index
+        ranker.proximity_km = proximity_km
+        ranker.name_lengths = arrays["name_lengths"]
+        ranker.category_codes = arrays["category_codes"]
+        ranker.store_slots = arrays["store_slots"]
+        ranker.category_names = meta["category_names"]
+        ranker.category_tokens = [set(tokenize(c)) for c in ranker.category_names]
+        ranker._locate(stores)
+        return ranker
+
+    def scores(
+        self,
+        positions: np.ndarray,
+        weights: RankingWeights,
+        query: str | None = None,
+        price: float | None = None,
+        location: tuple[float, float] | None = None
+    ) -> np.ndarray:
+        total = np.zeros(len(positions), dtype=np.float64)
+        tokens = set(tokenize(query))
+
+        if tokens and weights.name:
+            matched = np.zeros(len(positions), dtype=np.float64)
+            for token in tokens:
+                matched += np.isin(positions, self.index.postings.get(token, []), assume_unique=True)
+            total += weights.name * matched / self.name_lengths[positions]
+
+        if tokens and weights.category:
+            wanted = [i for i, words in enumerate(self.category_tokens) if words & tokens]
+            if wanted:
+                total += weights.category * np.isin(self.category_codes[positions], wanted)
+
+        if price and weights.price:
+            prices = self.index.prices[positions]
+            closeness = 1 - np.minimum(np.abs(prices - price) / price, 1)
+            total += weights.price * np.nan_to_num(closeness)
+
+        if location is not None and weights.proximity and len(self.store_lats):
+            store_km = haversine_km(location[0], location[1], self.store_lats, self.store_lngs)
+            # Products without a known center sit at "infinitely far"
+            store_score = np.append(1 / (1 + store_km / self.proximity_km), 0.0)
+            total += weights.proximity * store_score[self.store_slots[positions]]
+
+        return total
+
+    @staticmethod
+    def rank_keys(scores: np.ndarray) -> np.ndarray:
+        """
+        Unique int64 sort keys: the score (to ~1e-6) with the candidate's
+        place in catalog order folded into the low digits, so ties break
+        the same way every time and partial selection returns exactly k.
+        """
+        n = len(scores)
+        quantized = np.round(scores * SCORE_RESOLUTION).astype(np.int64)
+        return quantized * n + np.arange(n - 1, -1, -1, dtype=np.int64)
+
+    @staticmethod
+    def top_k(positions: np.ndarray, keys: np.ndarray, k: int) -> np.ndarray:
+        """The k best positions by rank_keys(), best first."""
+        if k <= 0 or not len(positions):
+            return positions[:0]
+
+        if k < len(positions):
+            chosen = np.argpartition(-keys, k - 1)[:k]
+        else:
+            chosen = np.arange(len(positions))
+
+        return positions[chosen[np.argsort(-keys[chosen])]]
+
+
+class RankedResults(ResultSet):
+    """
+    An IndexResults read in relevance order. Scores are computed once, up
+    front; the ordered prefix grows (doubling) only as deep as pages ask for.
+    """
+
+    def __init__(self, results: IndexResults, ranker: Ranker, weights: RankingWeights, **query):
+        self.results = results
+        self.total = results.total
+        self.ranker = ranker
+        self.weights = weights
+        self.query = query
+        self._keys = ranker.rank_keys(ranker.scores(results.positions, weights, **query))
+        self._best = results.positions[:0]
+
+    def positions(self, offset: int, limit: int) -> np.ndarray:
+        depth = min(offset + limit, self.total)
+
+        if depth > len(self._best):
+            self._best = self.ranker.top_k(
+                self.results.positions, self._keys, max(depth, 2 * len(self._best))
+            )
+
+        return self._best[offset:offset + limit]
+
+    def page(self, offset: int, limit: int) -> list[dict]:
+        return [self.results.index.rows[i] for i in self.positions(offset, limit)]
+
+    def estimated_size(self) -> int:
+        # The ordered prefix is at most as large as the keys
+        return int(2 * self._keys.nbytes)
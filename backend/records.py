@@ -0,0 +1,51 @@
+"""
+Compact product rows.
+
+The snapshot holds one row per product for its whole lifetime, and
+search, store and comparison replies hand those rows straight to the
+serializer. A ProductRecord keeps the fields in __slots__ (no per-row
+__dict__) and still reads like the dict rows the SQL path returns:
+row["name"], row.get("brand"), dict(row) and == against a dict all work.
+"""
+from collections.abc import Mapping
+
+
+class ProductRecord(Mapping):
+    # Columns returned by product searches (same as the SQL path)
+    __slots__ = (
+        "id",
+        "name",
+        "category",
+        "brand",
+        "department",
+        "retail_price",
+        "sku",
+        "distribution_center_id",
+        "distribution_name",
+    )
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_row(cls, row: Mapping, **overrides) -> "ProductRecord":
+        values = {**{f: row.get(f) for f in cls.__slots__}, **overrides}
+        return cls(*(values[f] for f in cls.__slots__))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def as_dict(self) -> dict:
+        return {f: getattr(self, f) for f in self.__slots__}
+
+    def __repr__(self):
+        return f"ProductRecord({self.as_dict()!r})"
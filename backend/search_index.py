@@ -0,0 +1,286 @@
+"""
+Inverted token index over product names.
+
+Names are split into normalized tokens and every token maps to a sorted
+postings array of product positions. Name filters (product, category,
+size) intersect postings instead of running LIKE '%x%' scans, and the
+match is whole-word: "men" no longer matches "women".
+"""
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from price_index import PriceIndex
+from query_plan import GENDER_EXCLUSIONS, ProductFilter
+from records import ProductRecord
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+POSSESSIVE_RE = re.compile(r"['’]s\b")
+
+# detect_size() codes and the words that spell them in product names
+SIZE_TERMS = {
+    "s": ["s", "small"],
+    "m": ["m", "medium"],
+    "l": ["l", "large"],
+    "xl": ["xl"],
+    "xxl": ["xxl"],
+}
+
+# Columns returned by product searches (same as the SQL path)
+SEARCH_FIELDS = list(ProductRecord.__slots__)
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+
+def normalize_token(token: str) -> str:
+    # Cheap plural folding: jackets -> jacket, but dress stays dress
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str | None) -> list[str]:
+    if not text:
+        return []
+
+    text = POSSESSIVE_RE.sub("", text.lower())
+    return [normalize_token(t) for t in TOKEN_RE.findall(text)]
+
+
+def intersect(arrays) -> np.ndarray:
+    arrays = sorted(arrays, key=len)
+    result = arrays[0]
+
+    for other in arrays[1:]:
+        if not len(result):
+            break
+        result = np.intersect1d(result, other, assume_unique=True)
+
+    return result
+
+
+def union(arrays) -> np.ndarray:
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return EMPTY
+    return np.unique(np.concatenate(arrays))
+
+
+class ProductIndex:
+    def __init__(
+        self,
+        products: list[dict],
+        store_names: dict | None = None,
+        columns: dict[str, np.ndarray] | None = None,
+        price_index: PriceIndex | None = None
+    ):
+        """
+        `columns` (id, retail_price, distribution_center_id) and
+        `price_index` may be passed in prebuilt, e.g. as views over a
+        mapped snapshot file; otherwise they are built from `products`.
+        """
+        store_names = store_names or {}
+
+        self.rows = [
+            ProductRecord.from_row(
+                p, distribution_name=store_names.get(p.get("distribution_center_id"))
+            )
+            for p in products
+        ]
+
+        if columns is not None:
+            self.prices = columns["retail_price"]
+            self.store_ids = columns["distribution_center_id"]
+            self.ids = columns["id"]
+        else:
+            self.prices = np.array(
+                [np.nan if p.get("retail_price") is None else p["retail_price"] for p in products],
+                dtype=np.float64
+            )
+            self.store_ids = np.array(
+                [-1 if p.get("distribution_center_id") is None else p["distribution_center_id"] for p in products],
+                dtype=np.int64
+            )
+            self.ids = np.array([p["id"] for p in products], dtype=np.int64)
+        self.lower_names = np.array([(p.get("name") or "").lower() for p in products], dtype=str)
+        self.department_values = np.array([p.get("department") for p in products], dtype=object)
+        self._by_store = {}
+
+        postings = defaultdict(list)
+        departments = defaultdict(list)
+
+        for pos, p in enumerate(products):
+            for token in set(tokenize(p.get("name"))):
+                postings[token].append(pos)
+            departments[p.get("department")].append(pos)
+
+        self.postings = {
+            t: np.array(v, dtype=np.int32) for t, v in postings.items()
+        }
+        self.departments = {
+            d: np.array(v, dtype=np.int32) for d, v in departments.items()
+        }
+        self._all = np.arange(len(products), dtype=np.int32)
+        self.price_index = price_index or PriceIndex(
+            self.prices,
+            self.department_values,
+            [p.get("category") for p in products],
+            ids=self.ids,
+        )
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, token: str) -> np.ndarray:
+        return self.postings.get(normalize_token(token), EMPTY)
+
+    def match_all(self, text: str) -> np.ndarray | None:
+        """Positions whose name contains every word of `text`."""
+        tokens = set(tokenize(text))
+        if not tokens:
+            return None
+        return intersect([self.postings.get(t, EMPTY) for t in tokens])
+
+    def match_any(self, words) -> np.ndarray:
+        return union([self.postings.get(t, EMPTY) for w in words for t in tokenize(w)])
+
+    def filter_positions(
+        self,
+        product=None,
+        category=None,
+        size=None,
+        department=None,
+        exclude_department=None,
+        price=None,
+        price_op=None
+    ) -> np.ndarray | None:
+        """
+        Positions matching every filter, in catalog order.
+        Returns None when a name filter has no indexable words, so the
+        caller can fall back to SQL.
+        """
+        sets = []
+
+        for text in (product, category):
+            if text:
+                matched = self.match_all(text)
+                if matched is None:
+                    return None
+                sets.append(matched)
+
+        if size:
+            sets.append(self.match_any(SIZE_TERMS.get(size, [size])))
+
+        if price is not None and price_op in PriceIndex.PRICE_OPS:
+            # Binary search in the department's price order; it already
+            # applies the department filter
+            in_range = self.price_index.range(
+                price, price_op,
+                department=department if isinstance(department, list) else department or None
+            )
+            sets.append(np.sort(in_range))
+        elif isinstance(department, list):
+            sets.append(union([self.departments.get(d, EMPTY) for d in department]))
+        elif department:
+            sets.append(self.departments.get(department, EMPTY))
+
+        candidates = intersect(sets) if sets else self._all
+
+        if isinstance(exclude_department, str) and exclude_department in GENDER_EXCLUSIONS:
+            excluded = self.match_any(GENDER_EXCLUSIONS[exclude_department])
+            candidates = np.setdiff1d(candidates, excluded, assume_unique=True)
+
+        return candidates
+
+    def search(self, limit: int | None = None, **filters) -> list[dict] | None:
+        positions = self.filter_positions(**filters)
+        if positions is None:
+            return None
+
+        if limit is not None:
+            positions = positions[:limit]
+        return [self.rows[i] for i in positions]
+
+    def cheapest(self, n: int, department=None, category=None) -> list[dict]:
+        """The n cheapest products, optionally within a department / catalog category."""
+        return [self.rows[i] for i in self.price_index.cheapest(n, department, category)]
+
+    def store_ids_matching(self, **filters) -> list[int] | None:
+        positions = self.filter_positions(**filters)
+        if positions is None:
+            return None
+
+        return self.stores_of(positions)
+
+    def stores_of(self, positions: np.ndarray) -> list[int]:
+        ids = np.unique(self.store_ids[positions])
+        return [int(i) for i in ids if i >= 0]
+
+    def scan(self, f: ProductFilter) -> np.ndarray:
+        """
+        Positions matching `f` with the SQL path's LIKE semantics
+        (substrings, not words). Slower than filter_positions; used when
+        the equivalent catalog query is refused by the cost guard.
+        """
+        mask = np.ones(len(self.rows), dtype=bool)
+
+        for text in (f.product, f.category, f.size):
+            if text:
+                mask &= np.char.find(self.lower_names, text) >= 0
+
+        if f.price_op == "under":
+            mask &= self.prices <= f.price
+        elif f.price_op == "over":
+            mask &= self.prices >= f.price
+        elif f.price_op == "exact":
+            mask &= (self.prices >= round(f.price - 0.01, 2)) & (self.prices <= round(f.price + 0.01, 2))
+
+        if f.departments:
+            mask &= np.isin(self.department_values, list(f.departments))
+
+        if f.exclude_department:
+            for word in GENDER_EXCLUSIONS[f.exclude_department]:
+                mask &= np.char.find(self.lower_names, word) < 0
+
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def store_positions(self, store_id: int) -> np.ndarray:
+        """A store's priced products, cheapest first (ties by id)."""
+        positions = self._by_store.get(store_id)
+
+        if positions is None:
+            positions = np.flatnonzero(
+                (self.store_ids == store_id) & ~np.isnan(self.prices)
+            )
+            order = np.lexsort((self.ids[positions], self.prices[positions]))
+            positions = positions[order]
+            self._by_store[store_id] = positions
+
+        return positions
+
+    def store_page(self, store_id: int, after: tuple | None = None, limit: int = 10):
+        """
+        Keyset page of a store's products ordered by (price, id).
+        `after` is the (price, id) of the last row already shown; returns
+        the rows and the key to continue from (None when exhausted).
+        """
+        positions = self.store_positions(store_id)
+        prices = self.prices[positions]
+        ids = self.ids[positions]
+
+        start = 0
+        if after is not None:
+            price, last_id = after
+            start = int(np.searchsorted(prices, price, side="left"))
+            # Skip the rows tied on price that were already shown
+            while start < len(positions) and prices[start] == price and ids[start] <= last_id:
+                start += 1
+
+        page = positions[start:start + limit]
+        rows = [self.rows[i] for i in page]
+
+        more = start + limit < len(positions)
+        next_key = (float(prices[start + limit - 1]), int(ids[start + limit - 1])) if more else None
+
+        return rows, next_key
@@ -0,0 +1,33 @@
+"""
+JSON rendering for chat replies.
+
+Replies are encoded straight to UTF-8 bytes by orjson instead of being
+walked by FastAPI's jsonable_encoder and then json.dumps. The output has
+the same shape: same keys, non-ASCII kept as is, non-string dict keys
+(e.g. None in category counts) turned into strings.
+"""
+import orjson
+from fastapi.responses import JSONResponse
+
+from records import ProductRecord
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    if isinstance(obj, ProductRecord):
+        return obj.as_dict()
+    if hasattr(obj, "item"):        # numpy scalars
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
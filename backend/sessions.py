@@ -0,0 +1,150 @@
+"""
+Per-session conversation state.
+
+Each chat session keeps its own last search (for the quick-reply
+buttons) and recipient context (for "him" / "her"), keyed by the
+X-Session-Id header or the session_id cookie. Sessions expire after
+SESSION_TTL_SECONDS of inactivity and at most SESSION_MAX_ENTRIES are
+kept; the least recently used go first.
+
+Backends (SESSION_BACKEND):
+- memory (default): in-process, one worker
+- redis: shared by every worker behind a load balancer (REDIS_URL)
+"""
+import json
+import os
+import re
+import time
+import uuid
+
+from cache import TTLCache
+
+SESSION_HEADER = "x-session-id"
+SESSION_COOKIE = "session_id"
+
+# Anything else gets a fresh id instead of becoming a storage key
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+
+def new_state() -> dict:
+    return {
+        "last_search": {},
+        "cart": [],                   # [{"product_id", "quantity", "price"}]
+        "last_context": {
+            "recipients": [],         # ["girlfriend", "brother"]
+            "departments": [],        # ["Women", "Men"]
+            "last_recipient": None,    # for pronouns (him / her)
+            "last_recipient_source": None
+        },
+    }
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id: str | None) -> bool:
+    return bool(session_id) and bool(SESSION_ID_RE.match(session_id))
+
+
+class MemorySessionStore:
+    def __init__(self, ttl: float = 1800, max_entries: int = 10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = TTLCache(ttl=ttl, max_entries=max_entries, clock=clock)
+
+    async def load(self, session_id: str) -> dict:
+        state = self._cache.get(session_id)
+        return state if state is not None else new_state()
+
+    async def save(self, session_id: str, state: dict):
+        # Re-setting refreshes both the TTL and the LRU position
+        self._cache.set(session_id, state)
+
+    async def delete(self, session_id: str):
+        self._cache.delete(session_id)
+
+    async def stats(self) -> dict:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class RedisSessionStore:
+    """
+    Sessions as JSON strings with a Redis TTL. A sorted set of last-seen
+    times provides the global LRU cap across workers.
+    `client` is a redis.asyncio client (or anything speaking the same
+    commands).
+    """
+
+    def __init__(
+        self,
+        client,
+        ttl: float = 1800,
+        max_entries: int = 10000,
+        prefix: str = "chat:session:",
+        clock=time.time
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.index_key = prefix + "lru"
+        self.clock = clock
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    async def load(self, session_id: str) -> dict:
+        raw = await self.client.get(self._key(session_id))
+        return json.loads(raw) if raw else new_state()
+
+    async def save(self, session_id: str, state: dict):
+        now = self.clock()
+
+        await self.client.set(
+            self._key(session_id), json.dumps(state), ex=max(1, int(self.ttl))
+        )
+        await self.client.zadd(self.index_key, {session_id: now})
+
+        # Expired sessions are already gone; drop them from the index too
+        await self.client.zremrangebyscore(self.index_key, "-inf", now - self.ttl)
+
+        excess = await self.client.zcard(self.index_key) - self.max_entries
+        if excess > 0:
+            evicted = await self.client.zpopmin(self.index_key, excess)
+            await self.client.delete(*[
+                self._key(m.decode() if isinstance(m, bytes) else m)
+                for m, _ in evicted
+            ])
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self._key(session_id))
+        await self.client.zrem(self.index_key, session_id)
+
+    async def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "entries": await self.client.zcard(self.index_key),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+        }
+
+
+def get_session_store():
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    ttl = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+    max_entries = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+
+    if backend == "memory":
+        return MemorySessionStore(ttl=ttl, max_entries=max_entries)
+
+    if backend == "redis":
+        import redis.asyncio as redis
+
+        client = redis.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            decode_responses=True
+        )
+        return RedisSessionStore(client, ttl=ttl, max_entries=max_entries)
+
+    raise RuntimeError(f"Unknown SESSION_BACKEND: {backend}")
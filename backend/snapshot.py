@@ -0,0 +1,224 @@
+"""
+In-memory catalog snapshot.
+
+The catalog is small (~30k products, 10 distribution centers), so it is
+read once into memory and everything the chat needs per store is
+precomputed from that read (per-store aggregates, the product name
+index, the comparison name resolver, the ranking features, the text
+vectors). A background task re-reads it every SNAPSHOT_REFRESH_SECONDS;
+readers always see one consistent snapshot because a refresh swaps the
+whole object.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from columnar import rss_bytes
+from name_resolver import NameResolver
+from price_index import PriceIndex
+from ranking import Ranker
+from search_index import ProductIndex
+from vector_index import DIM, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoreSummary:
+    id: int
+    name: str
+    latitude: float | None
+    longitude: float | None
+    product_count: int = 0
+    cheapest_price: float | None = None
+    most_expensive_price: float | None = None
+    categories: dict = field(default_factory=dict)
+    departments: dict = field(default_factory=dict)
+
+
+def build_store_summaries(stores, products):
+    """
+    One pass over the products: counts (every product, like COUNT(p.id))
+    and the price range (priced products only, like MIN / MAX) per store.
+    """
+    by_store = {s["id"]: [] for s in stores}
+
+    for p in products:
+        dc = p.get("distribution_center_id")
+        if dc in by_store:
+            by_store[dc].append(p)
+
+    summaries = {}
+
+    for s in stores:
+        items = by_store[s["id"]]
+        prices = [p["retail_price"] for p in items if p.get("retail_price") is not None]
+
+        summaries[s["id"]] = StoreSummary(
+            id=s["id"],
+            name=s["name"],
+            latitude=s.get("latitude"),
+            longitude=s.get("longitude"),
+            product_count=len(items),
+            cheapest_price=min(prices) if prices else None,
+            most_expensive_price=max(prices) if prices else None,
+            categories=dict(Counter(p.get("category") for p in items)),
+            departments=dict(Counter(p.get("department") for p in items)),
+        )
+
+    return summaries
+
+
+class CatalogSnapshot:
+    def __init__(self, stores, products, shared=None, vector_dim: int = DIM):
+        """
+        `shared` is the mapped ColumnarSnapshot the rows were read from,
+        if any: its numeric columns and stored indexes are then used in
+        place instead of being rebuilt in this worker (the vectors then
+        keep the dimension they were built with).
+        """
+        self.loaded_at = time.time()
+        self.stores = stores
+        self.products = products
+        self.summaries = build_store_summaries(stores, products)
+
+        stored = [shared.index(n) for n in ("price", "ranking", "vectors")] if shared else []
+        # Files written before the indexes were stored fall back to a local build
+        self.shared = bool(stored) and all(stored)
+        price, ranking, vectors = stored if self.shared else (None, None, None)
+
+        self.name_index = ProductIndex(
+            products,
+            store_names={s["id"]: s["name"] for s in stores},
+            columns=shared.numeric_columns("products") if self.shared else None,
+            price_index=PriceIndex.from_arrays(*price) if self.shared else None,
+        )
+        self.names = NameResolver([p.get("name") for p in products])
+        self.positions = {int(i): pos for pos, i in enumerate(self.name_index.ids.tolist())}
+
+        if self.shared:
+            self.ranker = Ranker.from_arrays(self.name_index, stores, *ranking)
+            self.vectors = VectorIndex.from_arrays(*vectors)
+        else:
+            self.ranker = Ranker(self.name_index, stores)
+            self.vectors = VectorIndex(self.name_index.rows, dim=vector_dim)
+
+    def store(self, store_id: int) -> StoreSummary | None:
+        return self.summaries.get(store_id)
+
+    def resolve_products(self, names) -> list[dict | None]:
+        """Best catalog row for each typed product name (None if no match)."""
+        return [
+            None if match is None else self.name_index.rows[match.position]
+            for match in self.names.resolve_many(names)
+        ]
+
+    def position_of(self, product_id: int) -> int | None:
+        return self.positions.get(int(product_id))
+
+    def min_prices(self) -> dict[int, float]:
+        return {
+            s.id: s.cheapest_price
+            for s in self.summaries.values()
+            if s.cheapest_price is not None
+        }
+
+
+class SnapshotManager:
+    """
+    Owns the current CatalogSnapshot: loads it on first use and keeps
+    it fresh from a background task.
+    """
+
+    def __init__(
+        self,
+        catalog,
+        refresh_seconds: float = 3600,
+        on_refresh=None,
+        vector_dim: int = DIM
+    ):
+        self.catalog = catalog
+        self.refresh_seconds = refresh_seconds
+        self.vector_dim = vector_dim
+        self.on_refresh = on_refresh
+        self.snapshot = None
+        self.refreshes = 0
+        self.last_error = None
+        self.load_seconds = None
+
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def get(self) -> CatalogSnapshot:
+        if self.snapshot is None:
+            async with self._lock:
+                if self.snapshot is None:
+                    await self._load()
+        return self.snapshot
+
+    async def refresh(self) -> CatalogSnapshot:
+        async with self._lock:
+            await self._load()
+        return self.snapshot
+
+    async def _load(self):
+        started = time.perf_counter()
+        shared = None
+
+        if hasattr(self.catalog, "load"):
+            # A snapshot file: rows and the arrays to share, from one version
+            stores, products, shared = await self.catalog.load()
+        else:
+            stores, products = await asyncio.gather(
+                self.catalog.distribution_centers(),
+                self.catalog.all_products(),
+            )
+
+        # Build off the event loop; readers keep the old snapshot meanwhile
+        self.snapshot = await asyncio.to_thread(
+            CatalogSnapshot, stores, products, shared, self.vector_dim
+        )
+        self.load_seconds = time.perf_counter() - started
+        self.refreshes += 1
+        self.last_error = None
+
+        if self.on_refresh:
+            self.on_refresh(self.snapshot)
+
+    def start(self):
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception as exc:
+                # Keep serving the previous snapshot
+                self.last_error = repr(exc)
+                logger.exception("Catalog snapshot refresh failed")
+
+    def stats(self) -> dict:
+        snap = self.snapshot
+        return {
+            "loaded": snap is not None,
+            "loaded_at": snap.loaded_at if snap else None,
+            "products": len(snap.products) if snap else 0,
+            "stores": len(snap.stores) if snap else 0,
+            "refreshes": self.refreshes,
+            "refresh_seconds": self.refresh_seconds,
+            "source": getattr(self.catalog, "name", type(self.catalog).__name__),
+            "shared_arrays": snap.shared if snap else False,
+            "load_seconds": self.load_seconds,
+            "rss_bytes": rss_bytes(),
+            "last_error": self.last_error,
+        }
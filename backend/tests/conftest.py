@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+# Run the suite offline against the bundled catalog snapshot.
+os.environ.setdefault("CATALOG_BACKEND", "local")
+os.environ.setdefault(
+    "CATALOG_DATA_DIR",
+    os.path.join(os.path.dirname(__file__), "data")
+)
+os.environ.setdefault("USER_ID", "1")
+os.environ.setdefault("ORDER_DB_PATH", ":memory:")
+os.environ.setdefault("ADMIN_TOKEN", "test-admin-token")
+
+
+class FakeClock:
+    """Stands in for time.monotonic; tests move it by setting `now`."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,27 @@
+import asyncio
+
+from benchmark import build_scripts, classify, load_guide_messages, run_benchmark
+
+def test_guide_includes_table_messages():
+    messages = load_guide_messages()
+    assert "Show me winter jackets under $10 and small" in messages
+    assert "closest store" in messages
+    assert not any(m.startswith("|") for m in messages)
+
+def test_scripts_are_padded_with_variations():
+    scripts = build_scripts(["closest store"], shoppers=3, per_shopper=5, seed=1)
+    assert len(scripts) == 3
+    assert all(len(s) == 5 and s[0] == "closest store" for s in scripts)
+
+def test_classify():
+    assert classify("show 3 nearest stores") == "store"
+    assert classify("I need a gift for my father") == "gift"
+    assert classify("Show me jackets under $10") == "price_search"
+
+def test_small_run_reports_percentiles():
+    report = asyncio.run(run_benchmark(requests=30, concurrency=4, per_shopper=10, warmup=2))
+
+    assert report["total"]["requests"] == 30
+    assert report["total"]["errors"] == 0
+    assert {"p50", "p95", "p99"} <= set(report["total"]["latency_ms"])
+    assert sum(i["requests"] for i in report["intents"].values()) == 30
@@ -0,0 +1,45 @@
+from cache import TTLCache
+
+def test_hit_and_miss_counters():
+    cache = TTLCache(ttl=10)
+    assert cache.get("a") is None
+    cache.set("a", [1, 2])
+    assert cache.get("a") == [1, 2]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10.0
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_lru_eviction_by_entries():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.keys() == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+def test_lru_eviction_by_bytes():
+    cache = TTLCache(max_entries=100, max_bytes=20)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+    assert cache.keys() == ["b"]
+    cache.set("huge", "z" * 100)
+    assert "huge" not in cache.keys()
+    assert cache.stats()["bytes"] <= 20
+
+    cache.set("b", "z" * 100)
+    assert cache.get("b") is None
+
+def test_clear():
+    cache = TTLCache()
+    cache.set("a", 1)
+    assert cache.clear() == 1
+    assert len(cache) == 0
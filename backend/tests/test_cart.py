@@ -0,0 +1,72 @@
+import asyncio
+
+import cart
+from products import ProductCache
+from sessions import new_state
+
+class FakeCatalog:
+    def __init__(self):
+        self.products = {
+            1: {"id": 1, "name": "Jacket", "retail_price": 50.0},
+            2: {"id": 2, "name": "Cap", "retail_price": 10.0},
+        }
+        self.calls = []
+
+    async def get_products(self, product_ids):
+        self.calls.append(list(product_ids))
+        return [dict(self.products[p]) for p in product_ids if p in self.products]
+
+def test_product_cache_batches_missing_ids(clock):
+    catalog = FakeCatalog()
+    products = ProductCache(catalog, ttl=60, clock=clock)
+
+    assert sorted(asyncio.run(products.get_many([1, 2, 3]))) == [1, 2]
+    assert sorted(asyncio.run(products.get_many([2, 1, 3]))) == [1, 2]
+    assert catalog.calls == [[1, 2, 3]]
+
+    clock.now += 61
+    asyncio.run(products.get_many([1]))
+    assert catalog.calls[-1] == [1]
+
+def test_revalidate_reprices_and_drops_in_one_lookup(clock):
+    catalog = FakeCatalog()
+    products = ProductCache(catalog, ttl=60, clock=clock)
+    state = new_state()
+
+    cart.add_item(state, catalog.products[1], 2)
+    cart.add_item(state, catalog.products[2])
+    cart.add_item(state, {"id": 3, "retail_price": 5.0})
+
+    catalog.products[1]["retail_price"] = 45.0
+    view = asyncio.run(cart.revalidate(state, products))
+
+    assert catalog.calls == [[1, 2, 3]]
+    assert [line["id"] for line in view["cart"]] == [1, 2]
+    assert view["total"] == 100.0
+    assert view["changes"] == [
+        {"product_id": 1, "change": "price", "old_price": 50.0, "new_price": 45.0},
+        {"product_id": 3, "change": "unavailable"},
+    ]
+
+    # Reported once: the stored cart now matches the catalog
+    assert asyncio.run(cart.revalidate(state, products))["changes"] == []
+
+def test_fresh_revalidation_reads_past_the_cache(clock):
+    catalog = FakeCatalog()
+    products = ProductCache(catalog, ttl=60, clock=clock)
+    state = new_state()
+
+    cart.add_item(state, catalog.products[1])
+    asyncio.run(cart.revalidate(state, products))
+
+    catalog.products[1]["retail_price"] = 55.0
+    assert asyncio.run(cart.revalidate(state, products))["changes"] == []
+    assert asyncio.run(cart.revalidate(state, products, fresh=True))["changes"] == [
+        {"product_id": 1, "change": "price", "old_price": 50.0, "new_price": 55.0},
+    ]
+    assert len(catalog.calls) == 2
+
+def test_old_sessions_get_an_empty_cart():
+    state = {"last_search": {}, "last_context": {}}
+    assert cart.remove_item(state, 1) is False
+    assert state["cart"] == []
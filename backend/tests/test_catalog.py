@@ -0,0 +1,164 @@
+import asyncio
+import os
+
+from catalog import BigQueryCatalog, LocalCatalog, QueryLimiter, SingleFlight
+from cost_guard import CostGuard
+from query_plan import QueryStats
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+catalog = LocalCatalog(DATA_DIR)
+
+def test_get_user():
+    assert asyncio.run(catalog.get_user(1))["gender"] == "M"
+    assert asyncio.run(catalog.get_user(999)) is None
+
+def test_get_users_in_one_query():
+    users = asyncio.run(catalog.get_users([1, 2, 999]))
+    assert sorted(u["id"] for u in users) == [1, 2]
+
+def test_distribution_centers():
+    stores = asyncio.run(catalog.distribution_centers())
+    assert len(stores) == 10
+    assert {"id", "name", "latitude", "longitude"} <= set(stores[0])
+
+def test_stores_matching_filters():
+    filters = {
+        "product": None,
+        "category": "dress",
+        "price": None,
+        "price_op": None,
+        "size": None,
+        "department": "Women",
+    }
+    assert sorted(asyncio.run(catalog.stores_matching(filters))) == [6, 9]
+    assert asyncio.run(catalog.stores_with_product("twill cap")) == [1]
+
+def test_search_products_filters():
+    products = asyncio.run(catalog.search_products(
+        price=10, price_op="under", department="Men", category="jacket"
+    ))
+    assert products
+    for p in products:
+        assert p["retail_price"] <= 10
+        assert p["department"] == "Men"
+        assert "jacket" in p["name"].lower()
+
+def test_all_products():
+    products = asyncio.run(catalog.all_products())
+    assert len(products) == 30
+    assert all(p["retail_price"] > 0 for p in products)
+
+def test_query_limiter_caps_in_flight_and_keeps_fifo_order():
+    limiter = QueryLimiter(2)
+    running = 0
+    peak = 0
+    order = []
+
+    async def job(i):
+        nonlocal running, peak
+        async with limiter:
+            order.append(i)
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main():
+        await asyncio.gather(*(job(i) for i in range(8)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert order == list(range(8))
+    assert limiter.in_flight == 0
+
+def test_query_limiter_cancelled_waiter_does_not_leak_slot():
+    limiter = QueryLimiter(1)
+
+    async def main():
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        limiter.release()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert limiter.in_flight == 0
+        await asyncio.wait_for(limiter.acquire(), timeout=1)
+
+    asyncio.run(main())
+
+class FakeJob:
+    def __init__(self, rows, polls):
+        self.rows = rows
+        self.polls = polls
+
+    def done(self):
+        self.polls -= 1
+        return self.polls <= 0
+
+    def result(self):
+        return self.rows
+
+class FakeClient:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        return FakeJob([{"id": 1, "name": "Chicago IL"}], polls=3)
+
+def test_bigquery_rows_polls_job_until_done():
+    bq = BigQueryCatalog.__new__(BigQueryCatalog)
+    bq.client = FakeClient()
+    bq.limiter = QueryLimiter(1)
+    bq.inflight = SingleFlight()
+    bq.query_stats = QueryStats()
+    bq.cost_guard = CostGuard()
+
+    rows = asyncio.run(bq._rows("SELECT 1"))
+    assert rows == [{"id": 1, "name": "Chicago IL"}]
+    assert bq.client.queries == ["SELECT 1"]
+    assert [s["executions"] for s in bq.query_stats.stats().values()] == [1]
+
+def test_identical_concurrent_queries_share_one_job():
+    bq = BigQueryCatalog.__new__(BigQueryCatalog)
+    bq.client = FakeClient()
+    bq.limiter = QueryLimiter(5)
+    bq.inflight = SingleFlight()
+    bq.query_stats = QueryStats()
+    bq.cost_guard = CostGuard()
+
+    async def burst():
+        return await asyncio.gather(*(bq._rows("SELECT 1") for _ in range(5)))
+
+    results = asyncio.run(burst())
+
+    assert bq.client.queries == ["SELECT 1"]
+    assert all(r == [{"id": 1, "name": "Chicago IL"}] for r in results)
+    assert bq.inflight.stats() == {"in_flight": 0, "started": 1, "coalesced": 4}
+    assert [s["coalesced"] for s in bq.query_stats.stats().values()] == [4]
+
+def test_single_flight_survives_caller_cancellation():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == ("done", True)
+    assert calls == [1]
+
+def test_get_products_by_id():
+    products = asyncio.run(catalog.get_products([1002, 1009, 424242]))
+    assert sorted(p["id"] for p in products) == [1002, 1009]
+    assert {p["distribution_name"] for p in products} == {"Memphis TN", "New Orleans LA"}
@@ -1,15 +1,234 @@
+import asyncio
+import json
+import os
+
 from fastapi.testclient import TestClient
+
+import main
+import metrics
+from cost_guard import QueryBudgetExceeded
 from main import app
+from pagination import encode_cursor
 
-client = TestClient(app)
+client = TestClient(app, headers={"X-Admin-Token": os.environ["ADMIN_TOKEN"]})
 
 def test_health():
     res = client.get("/health")
     assert res.status_code == 200
     assert res.json()["status"] == "ok"
 
+def test_admin_requires_a_configured_token(monkeypatch):
+    assert TestClient(app).get("/admin/cache").status_code == 403
+    assert TestClient(app, headers={"X-Admin-Token": "wrong"}).get("/admin/cache").status_code == 403
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/cache").status_code == 503
+
 def test_chat_basic_search():
     res = client.get("/chat", params={"message": "Show me jackets"})
     assert res.status_code == 200
     body = res.json()
-    assert "reply" in body
\ No newline at end of file
+    assert "reply" in body
+
+def test_search_cache_hit_and_flush():
+    client.delete("/admin/cache")
+    client.get("/chat", params={"message": "Show me jackets under $50"})
+    client.get("/chat", params={"message": "Show me jackets under $50"})
+
+    stats = client.get("/admin/cache").json()["search"]
+    assert stats["hits"] >= 1
+    assert stats["entries"] >= 1
+
+    assert client.delete("/admin/cache").json()["flushed"] >= 1
+    assert client.get("/admin/cache").json()["search"]["entries"] == 0
+
+def test_stores_within_radius():
+    res = client.get("/chat", params={"message": "stores within 800 km"})
+    stores = res.json()["stores"]
+    assert [s["name"] for s in stores] == ["Chicago IL", "Memphis TN"]
+
+def test_sessions_do_not_share_filters():
+    shopper = {"X-Session-Id": "session-shopper"}
+    other = {"X-Session-Id": "session-other"}
+
+    client.get("/chat", params={"message": "small jackets under $50"}, headers=shopper)
+
+    res = client.get("/chat", params={"message": "remove size filter"}, headers=other)
+    assert "under $50" not in res.json()["reply"]
+
+    res = client.get("/chat", params={"message": "remove size filter"}, headers=shopper)
+    assert "under $50" in res.json()["reply"]
+    assert res.headers["X-Session-Id"] == "session-shopper"
+
+def test_new_session_gets_cookie():
+    res = TestClient(app).get("/chat", params={"message": "Show me jackets"})
+    assert res.cookies.get("session_id") == res.headers["X-Session-Id"]
+
+def test_user_id_per_request():
+    res = client.get("/chat", params={"message": "closest store"}, headers={"X-User-Id": "3"})
+    assert "have your location" in res.json()["reply"]
+
+    res = client.get("/chat", params={"message": "closest store"}, headers={"X-User-Id": "999"})
+    assert res.status_code == 404
+
+def test_server_timing_and_metrics():
+    res = client.get("/chat", params={"message": "show 3 nearest stores"})
+    timing = res.headers["Server-Timing"]
+    assert "parse;dur=" in timing
+    assert "serialize;dur=" in timing
+    assert "total;dur=" in timing
+
+    body = client.get("/metrics").text
+    assert 'chat_stage_seconds_bucket{intent="closest_store",le="0.0005",stage="handler"}' in body
+    assert 'chat_requests_total{intent="closest_store",status="200"}' in body
+
+def test_chat_stream_ndjson():
+    res = client.get("/chat/stream", params={"message": "Show me jackets under $50"})
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+
+    events = [json.loads(line) for line in res.text.splitlines()]
+    kinds = [e["event"] for e in events]
+
+    assert kinds[0] == "intent" and events[0]["intent"] == "price_search"
+    assert kinds[1] == "ack" and events[1]["reply"].startswith("Looking for jackets")
+    assert kinds[-1] == "done" and events[-1]["reply"].startswith("Here are")
+    assert kinds.count("product") == len(client.get("/chat", params={"message": "Show me jackets under $50"}).json()["products"])
+
+def test_chat_stream_sse_stores():
+    res = client.get("/chat/stream", params={"message": "show 3 nearest stores", "format": "sse"})
+    assert res.headers["content-type"].startswith("text/event-stream")
+    assert res.text.count("event: store\n") == 3
+    assert res.text.rstrip().splitlines()[-2] == "event: done"
+
+def test_show_more_continues_previous_results():
+    shopper = {"X-Session-Id": "session-pager"}
+
+    first = client.get("/chat", params={"message": "Show me jackets"}, headers=shopper).json()
+    assert first["quick_replies"] == ["Show more"]
+
+    hits = client.get("/admin/cache").json()["search"]["hits"]
+    more = client.get("/chat", params={"message": "Show more"}, headers=shopper).json()
+
+    assert more["reply"].startswith("Here are more jackets")
+    assert not {p["id"] for p in more["products"]} & {p["id"] for p in first["products"]}
+    assert client.get("/admin/cache").json()["search"]["hits"] == hits + 1
+    assert client.get("/admin/cache").json()["rankings"]["hits"] >= 1
+
+def test_store_products_cursor():
+    first = client.get("/stores/1/products", params={"limit": 2}).json()
+    rest = client.get("/stores/1/products", params={"cursor": first["next_cursor"], "limit": 10}).json()
+
+    everything = client.get("/stores/1/products", params={"limit": 10}).json()
+    assert [p["id"] for p in first["products"] + rest["products"]] == [p["id"] for p in everything["products"]]
+    assert rest["next_cursor"] is None
+
+def test_chat_batch_streams_in_order_and_shares_searches():
+    client.delete("/admin/cache")
+    started = client.get("/admin/cache").json()["search"]["in_flight"]["started"]
+    res = client.post("/chat/batch", json={"messages": [
+        {"message": "small jackets under $50", "session_id": "batch-shopper"},
+        "Show me jackets under $50",
+        {"message": "remove size filter", "session_id": "batch-shopper"},
+        "Show me jackets under $50",
+        {"message": "hi", "user_id": 999},
+    ]})
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+
+    # Same session: the quick reply sees the first message's filters
+    assert lines[2]["intent"] == "quick_reply"
+    assert "under $50" in lines[2]["reply"]
+    assert lines[1]["products"] == lines[3]["products"]
+    assert lines[4]["error"]["status"] == 404
+
+    # Three distinct searches; the repeated one is served by the first
+    searches = client.get("/admin/cache").json()["search"]["in_flight"]
+    assert searches["started"] - started == 3
+
+def test_chat_batch_rejects_bad_items():
+    res = client.post("/chat/batch", json={"messages": [{"session_id": "batch-shopper"}]})
+    assert res.status_code == 400
+
+def test_compare_three_products_by_name():
+    res = client.get("/chat", params={"message": (
+        "Compare Carhartt Men's Duck Active Jacket, Levi's Men's Denim Trucker Jacket "
+        "and Alpha Industries Men's Winter Jacket"
+    )})
+    body = res.json()
+
+    assert body["reply"] == "Here’s a comparison of the 3 products you mentioned:"
+    assert [p["id"] for p in body["products"]] == [1002, 1009, 1005]
+
+def test_server_side_cart_and_checkout():
+    shopper = {"X-Session-Id": "session-cart"}
+
+    client.post("/cart/items", json={"product_id": 1002, "quantity": 2}, headers=shopper)
+    res = client.post("/cart/items", json={"product_id": 1009}, headers=shopper)
+    assert res.json()["total"] == 138.98
+    assert client.post("/cart/items", json={"product_id": 424242}, headers=shopper).status_code == 404
+
+    body = client.get("/chat", params={"message": "show my cart"}, headers=shopper).json()
+    assert body["action"] == "show_cart"
+    assert [p["id"] for p in body["cart"]] == [1002, 1009]
+    assert "cost" not in body["cart"][0]
+
+    client.delete("/cart/items/1009", headers=shopper)
+    orders = client.get("/admin/orders").json()["orders"]
+    order = client.post("/checkout", headers=shopper).json()
+    assert order["total"] == 99.98
+    assert client.get("/admin/orders").json()["orders"] == orders + 1
+    inventory = main.ORDERS.unexported(1000)["inventory_items"]
+    assert all(i["cost"] is not None for i in inventory if i["product_id"] == 1002)
+    assert client.get("/cart", headers=shopper).json()["cart"] == []
+
+def test_checkout_refuses_stale_client_prices():
+    res = client.post(
+        "/checkout",
+        json={"cart": [{"id": 1002, "retail_price": 10.0}]},
+        headers={"X-Session-Id": "session-stale-cart"}
+    )
+    assert res.status_code == 409
+    assert res.json()["changes"][0]["new_price"] == 49.99
+
+def test_show_similar_items_uses_vector_index():
+    shopper = {"X-Session-Id": "session-similar"}
+
+    client.get("/chat", params={"message": "winter jackets under $5"}, headers=shopper)
+    body = client.get("/chat", params={"message": "Show similar items"}, headers=shopper).json()
+
+    assert body["reply"] == "Here are items similar to jackets for men."
+    assert all(p["department"] == "Men" for p in body["products"])
+    assert 1010 not in [p["id"] for p in body["products"]]
+
+def test_product_text_search_and_similar():
+    found = client.get("/products/search", params={"q": "denim trucker jackt"}).json()["products"]
+    assert found[0]["id"] == 1009
+
+    similar = client.get("/products/1009/similar", params={"limit": 3}).json()["products"]
+    assert len(similar) == 3 and 1009 not in [p["id"] for p in similar]
+    assert client.get("/products/424242/similar").status_code == 404
+
+def test_store_products_rejects_malformed_cursors():
+    for data in ({"a": 1}, {"price": "x", "id": 1}, [1], {"price": 9.5, "id": 1.5}):
+        res = client.get("/stores/1/products", params={"cursor": encode_cursor(data)})
+        assert res.status_code == 400, data
+        assert res.json()["detail"] == "Invalid cursor"
+
+    assert client.get("/stores/1/products", params={"cursor": "!!!"}).status_code == 400
+
+def test_chat_batch_messages_keep_their_own_intent_and_budget_errors(monkeypatch):
+    async def fake_handle(message, state, user, emit=None):
+        if message == "too expensive":
+            raise QueryBudgetExceeded("price_search", 10, 1)
+        metrics.set_intent(message)
+        await asyncio.sleep(0.01)
+        return {"reply": metrics.current().intent}
+
+    monkeypatch.setattr(main, "handle_message", fake_handle)
+    res = client.post("/chat/batch", json={"messages": ["first", "second", "too expensive"]})
+    lines = [json.loads(line) for line in res.text.splitlines()]
+
+    assert [line.get("reply") for line in lines[:2]] == ["first", "second"]
+    assert lines[2]["error"] == {"status": 429, "detail": "Query over budget"}
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import threading
+
+import numpy as np
+
+from catalog import LocalCatalog
+from columnar import ColumnarSnapshot, ColumnarSource, SCHEMA, find_table_file, read_table, write_snapshot
+from price_index import ALL
+from ranking import RankingWeights
+from snapshot import CatalogSnapshot, SnapshotManager
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def build(tmp_path):
+    path = str(tmp_path / "catalog.snap")
+    write_snapshot(path, {t: read_table(find_table_file(DATA_DIR, t), t) for t in SCHEMA})
+    return path
+
+def test_round_trip_matches_local_catalog(tmp_path):
+    snap = ColumnarSnapshot(build(tmp_path))
+    local = LocalCatalog(DATA_DIR)
+
+    products = sorted(asyncio.run(local.all_products()), key=lambda p: p["id"])
+    assert sorted(snap.records("products"), key=lambda p: p["id"]) == [
+        {c: p.get(c) for c in SCHEMA["products"]} for p in products
+    ]
+
+    stores = asyncio.run(local.distribution_centers())
+    assert snap.records("distribution_centers") == stores
+
+def test_columns_are_dictionary_encoded_views(tmp_path):
+    snap = ColumnarSnapshot(build(tmp_path))
+
+    departments = snap.column("products", "department")
+    assert departments.dictionary == ["Men", "Women"]
+    assert departments.codes.dtype.itemsize == 4
+    assert not snap.column("products", "retail_price").flags.writeable
+
+def test_snapshot_manager_loads_from_file(tmp_path):
+    manager = SnapshotManager(ColumnarSource(build(tmp_path)), refresh_seconds=0)
+    snapshot = asyncio.run(manager.get())
+
+    assert len(snapshot.products) == 30
+    assert manager.stats()["source"] == "columnar"
+    assert manager.stats()["load_seconds"] > 0
+
+def test_snapshot_searches_with_views_over_the_file(tmp_path):
+    snap = ColumnarSnapshot(build(tmp_path))
+    stores = snap.records("distribution_centers")
+    products = snap.records("products")
+
+    shared = CatalogSnapshot(stores, products, shared=snap)
+    local = CatalogSnapshot(stores, products)
+
+    assert shared.shared and not local.shared
+    for array in (
+        shared.name_index.prices,
+        shared.name_index.price_index.partitions[(ALL, ALL)].positions,
+        shared.ranker.name_lengths,
+        shared.vectors.matrix,
+    ):
+        assert not array.flags.writeable and not array.flags.owndata
+
+    assert list(shared.name_index.filter_positions(price=50, price_op="under", department="Men")) == \
+        list(local.name_index.filter_positions(price=50, price_op="under", department="Men"))
+
+    positions = local.name_index.filter_positions(product="jacket")
+    args = (positions, RankingWeights(), "jacket", 60.0, (40.7, -74.0))
+    assert np.array_equal(shared.ranker.scores(*args), local.ranker.scores(*args))
+    assert shared.vectors.search(["denim jacket"]) == local.vectors.search(["denim jacket"])
+
+def test_reload_closes_the_previous_mapping(tmp_path):
+    path = build(tmp_path)
+    manager = SnapshotManager(ColumnarSource(path), refresh_seconds=0)
+    asyncio.run(manager.get())
+    first = manager.catalog.snapshot
+
+    os.utime(path, (0, 0))
+    asyncio.run(manager.refresh())
+    # The first chat snapshot was still serving while the new one was built
+    assert not first._map.closed
+
+    asyncio.run(manager.refresh())
+    assert first._map.closed
+    assert manager.snapshot.shared
+
+def test_rows_are_decoded_off_the_event_loop(tmp_path, monkeypatch):
+    source = ColumnarSource(build(tmp_path))
+    threads = set()
+    records = ColumnarSnapshot.records
+
+    def spy(self, table):
+        threads.add(threading.current_thread())
+        return records(self, table)
+
+    monkeypatch.setattr(ColumnarSnapshot, "records", spy)
+    asyncio.run(source.load())
+
+    assert threads and threading.main_thread() not in threads
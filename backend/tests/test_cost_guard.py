@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import metrics
+from catalog import BigQueryCatalog, QueryLimiter, SingleFlight
+from cost_guard import CostGuard, QueryBudgetExceeded, parse_budgets
+from query_plan import QueryStats
+
+class FakeJob:
+    def __init__(self, bytes_processed, cache_hit=False, error_result=None):
+        self.total_bytes_processed = bytes_processed
+        self.total_bytes_billed = 0 if cache_hit else bytes_processed
+        self.slot_millis = 0 if cache_hit else 250
+        self.cache_hit = cache_hit
+        self.error_result = error_result
+
+    def done(self):
+        return True
+
+    def result(self):
+        return [{"id": 1}]
+
+class FakeClient:
+    """Dry runs and jobs both report `scan_bytes` processed."""
+
+    def __init__(self, scan_bytes, max_billed_error=False):
+        self.scan_bytes = scan_bytes
+        self.max_billed_error = max_billed_error
+        self.dry_runs = 0
+        self.jobs = []
+
+    def query(self, query, job_config=None):
+        if job_config.dry_run:
+            self.dry_runs += 1
+            return FakeJob(self.scan_bytes)
+
+        self.jobs.append(job_config.maximum_bytes_billed)
+        if self.max_billed_error:
+            return FakeJob(0, error_result={"reason": "bytesBilledLimitExceeded"})
+        return FakeJob(self.scan_bytes)
+
+def make_catalog(client, guard):
+    bq = BigQueryCatalog.__new__(BigQueryCatalog)
+    bq.client = client
+    bq.cost_guard = guard
+    bq.limiter = QueryLimiter(4)
+    bq.inflight = SingleFlight()
+    bq.query_stats = QueryStats()
+    return bq
+
+def run_as(intent, coro):
+    async def inside_request():
+        metrics.start_request().intent = intent
+        return await coro
+
+    return asyncio.run(inside_request())
+
+def test_parse_budgets():
+    assert parse_budgets("store=1e9, price_search=500") == {"store": 1000000000, "price_search": 500}
+    assert parse_budgets(None) == {}
+
+def test_over_budget_query_is_refused_before_it_runs():
+    client = FakeClient(scan_bytes=5_000)
+    guard = CostGuard(dry_run=True, default_budget=10_000, intent_budgets={"search": 1_000})
+    bq = make_catalog(client, guard)
+
+    with pytest.raises(QueryBudgetExceeded) as exc:
+        run_as("search", bq._rows("SELECT name FROM products"))
+    assert (exc.value.intent, exc.value.estimated_bytes, exc.value.budget_bytes) == ("search", 5_000, 1_000)
+
+    assert client.jobs == []
+    assert guard.stats()["intents"]["search"]["refused"] == 1
+
+def test_estimates_are_cached_and_costs_recorded_per_intent():
+    client = FakeClient(scan_bytes=5_000)
+    guard = CostGuard(max_bytes_billed=1_000_000, dry_run=True, default_budget=10_000)
+    bq = make_catalog(client, guard)
+
+    run_as("store", bq._rows("SELECT id FROM stores"))
+    run_as("store", bq._rows("SELECT id FROM stores"))
+
+    assert client.dry_runs == 1
+    assert client.jobs == [1_000_000, 1_000_000]
+
+    store = guard.stats()["intents"]["store"]
+    assert store["jobs"] == 2
+    assert store["bytes_processed"] == 10_000
+    assert store["slot_ms"] == 500
+    assert store["dry_runs"] == 1
+
+def test_maximum_bytes_billed_failure_is_a_refusal():
+    client = FakeClient(scan_bytes=5_000, max_billed_error=True)
+    guard = CostGuard(max_bytes_billed=100)
+    bq = make_catalog(client, guard)
+
+    with pytest.raises(QueryBudgetExceeded):
+        run_as("compare", bq._rows("SELECT * FROM products"))
+
+    assert client.dry_runs == 0
+    assert guard.stats()["intents"]["compare"]["refused"] == 1
@@ -0,0 +1,39 @@
+from geo import StoreIndex, haversine_km
+
+STORES = [
+    {"id": 1, "name": "Memphis TN", "latitude": 35.1174, "longitude": -89.9711},
+    {"id": 2, "name": "Chicago IL", "latitude": 41.8369, "longitude": -87.6847},
+    {"id": 3, "name": "Houston TX", "latitude": 29.7604, "longitude": -95.3698},
+    {"id": 4, "name": "Los Angeles CA", "latitude": 34.05, "longitude": -118.25},
+    {"id": 5, "name": "No Location", "latitude": None, "longitude": None},
+]
+
+CHICAGO = (41.8781, -87.6298)
+
+index = StoreIndex(STORES)
+
+def test_haversine_km():
+    # Chicago -> Memphis is roughly 780 km
+    assert 770 < haversine_km(41.8369, -87.6847, 35.1174, -89.9711) < 790
+
+def test_skips_centers_without_location():
+    assert len(index) == 4
+    assert index.get(5) is None
+
+def test_nearest_sorted_by_distance():
+    stores = index.nearest(*CHICAGO, k=3)
+    assert [s["id"] for s in stores] == [2, 1, 3]
+    assert stores[0]["distance_km"] < 10
+
+def test_nearest_restricted_to_ids():
+    stores = index.nearest(*CHICAGO, k=5, store_ids=[3, 4])
+    assert [s["id"] for s in stores] == [3, 4]
+
+def test_nearest_k_larger_than_index():
+    assert len(index.nearest(*CHICAGO, k=50)) == 4
+    assert index.nearest(*CHICAGO, k=0) == []
+
+def test_within_radius():
+    stores = index.within(*CHICAGO, radius_km=800)
+    assert [s["id"] for s in stores] == [2, 1]
+    assert index.within(*CHICAGO, radius_km=1) == []
@@ -0,0 +1,49 @@
+import re
+
+from name_resolver import NameResolver, normalize_name
+
+SEPARATOR_RE = re.compile(r"\s*,\s*|\s+and\s+")
+
+NAMES = [
+    "Low Profile Dyed Cotton Twill Cap - Navy W39S55D",
+    "Enzyme Regular Solid Army Caps-Black W35S45D",
+    "Carhartt Men's Duck Active Jacket",
+    "Carhartt Men's Duck Active Jacket Large",
+    None,
+]
+
+resolver = NameResolver(NAMES)
+
+def test_normalize_ignores_case_and_punctuation():
+    assert normalize_name("Caps-Black  W35S45D!") == "caps black w35s45d"
+
+def test_exact_match():
+    match = resolver.resolve("enzyme regular solid army caps-black w35s45d")
+    assert (match.position, match.method) == (1, "exact")
+
+def test_prefix_prefers_shortest_name():
+    match = resolver.resolve("Carhartt Men's Duck")
+    assert (match.position, match.method) == (2, "prefix")
+
+def test_trigram_fallback_tolerates_typos():
+    match = resolver.resolve("Low Profile Died Coton Twill Cap Navy")
+    assert (match.position, match.method) == (0, "trigram")
+
+def test_unrelated_text_has_no_match():
+    assert resolver.resolve("Quantum Flux Capacitor 3000") is None
+    assert resolver.resolve("") is None
+
+def test_split_keeps_separators_inside_product_names():
+    names = NameResolver([
+        "Levi's Black and White Tee",
+        "Hanes Cargo Shorts, Slim",
+        "Carhartt Men's Duck Active Jacket",
+    ])
+
+    assert names.split(
+        "Levi's Black and White Tee and Hanes Cargo Shorts, Slim, Carhartt Men's Duck Active Jacket",
+        SEPARATOR_RE,
+    ) == ["Levi's Black and White Tee", "Hanes Cargo Shorts, Slim", "Carhartt Men's Duck Active Jacket"]
+
+    assert names.split("Levi's Black and White Tee", SEPARATOR_RE) == ["Levi's Black and White Tee"]
+    assert names.split("Levi's Black and Nothing Else Matches", SEPARATOR_RE) is None
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from orders import LOCAL_ID_BASE, BigQueryOrderSink, OrderExporter, OrderStore
+
+USER = {"id": 7, "gender": "F"}
+
+LINES = [
+    {"id": 1002, "name": "Jacket", "retail_price": 49.99, "distribution_center_id": 1, "quantity": 2},
+    {"id": 1009, "name": "Trucker", "retail_price": 39.0, "distribution_center_id": 5, "quantity": 1},
+]
+
+class FakeSink:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    async def write(self, batch):
+        if self.fail:
+            raise RuntimeError("analytics down")
+        self.batches.append(batch)
+
+def test_order_rows_written_together_with_generated_ids():
+    store = OrderStore(":memory:")
+
+    first = asyncio.run(store.place_order(USER, LINES))
+    second = asyncio.run(store.place_order(USER, LINES[:1]))
+
+    assert (first["order_id"], second["order_id"]) == (LOCAL_ID_BASE + 1, LOCAL_ID_BASE + 2)
+    assert first["num_of_item"] == 3
+    assert first["total"] == 138.98
+    assert [i["inventory_item_id"] - LOCAL_ID_BASE for i in first["items"]] == [1, 2, 3]
+    assert [i["inventory_item_id"] - LOCAL_ID_BASE for i in second["items"]] == [4, 5]
+
+def test_concurrent_checkouts_never_share_ids():
+    store = OrderStore(":memory:")
+
+    async def checkout_many():
+        return await asyncio.gather(*(store.place_order(USER, LINES) for _ in range(20)))
+
+    orders = asyncio.run(checkout_many())
+    item_ids = [i["id"] for o in orders for i in o["items"]]
+
+    assert sorted(o["order_id"] - LOCAL_ID_BASE for o in orders) == list(range(1, 21))
+    assert len(set(item_ids)) == len(item_ids) == 60
+
+def test_exporter_sends_batches_and_retries_failures():
+    store = OrderStore(":memory:")
+    asyncio.run(store.place_order(USER, LINES))
+    asyncio.run(store.place_order(USER, LINES))
+
+    failing = OrderExporter(store, FakeSink(fail=True), batch_size=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing.flush())
+    assert store.stats()["pending_export"] == 2
+
+    sink = FakeSink()
+    assert asyncio.run(OrderExporter(store, sink, batch_size=1).flush()) == 2
+    assert [len(b["order_items"]) for b in sink.batches] == [3, 3]
+    assert store.stats()["pending_export"] == 0
+
+def test_store_opens_lazily_and_records_unit_costs(tmp_path):
+    path = tmp_path / "data" / "orders.db"
+    store = OrderStore(str(path))
+    assert not path.exists()
+
+    asyncio.run(store.place_order(USER, LINES, costs={1002: 20.5}))
+    assert path.exists()
+
+    costs = [r["cost"] for r in store.unexported()["inventory_items"]]
+    assert costs == [20.5, 20.5, None]
+    store.close()
+
+class FakeBigQuery:
+    def __init__(self):
+        self.calls = []
+
+    def insert_rows_json(self, table, rows, row_ids=None):
+        self.calls.append((table, row_ids))
+        return []
+
+def test_sink_sends_stable_insert_ids():
+    store = OrderStore(":memory:")
+    asyncio.run(store.place_order(USER, LINES[1:]))
+    client = FakeBigQuery()
+
+    batch = store.unexported()
+    asyncio.run(BigQueryOrderSink(client, "shop").write(batch))
+    asyncio.run(BigQueryOrderSink(client, "shop").write(batch))
+
+    first, retried = client.calls[:3], client.calls[3:]
+    assert first == retried
+    assert first[0] == ("shop.orders", [f"orders-{LOCAL_ID_BASE + 1}"])
@@ -0,0 +1,54 @@
+from message_parser import KeywordMatcher, parse_message, route
+
+def test_matcher_reports_overlapping_hits():
+    matcher = KeywordMatcher(["he", "she", "his", "hers"])
+    assert sorted(matcher.find("ushers")) == [(1, "she"), (2, "he"), (2, "hers")]
+
+def test_parse_extracts_everything_in_one_call():
+    parsed = parse_message("small jacket for my sister under $40")
+
+    assert parsed.intent == "price_search"
+    assert parsed.size == "s"
+    assert parsed.category == "jacket"
+    assert (parsed.price, parsed.price_op) == (40, "under")
+    assert parsed.recipients == ("sister",)
+    assert parsed.recipient_departments == ("Women",)
+    assert parsed.has_explicit_recipient
+
+def test_price_digits_still_count_as_number():
+    parsed = parse_message("closest store with winter jackets under $100")
+
+    assert parsed.price == 100
+    assert parsed.number == 100
+    assert parsed.store_product == "winter jacket"
+
+def test_radius_in_miles():
+    parsed = parse_message("stores within 10 miles")
+
+    assert parsed.is_closest_store
+    assert round(parsed.radius_km, 3) == 16.093
+    assert parsed.number == 10
+
+def test_store_product_from_capitalized_name():
+    parsed = parse_message("Closest store with Columbia Men's Rain Parka")
+    assert parsed.store_product == "Columbia Men's Rain Parka"
+
+def test_relax_price_is_whole_message():
+    assert parse_message("Show similar items").is_relax_price
+    assert not parse_message("show similar items please").is_relax_price
+
+def test_parse_is_cached():
+    assert parse_message("xl hoodie") is parse_message("xl hoodie")
+
+def test_show_more_routes_before_search():
+    parsed = parse_message("Show more")
+    assert parsed.is_show_more
+    assert route(parsed) == "show_more"
+    assert not parse_message("show me more jackets").is_show_more
+    assert parse_message("Show more please!").is_show_more
+
+def test_show_more_with_a_new_search_is_a_search():
+    for message in ("show more jackets under $50", "more results for boots", "next page of xl hoodies"):
+        parsed = parse_message(message)
+        assert not parsed.is_show_more
+        assert route(parsed) != "show_more"
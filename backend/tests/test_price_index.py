@@ -0,0 +1,45 @@
+import numpy as np
+
+from price_index import ALL, PriceIndex
+
+PRICES = np.array([30.0, 10.0, np.nan, 10.0, 25.0, 5.0, 49.99])
+DEPARTMENTS = ["Men", "Men", "Men", "Women", "Women", "Women", "Men"]
+CATEGORIES = ["Jeans", "Jeans", "Jeans", "Dresses", "Dresses", "Tops", "Outerwear"]
+
+index = PriceIndex(PRICES, DEPARTMENTS, CATEGORIES)
+
+def test_ranges_match_a_linear_filter():
+    for department in (None, "Men", "Women", ["Men", "Women"]):
+        for price, price_op in [(10, "under"), (25, "over"), (10, "exact"), (49.98, "exact")]:
+            mask = {
+                "under": PRICES <= price,
+                "over": PRICES >= price,
+                "exact": (PRICES >= price - 0.01) & (PRICES <= price + 0.01),
+            }[price_op]
+            if department:
+                mask &= np.isin(DEPARTMENTS, department)
+
+            got = np.sort(index.range(price, price_op, department))
+            assert got.tolist() == np.flatnonzero(mask).tolist()
+
+def test_category_partitions_and_unknown_keys():
+    assert index.range(100, "under", "Men", "Jeans").tolist() == [1, 0]
+    assert index.range(100, "under", "Kids").tolist() == []
+
+def test_cheapest_slices_in_price_order():
+    assert index.cheapest(2).tolist() == [5, 1]
+    assert index.cheapest(10, "Men").tolist() == [1, 0, 6]
+    assert index.cheapest(3, ["Men", "Women"]).tolist() == [5, 1, 3]
+
+def test_null_department_and_category_keep_their_own_partitions():
+    nulls = PriceIndex(np.array([10.0, 20.0, 30.0, 40.0]), ["Men", None, "Women", "Men"], ["Jeans", "Tops", "Tops", None])
+
+    assert np.sort(nulls.range(100, "under")).tolist() == [0, 1, 2, 3]
+    assert nulls.range(100, "under", "Men").tolist() == [0, 3]
+    assert nulls.range(100, "under", "Men", "Jeans").tolist() == [0]
+    assert nulls.partitions[(None, ALL)].positions.tolist() == [1]
+
+    arrays, meta = nulls.to_arrays()
+    restored = PriceIndex.from_arrays(arrays, meta)
+    assert restored.partitions.keys() == nulls.partitions.keys()
+    assert np.sort(restored.range(100, "under")).tolist() == [0, 1, 2, 3]
@@ -0,0 +1,41 @@
+from catalog import BIGQUERY_DIALECT, SQLITE_DIALECT
+from query_plan import ProductFilter, QueryStats, compile_product_search, compile_store_ids
+
+def test_equal_questions_compile_to_identical_sql():
+    a = ProductFilter.build(category="Jacket ", price=10, price_op="under", department=["Women", "Men"])
+    b = ProductFilter.build(category="jacket", price=10.0, price_op="under", department=["Men", "Women", "Men"])
+
+    assert a == b
+    assert compile_product_search(a, BIGQUERY_DIALECT).fingerprint == \
+        compile_product_search(b, BIGQUERY_DIALECT).fingerprint
+
+def test_values_are_parameters_not_sql():
+    f = ProductFilter.build(size="s", price=25, price_op="exact", department="Men", exclude_department="Men")
+    compiled = compile_product_search(f, BIGQUERY_DIALECT, limit=7)
+
+    assert "25" not in compiled.sql
+    assert "7" not in compiled.sql
+    assert "ladies" not in compiled.sql
+    assert "LIMIT @limit" in compiled.sql
+    assert dict(compiled.param_values())["exclude_0"] == "%ladies%"
+
+def test_limit_and_values_do_not_change_fingerprint():
+    f1 = ProductFilter.build(category="jacket", price=10, price_op="under")
+    f2 = ProductFilter.build(category="coat", price=99, price_op="under")
+
+    assert compile_product_search(f1, BIGQUERY_DIALECT, limit=5).fingerprint == \
+        compile_product_search(f2, BIGQUERY_DIALECT, limit=20).fingerprint
+
+def test_store_ids_sqlite_expands_departments():
+    compiled = compile_store_ids(ProductFilter.build(department=["Men", "Women"]), SQLITE_DIALECT)
+    assert "p.department IN (:department_0, :department_1)" in compiled.sql
+
+def test_query_stats_hit_rate():
+    stats = QueryStats()
+    stats.record("abc", "SELECT 1", cache_hit=True)
+    stats.record("abc", "SELECT 1", cache_hit=False)
+    stats.record("abc", "SELECT 1")
+
+    entry = stats.stats()["abc"]
+    assert entry["executions"] == 3
+    assert entry["hit_rate"] == 0.5
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from pagination import IndexResults
+from ranking import RankedResults, Ranker, RankingWeights
+from search_index import ProductIndex
+
+PRODUCTS = [
+    {"id": 1, "name": "Columbia Men's Steens Mountain Fleece Jacket", "category": "Outerwear & Coats", "retail_price": 89.99, "distribution_center_id": 2},
+    {"id": 2, "name": "Men's Rain Jacket", "category": "Outerwear & Coats", "retail_price": 45.0, "distribution_center_id": 3},
+    {"id": 3, "name": "Men's Jacket Print Tee", "category": "Tops & Tees", "retail_price": 19.0, "distribution_center_id": 2},
+    {"id": 4, "name": "Men's Bomber Jacket", "category": "Outerwear & Coats", "retail_price": 52.0, "distribution_center_id": 3},
+]
+STORES = [
+    {"id": 2, "name": "Chicago IL", "latitude": 41.8369, "longitude": -87.6847},
+    {"id": 3, "name": "Houston TX", "latitude": 29.7604, "longitude": -95.3698},
+]
+CHICAGO = (41.88, -87.63)
+
+index = ProductIndex(PRODUCTS)
+ranker = Ranker(index, STORES)
+jackets = index.filter_positions(category="jacket")
+
+def ranked_ids(weights, **query):
+    return [r["id"] for r in RankedResults(IndexResults(index, jackets), ranker, weights, **query).page(0, 10)]
+
+def test_parse_weights():
+    assert RankingWeights.parse("name=2, proximity=0") == RankingWeights(name=2.0, proximity=0.0)
+    assert RankingWeights.parse(None) == RankingWeights()
+    with pytest.raises(ValueError):
+        RankingWeights.parse("popularity=1")
+
+def test_each_signal_reorders_candidates():
+    name_only = RankingWeights(name=1, category=0, price=0, proximity=0)
+    assert ranked_ids(name_only, query="jacket") == [2, 4, 3, 1]
+
+    category_only = RankingWeights(name=0, category=1, price=0, proximity=0)
+    assert ranked_ids(category_only, query="outerwear jacket")[-1] == 3
+
+    price_only = RankingWeights(name=0, category=0, price=1, proximity=0)
+    assert ranked_ids(price_only, price=50) == [4, 2, 3, 1]
+
+    near_only = RankingWeights(name=0, category=0, price=0, proximity=1)
+    assert ranked_ids(near_only, location=CHICAGO) == [1, 3, 2, 4]
+
+def test_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(3)
+    positions = np.arange(1000, dtype=np.int32)
+    scores = rng.integers(0, 50, 1000).astype(np.float64)
+
+    full = positions[np.lexsort((positions, -scores))]
+    keys = Ranker.rank_keys(scores)
+    assert len(np.unique(keys)) == len(keys)
+    assert Ranker.top_k(positions, keys, 25).tolist() == full[:25].tolist()
+
+def test_later_pages_continue_the_ranking():
+    results = RankedResults(IndexResults(index, jackets), ranker, RankingWeights(), query="jacket", location=CHICAGO)
+    first, second = results.page(0, 2), results.page(2, 2)
+    assert first + second == results.page(0, 4)
+    assert len(results.page(3, 10)) == 1
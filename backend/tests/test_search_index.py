@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+from catalog import SQLITE_DIALECT, LocalCatalog
+from query_plan import ProductFilter, compile_product_search
+from search_index import ProductIndex, tokenize
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+PRODUCTS = [
+    {"id": 1, "name": "Men's Winter Jacket Small", "department": "Men", "retail_price": 9.5, "distribution_center_id": 2},
+    {"id": 2, "name": "Women's Winter Jacket", "department": "Women", "retail_price": 8.5, "distribution_center_id": 2},
+    {"id": 3, "name": "Men's Chino Pants Medium", "department": "Men", "retail_price": 29.0, "distribution_center_id": 1},
+    {"id": 4, "name": "Women's Summer Dress", "department": "Women", "retail_price": 25.0, "distribution_center_id": 3},
+    {"id": 5, "name": "Ladies Rain Jackets", "department": "Men", "retail_price": 40.0, "distribution_center_id": 3},
+]
+
+index = ProductIndex(PRODUCTS, store_names={1: "Memphis TN", 2: "Chicago IL", 3: "Houston TX"})
+
+def ids(rows):
+    return [r["id"] for r in rows]
+
+def test_tokenize_folds_case_possessives_and_plurals():
+    assert tokenize("Men's JACKETS") == ["men", "jacket"]
+    assert tokenize("dress") == ["dress"]
+    assert tokenize(None) == []
+
+def test_whole_word_men_does_not_match_women():
+    assert list(index.lookup("men")) == [0, 2]
+    assert list(index.lookup("women")) == [1, 3]
+
+def test_category_matches_plurals():
+    assert ids(index.search(category="jacket")) == [1, 2, 5]
+
+def test_product_phrase_intersects_all_words():
+    assert ids(index.search(product="winter jacket")) == [1, 2]
+
+def test_size_matches_code_or_word():
+    assert ids(index.search(size="s")) == [1]
+    assert ids(index.search(size="m")) == [3]
+
+def test_department_exclusions_and_price():
+    assert ids(index.search(category="jacket", department="Men", exclude_department="Men")) == [1]
+    assert ids(index.search(department="Women", exclude_department="Women")) == [2, 4]
+    assert ids(index.search(category="jacket", price=9, price_op="under")) == [2]
+    assert ids(index.search(price=25, price_op="exact")) == [4]
+    assert ids(index.search(department=["Men", "Women"], limit=2)) == [1, 2]
+
+def test_rows_carry_store_name():
+    assert index.search(product="dress")[0]["distribution_name"] == "Houston TX"
+
+def test_store_ids_matching():
+    assert index.store_ids_matching(category="jacket") == [2, 3]
+
+def test_unindexable_filter_falls_back():
+    assert index.search(product="!!!") is None
+
+def test_store_page_keyset_breaks_price_ties_by_id():
+    tied = ProductIndex([
+        {"id": i, "name": f"Item {i}", "retail_price": price, "distribution_center_id": 1}
+        for i, price in [(7, 5.0), (3, 5.0), (9, 1.0), (4, 5.0), (8, None)]
+    ])
+
+    rows, key = tied.store_page(1, limit=2)
+    assert ids(rows) == [9, 3]
+    assert key == (5.0, 3)
+
+    rows, key = tied.store_page(1, after=key, limit=2)
+    assert ids(rows) == [4, 7]
+    assert key is None
+
+def test_scan_matches_sql_like_semantics():
+    local = LocalCatalog(DATA_DIR)
+    full = ProductIndex(asyncio.run(local.all_products()))
+
+    for f in [
+        ProductFilter.build(category="jacket", price=50, price_op="under"),
+        ProductFilter.build(product="men", department=["Women", "Men"]),
+        ProductFilter.build(size="s", department="Men", exclude_department="Men"),
+        ProductFilter.build(price=9.5, price_op="exact"),
+    ]:
+        rows = asyncio.run(local._run(compile_product_search(f, SQLITE_DIALECT, limit=1000)))
+        assert sorted(int(full.ids[i]) for i in full.scan(f)) == sorted(r["id"] for r in rows)
@@ -0,0 +1,39 @@
+import json
+
+from fastapi.encoders import jsonable_encoder
+
+from records import ProductRecord
+from serialization import dumps
+
+ROW = {
+    "id": 1002,
+    "name": "Carhartt Men's Duck Active Jacket",
+    "category": "Outerwear & Coats",
+    "brand": "Carhartt",
+    "department": "Men",
+    "retail_price": 49.99,
+    "sku": "SKU-1002",
+    "distribution_center_id": 2,
+    "distribution_name": "Memphis TN",
+}
+
+def test_product_record_reads_like_a_dict():
+    record = ProductRecord.from_row(ROW)
+
+    assert not hasattr(record, "__dict__")
+    assert record["name"] == ROW["name"]
+    assert record.get("missing") is None
+    assert dict(record) == ROW
+    assert record == ROW and ROW == record
+
+def test_dumps_matches_the_generic_encoder():
+    reply = {
+        "reply": "Here’s a comparison 👇",
+        "products": [ProductRecord.from_row(ROW), dict(ROW, retail_price=None)],
+        "stores": [{"categories": {None: 1, "Jeans": 2}}],
+    }
+    expected = json.loads(json.dumps(jsonable_encoder(reply), ensure_ascii=False))
+
+    raw = dumps(reply)
+    assert "Here’s".encode() in raw
+    assert json.loads(raw) == expected
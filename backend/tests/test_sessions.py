@@ -0,0 +1,84 @@
+import asyncio
+
+from sessions import MemorySessionStore, RedisSessionStore, new_state, valid_session_id
+
+class FakeRedis:
+    """The handful of async Redis commands the session store uses."""
+
+    def __init__(self):
+        self.strings = {}
+        self.zsets = {}
+
+    async def get(self, key):
+        return self.strings.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.strings[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.strings.pop(key, None)
+
+    async def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    async def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    async def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    async def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.get(key, {})
+        for member in [m for m, s in zset.items() if s <= high]:
+            del zset[member]
+
+    async def zpopmin(self, key, count):
+        zset = self.zsets.get(key, {})
+        popped = sorted(zset.items(), key=lambda item: item[1])[:count]
+        for member, _ in popped:
+            del zset[member]
+        return popped
+
+def test_session_id_validation():
+    assert valid_session_id("3f2b9c0e1a")
+    assert not valid_session_id(None)
+    assert not valid_session_id("short")
+    assert not valid_session_id("../../etc/passwd")
+
+def test_memory_store_expires_and_caps_sessions(clock):
+    store = MemorySessionStore(ttl=60, max_entries=2, clock=clock)
+
+    async def run():
+        state = await store.load("session-a")
+        state["last_search"]["filters"] = {"category": "jacket"}
+        await store.save("session-a", state)
+        assert (await store.load("session-a"))["last_search"]["filters"]["category"] == "jacket"
+
+        await store.save("session-b", new_state())
+        await store.save("session-c", new_state())
+        assert await store.load("session-a") == new_state()   # LRU evicted
+
+        clock.now += 61
+        assert await store.load("session-c") == new_state()   # expired
+
+    asyncio.run(run())
+
+def test_redis_store_round_trips_and_evicts_lru(clock):
+    redis = FakeRedis()
+    store = RedisSessionStore(redis, ttl=60, max_entries=2, clock=clock)
+
+    async def run():
+        state = new_state()
+        state["last_context"]["departments"] = ["Men", "Women"]
+        await store.save("session-a", state)
+        assert await store.load("session-a") == state
+
+        for session_id in ("session-b", "session-c"):
+            clock.now += 1
+            await store.save(session_id, new_state())
+
+        assert await store.load("session-a") == new_state()
+        assert (await store.stats())["entries"] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import asyncio
+
+from snapshot import CatalogSnapshot, SnapshotManager, build_store_summaries
+
+STORES = [
+    {"id": 1, "name": "Memphis TN", "latitude": 35.1, "longitude": -89.9},
+    {"id": 2, "name": "Chicago IL", "latitude": 41.8, "longitude": -87.6},
+    {"id": 3, "name": "Empty", "latitude": 29.7, "longitude": -95.3},
+]
+
+PRODUCTS = [
+    {"id": 9, "name": "Scarf", "category": "Accessories", "department": "Women", "retail_price": None, "distribution_center_id": 1},
+    {"id": 10, "name": "Jacket", "category": "Outerwear", "department": "Men", "retail_price": 50.0, "distribution_center_id": 1},
+    {"id": 11, "name": "Hoodie", "category": "Hoodies", "department": "Men", "retail_price": 20.0, "distribution_center_id": 1},
+    {"id": 12, "name": "Dress", "category": "Dresses", "department": "Women", "retail_price": 35.0, "distribution_center_id": 1},
+    {"id": 13, "name": "Cap", "category": "Accessories", "department": "Women", "retail_price": 9.0, "distribution_center_id": 2},
+]
+
+def test_store_summaries():
+    summaries = build_store_summaries(STORES, PRODUCTS)
+
+    memphis = summaries[1]
+    # Unpriced products count, like COUNT(p.id), but don't set the range
+    assert memphis.product_count == 4
+    assert memphis.cheapest_price == 20.0
+    assert memphis.most_expensive_price == 50.0
+    assert memphis.departments == {"Men": 2, "Women": 2}
+
+    assert summaries[3].product_count == 0
+    assert summaries[3].cheapest_price is None
+
+def test_min_prices_skip_empty_stores():
+    snapshot = CatalogSnapshot(STORES, PRODUCTS)
+    assert snapshot.min_prices() == {1: 20.0, 2: 9.0}
+
+class FakeCatalog:
+    def __init__(self):
+        self.loads = 0
+
+    async def distribution_centers(self):
+        return STORES
+
+    async def all_products(self):
+        self.loads += 1
+        return PRODUCTS[: self.loads + 1]
+
+def test_manager_loads_once_and_refreshes():
+    catalog = FakeCatalog()
+    refreshed = []
+    manager = SnapshotManager(catalog, on_refresh=refreshed.append)
+
+    async def main():
+        first = await manager.get()
+        assert await manager.get() is first
+        second = await manager.refresh()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert catalog.loads == 2
+    assert len(first.products) == 2
+    assert len(second.products) == 3
+    assert refreshed == [first, second]
+    assert manager.stats()["refreshes"] == 2
@@ -0,0 +1,54 @@
+import asyncio
+
+from users import UserProfiles
+
+class FakeCatalog:
+    def __init__(self):
+        self.users = {1: {"id": 1, "gender": "M"}, 2: {"id": 2, "gender": "F"}}
+        self.calls = []
+
+    async def get_user(self, user_id):
+        self.calls.append(("get_user", user_id))
+        return self.users.get(user_id)
+
+    async def get_users(self, user_ids):
+        self.calls.append(("get_users", list(user_ids)))
+        return [self.users[u] for u in user_ids if u in self.users]
+
+def test_profiles_are_cached_until_ttl(clock):
+    catalog = FakeCatalog()
+    profiles = UserProfiles(catalog, ttl=60, clock=clock)
+
+    assert asyncio.run(profiles.get(1))["gender"] == "M"
+    assert asyncio.run(profiles.get(1))["gender"] == "M"
+    assert catalog.calls == [("get_user", 1)]
+
+    clock.now += 61
+    asyncio.run(profiles.get(1))
+    assert len(catalog.calls) == 2
+
+def test_unknown_ids_are_negatively_cached(clock):
+    catalog = FakeCatalog()
+    profiles = UserProfiles(catalog, ttl=60, negative_ttl=5, clock=clock)
+
+    assert asyncio.run(profiles.get(999)) is None
+    assert asyncio.run(profiles.get(999)) is None
+    assert catalog.calls == [("get_user", 999)]
+
+    clock.now += 6
+    asyncio.run(profiles.get(999))
+    assert len(catalog.calls) == 2
+
+def test_prefetch_batches_missing_ids():
+    catalog = FakeCatalog()
+    profiles = UserProfiles(catalog)
+    asyncio.run(profiles.get(1))
+
+    found = asyncio.run(profiles.prefetch([1, 2, 3, 2]))
+
+    assert sorted(found) == [1, 2]
+    assert catalog.calls[-1] == ("get_users", [2, 3])
+
+    asyncio.run(profiles.get(2))
+    asyncio.run(profiles.get(3))
+    assert len(catalog.calls) == 2
@@ -0,0 +1,43 @@
+import numpy as np
+
+from vector_index import VectorIndex
+
+PRODUCTS = [
+    {"name": "Levi's Men's Denim Trucker Jacket", "brand": "Levi's", "category": "Outerwear & Coats", "department": "Men"},
+    {"name": "Carhartt Men's Duck Active Jacket", "brand": "Carhartt", "category": "Outerwear & Coats", "department": "Men"},
+    {"name": "Women's Summer Maxi Dress", "brand": "Calvin Klein", "category": "Dresses", "department": "Women"},
+    {"name": "Levi's Women's 711 Skinny Jeans", "brand": "Levi's", "category": "Jeans", "department": "Women"},
+    {"name": "Women's Denim Jacket", "brand": "Gap", "category": "Outerwear & Coats", "department": "Women"},
+]
+
+index = VectorIndex(PRODUCTS, block_rows=2)
+
+def positions(matches):
+    return [i for i, _ in matches]
+
+def test_matrix_is_contiguous_int8():
+    assert index.matrix.dtype == np.int8
+    assert index.matrix.flags.c_contiguous
+    assert index.matrix.shape == (5, index.dim)
+
+def test_free_text_tolerates_typos_and_batches():
+    denim, dress = index.search(["denim jackt", "summer dress"], k=2)
+    assert set(positions(denim)) == {0, 4}
+    assert positions(dress)[0] == 2
+
+def test_blocked_scores_match_a_plain_product():
+    queries = index.encode(["men's jacket"])
+    exact = index.vectors(range(5)) @ queries[0]
+    assert np.allclose(index.scores(queries)[:, 0], exact, atol=0.02)
+
+def test_similar_excludes_seeds_and_respects_mask():
+    assert 0 not in positions(index.similar([0], k=4))
+    assert positions(index.similar([0], k=1))[0] == 4
+
+    men_only = np.array([p["department"] == "Men" for p in PRODUCTS])
+    assert positions(index.similar([0], k=4, mask=men_only)) == [1]
+
+def test_dimension_is_configurable():
+    small = VectorIndex(PRODUCTS, dim=64)
+    assert small.matrix.shape == (5, 64)
+    assert positions(small.search(["denim jacket"], k=1)[0]) in ([0], [4])
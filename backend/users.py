@@ -0,0 +1,45 @@
+"""
+Cached user profiles.
+
+Every chat request names its shopper (X-User-Id header, USER_ID env as
+the default), so profiles are looked up per request through an LRU +
+TTL cache instead of one pinned global. Unknown ids are cached too, for
+a shorter time, so a bad id can't turn into a catalog query per message.
+Many ids can be warmed with one batched query.
+"""
+import time
+
+from cache import BatchedLoader
+
+
+class UserProfiles(BatchedLoader):
+    def __init__(
+        self,
+        catalog,
+        ttl: float = 600,
+        negative_ttl: float = 60,
+        max_entries: int = 10000,
+        clock=time.monotonic
+    ):
+        super().__init__(ttl, negative_ttl, max_entries, clock)
+        self.catalog = catalog
+        self.batches = 0
+
+    async def fetch(self, user_ids: list[int]) -> list[dict]:
+        if len(user_ids) == 1:
+            user = await self.catalog.get_user(user_ids[0])
+            return [user] if user else []
+
+        self.batches += 1
+        return await self.catalog.get_users(user_ids)
+
+    async def prefetch(self, user_ids) -> dict[int, dict]:
+        """Warm the cache for many ids with a single catalog query."""
+        return await self.get_many(user_ids)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "catalog_lookups": self.lookups,
+            "batched_lookups": self.batches,
+        }
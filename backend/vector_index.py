@@ -0,0 +1,174 @@
+"""
+Local text-vector index over the catalog.
+
+Every product (name, brand, category, department) becomes a TF-IDF
+vector over hashed features: the words plus the character trigrams of
+each word, so "jackt" still lands near "jacket". Vectors are L2
+normalized and stored int8-quantized, one row per product in a single
+contiguous matrix, with a float scale per row.
+
+A query (free text, or existing products for "show similar items") is
+encoded the same way. It is scored against the whole matrix with BLAS
+matrix products, a block of rows at a time dequantized into one reusable
+float32 buffer. Then the top k are picked by partial selection. Nothing
+leaves the process: no model download, no network, no GPU.
+"""
+import zlib
+
+import numpy as np
+
+from search_index import tokenize
+
+# Hashed feature buckets per vector (VECTOR_DIM). Fewer buckets means
+# more unrelated words sharing one; see bench_vector_index.py for recall
+DIM = 1024
+BLOCK_ROWS = 4096
+
+# Below this cosine a free-text match is noise
+MIN_SCORE = 0.15
+
+# Fields and how much each contributes; name carries trigrams as well
+FIELDS = [("name", 1.0), ("brand", 0.5), ("category", 0.5), ("department", 0.25)]
+
+
+def word_features(word: str, trigrams: bool) -> list[tuple[str, float]]:
+    """(feature, weight) of a word: the word itself, plus its trigrams."""
+    found = [("w:" + word, 1.0)]
+    if trigrams:
+        padded = f"#{word}#"
+        found += [("t:" + padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+    return found
+
+
+def hashed_word(word: str, trigrams: bool, dim: int) -> list[tuple[int, float]]:
+    """(bucket, signed weight) of a word's features."""
+    buckets = []
+    for feature, value in word_features(word, trigrams):
+        h = zlib.crc32(feature.encode("utf-8"))
+        buckets.append((h % dim, value if h & 0x80000000 else -value))
+    return buckets
+
+
+class VectorIndex:
+    def __init__(self, rows, dim: int = DIM, block_rows: int = BLOCK_ROWS):
+        self.dim = dim
+        self.block_rows = block_rows
+
+        self._words = {}
+
+        dense = np.zeros((len(rows), dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            for field, weight in FIELDS:
+                self._add(dense[i], row.get(field), weight, trigrams=field == "name", learn=True)
+
+        # Document frequency per hashed bucket -> smoothed idf
+        df = np.count_nonzero(dense, axis=0)
+        self.idf = (np.log((1 + len(rows)) / (1 + df)) + 1).astype(np.float32)
+        self.matrix, self.scales = self._quantize(dense * self.idf)
+        self._allocate()
+
+    def _allocate(self):
+        # Reused by every scores() call; the index is only used from the event loop
+        rows = min(self.block_rows, max(len(self.matrix), 1))
+        self._buffer = np.empty((rows, self.dim), dtype=np.float32)
+
+    def to_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        """The quantized matrix, row scales and idf, for storing in a snapshot file."""
+        return {"matrix": self.matrix, "scales": self.scales, "idf": self.idf}, {}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], meta: dict | None = None, block_rows: int = BLOCK_ROWS) -> "VectorIndex":
+        """A VectorIndex over to_arrays() output; the matrix is used in place."""
+        index = cls.__new__(cls)
+        index.matrix = arrays["matrix"]
+        index.scales = arrays["scales"]
+        index.idf = arrays["idf"]
+        index.dim = index.matrix.shape[1]
+        index.block_rows = block_rows
+        index._words = {}
+        index._allocate()
+        return index
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def _add(self, vector: np.ndarray, text: str | None, weight: float, trigrams: bool = True, learn: bool = False):
+        """Adds the hashed features of `text` into `vector`."""
+        for word in tokenize(text):
+            key = (word, trigrams)
+            buckets = self._words.get(key)
+            if buckets is None:
+                buckets = hashed_word(word, trigrams, self.dim)
+                # Catalog words only; query words would grow this forever
+                if learn:
+                    self._words[key] = buckets
+            for bucket, value in buckets:
+                vector[bucket] += weight * value
+
+    @staticmethod
+    def _quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """L2-normalize, then int8 per row; row ≈ int8 * scale."""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        peaks = np.abs(vectors).max(axis=1)
+        scales = np.where(peaks == 0, 1, peaks) / 127
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return np.ascontiguousarray(quantized), scales.astype(np.float32)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Unit-length float32 query vectors, one row per text."""
+        dense = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            self._add(dense[i], text, 1.0)
+        dense *= self.idf
+
+        norms = np.linalg.norm(dense, axis=1, keepdims=True)
+        return dense / np.where(norms == 0, 1, norms)
+
+    def vectors(self, positions) -> np.ndarray:
+        """Stored products as (dequantized) query vectors."""
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.matrix[positions].astype(np.float32) * self.scales[positions, None]
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine of every product against every query: shape (products, queries)."""
+        queries_t = np.ascontiguousarray(queries.T, dtype=np.float32)
+        out = np.empty((len(self.matrix), queries.shape[0]), dtype=np.float32)
+
+        for start in range(0, len(self.matrix), self.block_rows):
+            block = self.matrix[start:start + self.block_rows]
+            buffer = self._buffer[:len(block)]
+            np.copyto(buffer, block, casting="unsafe")
+            np.matmul(buffer, queries_t, out=out[start:start + len(block)])
+
+        out *= self.scales[:, None]
+        return out
+
+    @staticmethod
+    def top_k(scores: np.ndarray, k: int, min_score: float = -np.inf) -> list[tuple[int, float]]:
+        """Best k (position, score) of one score column, best first."""
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+
+        chosen = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        chosen = chosen[np.lexsort((chosen, -scores[chosen]))]
+        return [(int(i), float(scores[i])) for i in chosen if scores[i] > min_score]
+
+    def search(self, texts: list[str], k: int = 10, mask: np.ndarray | None = None) -> list[list[tuple[int, float]]]:
+        """Free-text queries, answered in one batch."""
+        scores = self.scores(self.encode(texts))
+        if mask is not None:
+            scores[~mask] = -np.inf
+        return [self.top_k(scores[:, j], k, MIN_SCORE) for j in range(len(texts))]
+
+    def similar(self, positions, k: int = 10, mask: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """Products closest to the centroid of `positions`, the seeds themselves excluded."""
+        centroid = self.vectors(positions).mean(axis=0, keepdims=True)
+        scores = self.scores(centroid)[:, 0]
+
+        if mask is not None:
+            scores[~mask] = -np.inf
+        scores[np.asarray(positions, dtype=np.int64)] = -np.inf
+        return self.top_k(scores, k, min_score=0.0)
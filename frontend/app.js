@@ -5,6 +5,13 @@ let isCheckingOut = false;
 let userLocation = null;
 let isBotTyping = false;
 
+// One chat session per tab; the backend keeps its context under this id
+const sessionId =
+  sessionStorage.getItem("sessionId") ||
+  (crypto.randomUUID ? crypto.randomUUID() : String(Date.now()) + Math.random().toString(16).slice(2));
+sessionStorage.setItem("sessionId", sessionId);
+const sessionHeaders = { "X-Session-Id": sessionId };
+
 const messages = document.getElementById("messages");
 const quickReplies = document.getElementById("quickReplies");
 const quickReplyActions = {
@@ -284,7 +291,8 @@ async function sendBackendCommand(command) {
   showTyping()
 
   const res = await fetch(
-    `http://localhost:8000/chat?message=${encodeURIComponent(command)}`
+    `http://localhost:8000/chat?message=${encodeURIComponent(command)}`,
+    { headers: sessionHeaders }
   )
 
   hideTyping()
@@ -312,22 +320,17 @@ async function send(textOverride) {
     hideTyping();
 
     const res = await fetch(
-      `http://localhost:8000/chat?message=${encodeURIComponent(text)}`
+      `http://localhost:8000/chat?message=${encodeURIComponent(text)}`,
+      { headers: sessionHeaders }
     );
 
     const data = await res.json();
 
     if (data.action === "show_cart") {
-      const cartRes = await fetch("http://localhost:8000/cart", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(cart)
-      });
-
-      const cartData = await cartRes.json();
-
-      if (cartData.reply) addMessage(cartData.reply, "bot");
-      renderCart(cartData.cart);
+      // The reply already carries the server cart, revalidated
+      cart = data.cart || [];
+      if (data.reply) addMessage(data.reply, "bot");
+      renderCart(cart);
 
       clearQuickReplies();
       return;
@@ -398,12 +401,33 @@ function renderComparison(products) {
 /* --------------------
    CART FLOW
 -------------------- */
-function addToCart(product) {
+async function updateCart(path, method, body) {
+  const res = await fetch(`http://localhost:8000${path}`, {
+    method,
+    headers: { "Content-Type": "application/json", ...sessionHeaders },
+    body: body ? JSON.stringify(body) : undefined
+  });
+
+  const data = await res.json();
+  if (!res.ok) throw new Error(data.detail || "Cart update failed");
+
+  cart = data.cart;
+  return data;
+}
+
+async function addToCart(product) {
   if (cart.find(p => p.id === product.id)) {
     addMessage(`${product.name} is already in your cart 🛒`, "system");
     return;
   }
-  cart.push(product);
+
+  try {
+    await updateCart("/cart/items", "POST", { product_id: product.id });
+  } catch (err) {
+    addMessage(`❌ ${err.message}`);
+    return;
+  }
+
   addMessage(
     `${product.name} added to cart. Would you like to checkout or keep shopping?`,
     "bot"
@@ -411,8 +435,14 @@ function addToCart(product) {
   renderQuickReplies(["Checkout", "Show more"]);
 }
 
-function removeFromCart(product) {
-  cart = cart.filter(p => p.id !== product.id);
+async function removeFromCart(product) {
+  try {
+    await updateCart(`/cart/items/${product.id}`, "DELETE");
+  } catch (err) {
+    addMessage(`❌ ${err.message}`);
+    return;
+  }
+
   addMessage(`❌ Removed ${product.name} from cart`);
   renderCart(cart);
 }
@@ -430,10 +460,19 @@ async function checkout() {
 
     const res = await fetch("http://localhost:8000/checkout", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ cart })
+      headers: sessionHeaders
     });
 
+    if (res.status === 409) {
+        // Prices moved since the cart was shown: show it again first
+        const changed = await res.json();
+        cart = changed.cart;
+        addMessage(changed.reply, "bot");
+        renderCart(cart);
+        renderQuickReplies(["Checkout", "Show more"]);
+        return;
+    }
+
     if (!res.ok) {
         const err = await res.json();
         throw new Error(err.detail || "Checkout failed");